@@ -0,0 +1,115 @@
+"""
+Slot arithmetic for doctor availability.
+
+A doctor's working hours ("08:00-17:00") are cut into fixed-length slots;
+both ends are bookable start times, matching the booking screen which
+offers 17:00 for the default hours.
+Occupancy for one doctor on one day is a single integer bitmap where bit i
+is set when slot i is booked, so "which slots are free" and "is this slot
+free" are bit operations on one document.
+"""
+
+from datetime import date, datetime
+from typing import List, Optional
+
+import numpy as np
+
+# Bit 63 is the sign bit of a BSON int64, so a day holds at most 63 slots
+MAX_SLOTS_PER_DAY = 63
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def parse_time(value: str) -> int:
+    """'HH:MM' -> minutes since midnight"""
+    try:
+        hours, minutes = value.strip().split(":")
+        hours, minutes = int(hours), int(minutes)
+    except (ValueError, AttributeError):
+        raise ValueError(f"Invalid time: {value}")
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f"Invalid time: {value}")
+    return hours * 60 + minutes
+
+def format_time(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def parse_hours(hours: str):
+    """'08:00-17:00' -> (start, end) in minutes since midnight"""
+    try:
+        start, end = hours.split("-")
+    except (ValueError, AttributeError):
+        raise ValueError(f"Invalid working hours: {hours}")
+    start, end = parse_time(start), parse_time(end)
+    if end <= start:
+        raise ValueError(f"Invalid working hours: {hours}")
+    return start, end
+
+def parse_day(value: str) -> date:
+    """Accept both the app's DD/MM/YYYY and ISO YYYY-MM-DD dates"""
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except (ValueError, AttributeError):
+            continue
+    raise ValueError(f"Invalid date: {value}")
+
+def normalize_days(days: Optional[List[str]]) -> List[str]:
+    """Validate weekday names ('Monday', 'mon', ...) into lowercase full names"""
+    normalized = []
+    for day in days or []:
+        matches = [name for name in WEEKDAYS if name.startswith(day.strip().lower()[:3])]
+        if len(day.strip()) < 3 or not matches:
+            raise ValueError(f"Invalid weekday: {day}")
+        if matches[0] not in normalized:
+            normalized.append(matches[0])
+    return normalized
+
+def works_on(available_days: Optional[List[str]], day: date) -> bool:
+    """An empty schedule means the doctor accepts bookings every day"""
+    if not available_days:
+        return True
+    return WEEKDAYS[day.weekday()] in normalize_days(available_days)
+
+def slot_count(hours: str, slot_minutes: int) -> int:
+    start, end = parse_hours(hours)
+    return min((end - start) // slot_minutes + 1, MAX_SLOTS_PER_DAY)
+
+def slot_times(hours: str, slot_minutes: int) -> List[str]:
+    """Start times of every slot within working hours"""
+    start, _ = parse_hours(hours)
+    return [
+        format_time(start + i * slot_minutes)
+        for i in range(slot_count(hours, slot_minutes))
+    ]
+
+def slot_index(hours: str, time_value: str, slot_minutes: int) -> int:
+    """Index of the slot starting at `time_value`; it must sit on a slot boundary"""
+    start, _ = parse_hours(hours)
+    offset = parse_time(time_value) - start
+    if offset < 0 or offset % slot_minutes:
+        raise ValueError(f"{time_value} is not a bookable slot")
+    index = offset // slot_minutes
+    if index >= slot_count(hours, slot_minutes):
+        raise ValueError(f"{time_value} is outside working hours")
+    return index
+
+def slot_mask(index: int) -> int:
+    return 1 << index
+
+def full_day_mask(count: int) -> int:
+    return (1 << count) - 1
+
+def earliest_free_slots(working: np.ndarray, occupied: np.ndarray, limit: int):
+    """Earliest `limit` free slots per doctor across a range of days in one pass.
+
+    `working` and `occupied` are (doctors, days) uint64 bitmaps. Returns
+    (doctor_rows, day_columns, slot_indexes), ordered by doctor then time.
+    """
+    free = working & ~occupied
+    doctors, days = free.shape
+    # (doctors, days, 64) booleans, bit i of each day at position i
+    bits = np.unpackbits(free.astype("<u8").view(np.uint8), bitorder="little")
+    bits = bits.reshape(doctors, days * 64).astype(bool)
+    rank = np.cumsum(bits, axis=1)
+    rows, columns = np.nonzero(bits & (rank <= limit))
+    return rows, columns // 64, columns % 64
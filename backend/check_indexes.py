@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Index verification for the clinic backend.
+
+Seeds a throwaway database on the configured MongoDB (DB_NAME + "_explain"),
+builds REQUIRED_INDEXES there and explains every route query shape, reporting
+shapes that fall back to a collection scan or an in-memory sort.
+
+Usage:
+    python check_indexes.py            # explain query shapes on a seeded scratch db
+    python check_indexes.py --verify   # only report indexes missing from DB_NAME
+"""
+
+import sys
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from server import client, db, ensure_indexes, explain_query_shapes
+
+SEED_SIZE = 200
+
+async def seed(database):
+    now = datetime.utcnow()
+    doctors = [
+        {
+            "_id": str(uuid.uuid4()),
+            "email": f"doctor{i}@clinic.vn",
+            "full_name": f"BS. {i}",
+            "role": "doctor",
+            "specialization": "Nội khoa" if i % 2 else "Nhi khoa",
+            "created_at": now - timedelta(minutes=i)
+        }
+        for i in range(SEED_SIZE)
+    ]
+    await database.users.insert_many(doctors)
+    appointments = [
+        {
+            "_id": str(uuid.uuid4()),
+            "patient_id": f"p{i % 20}",
+            "doctor_id": doctors[i % SEED_SIZE]["_id"],
+            "status": "pending",
+            "created_at": now - timedelta(minutes=i)
+        }
+        for i in range(SEED_SIZE)
+    ]
+    await database.appointments.insert_many(appointments)
+    await database.messages.insert_many([
+        {
+            "_id": str(uuid.uuid4()),
+            "appointment_id": appointments[i % 20]["_id"],
+            "timestamp": now - timedelta(seconds=i)
+        }
+        for i in range(SEED_SIZE)
+    ])
+    await database.payments.insert_many([
+        {
+            "_id": str(uuid.uuid4()),
+            "appointment_id": apt["_id"],
+            "status": "pending",
+            "expires_at": now + timedelta(minutes=i)
+        }
+        for i, apt in enumerate(appointments[:20])
+    ])
+    await database.conversations.insert_many([
+        {"_id": apt["_id"], "last_message": {"timestamp": now}, "message_count": 1}
+        for apt in appointments[:20]
+    ])
+    await database.doctor_schedules.insert_many([
+        {
+            "_id": f"{doctor['_id']}:{(now + timedelta(days=i % 7)).date().isoformat()}",
+            "doctor_id": doctor["_id"],
+            "date": (now + timedelta(days=i % 7)).date().isoformat(),
+            "occupied": 1
+        }
+        for i, doctor in enumerate(doctors)
+    ])
+    await database.payment_notifications.insert_many([
+        {"_id": f"vnpay:{i}", "status": "processed" if i % 4 else "queued",
+         "received_at": now - timedelta(seconds=i)}
+        for i in range(SEED_SIZE)
+    ])
+
+async def check_query_shapes():
+    scratch_name = f"{db.name}_explain"
+    scratch = client[scratch_name]
+    await client.drop_database(scratch_name)
+    try:
+        await seed(scratch)
+        await ensure_indexes(scratch, mode="create")
+        report = await explain_query_shapes(scratch)
+    finally:
+        await client.drop_database(scratch_name)
+
+    unsupported = [row for row in report if not row["supported"]]
+    for row in report:
+        symbol = "✅" if row["supported"] else "❌"
+        print(f"{symbol} {row['route']} [{row['collection']}]: {' > '.join(row['stages'])}")
+    return not unsupported
+
+async def verify_indexes():
+    missing = await ensure_indexes(mode="verify")
+    for collection, names in missing.items():
+        print(f"❌ {collection}: missing or mismatched {', '.join(names)}")
+    if not missing:
+        print("✅ All required indexes present")
+    return not missing
+
+if __name__ == "__main__":
+    check = verify_indexes if "--verify" in sys.argv[1:] else check_query_shapes
+    ok = asyncio.run(check())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,188 @@
+"""
+Negotiated response compression.
+
+CompressionMiddleware picks the first of its encodings that the request's
+Accept-Encoding allows (q=0 refuses an encoding):
+
+    br      brotli at `brotli_quality` (needs the `brotli` package; skipped
+            when it is not installed)
+    gzip    zlib at `gzip_level`
+
+Only compressible media types (JSON, text, SVG) are touched, and bodies
+smaller than `minimum_size` are sent as they are. A response sent in one
+piece is compressed in one call and keeps a Content-Length. A streamed
+response (more_body) is compressed chunk by chunk, flushing after each
+chunk, so the client gets data as it is produced and nothing is buffered;
+its Content-Length is dropped.
+
+Compressed responses carry Vary: Accept-Encoding and a weak ETag, since the
+bytes differ from the identity representation the ETag was computed on.
+"""
+
+import zlib
+from typing import Iterable, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/javascript", "application/xml",
+    "image/svg+xml", "text/",
+)
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+class BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding as {coding: q}"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+def negotiate(header: str, encodings: Iterable[str]) -> Optional[str]:
+    """First of `encodings` (server preference order) the client accepts"""
+    accepted = accepted_encodings(header)
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+def compressible(headers: dict) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    """ASGI middleware compressing HTTP responses with br or gzip"""
+
+    def __init__(self, app, minimum_size: int = 1024, encodings: Iterable[str] = ("br", "gzip"),
+                 gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = [
+            encoding for encoding in encodings
+            if encoding == "gzip" or (encoding == "br" and brotli is not None)
+        ]
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def encoder(self, encoding: str):
+        if encoding == "br":
+            return BrotliEncoder(self.brotli_quality)
+        return GzipEncoder(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        request_headers = {
+            name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]
+        }
+        encoding = negotiate(request_headers.get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder = None
+
+        async def send_compressed(message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                # Held back until the first body message shows the size
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is None:
+                if encoder is None:
+                    await send(message)
+                elif more_body:
+                    await send({"type": "http.response.body", "body": encoder.chunk(body),
+                                "more_body": True})
+                else:
+                    await send({"type": "http.response.body", "body": encoder.finish(body)})
+                return
+
+            response_start, start = start, None
+            headers = {
+                name.decode("latin-1").lower(): value.decode("latin-1")
+                for name, value in response_start["headers"]
+            }
+            declared = headers.get("content-length", "")
+            # Streamed bodies without a Content-Length are assumed to be large
+            size = int(declared) if declared.isdigit() else (None if more_body else len(body))
+            if (response_start["status"] in (204, 304) or not compressible(headers)
+                    or (size is not None and size < self.minimum_size)):
+                await send(response_start)
+                await send(message)
+                return
+
+            encoder = self.encoder(encoding)
+            if more_body:
+                await send(self.compressed_start(response_start, encoding))
+                await send({"type": "http.response.body", "body": encoder.chunk(body),
+                            "more_body": True})
+            else:
+                compressed = encoder.finish(body)
+                await send(self.compressed_start(response_start, encoding, len(compressed)))
+                await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    def compressed_start(self, message: dict, encoding: str, length: Optional[int] = None) -> dict:
+        headers = []
+        vary = None
+        for name, value in message["headers"]:
+            lowered = name.lower()
+            if lowered == b"content-length":
+                continue
+            if lowered == b"vary":
+                vary = value
+                continue
+            if lowered == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            headers.append((name, value))
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode("latin-1")))
+        return {**message, "headers": headers}
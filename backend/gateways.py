@@ -0,0 +1,124 @@
+"""
+Payment gateway notification (IPN) signing and parsing.
+
+Each gateway signs its callback differently; this module verifies the
+signature and normalizes the callback into a GatewayNotification:
+
+    vnpay    query params, HMAC-SHA512 over the sorted, url-encoded vnp_* params
+    momo     JSON body, HMAC-SHA256 over the sorted "key=value&..." fields
+    zalopay  JSON body {"data": <json string>, "mac": HMAC-SHA256(data)}
+
+Each notification carries a notification_id that is equal for retries of
+one callback and distinct for different callbacks. Gateway transaction
+numbers alone are not enough: VNPay sends vnp_TransactionNo "0" for every
+failed or cancelled attempt.
+"""
+
+import hashlib
+import hmac
+import json
+from typing import NamedTuple, Optional
+from urllib.parse import quote_plus
+
+class GatewayError(ValueError):
+    """Raised for callbacks that are malformed or fail signature verification"""
+
+class GatewayNotification(NamedTuple):
+    gateway: str
+    transaction_id: str
+    payment_id: str
+    amount: float
+    success: bool
+    notification_id: str
+
+# Fields MoMo signs over, in signing order
+MOMO_SIGNED_FIELDS = [
+    "accessKey", "amount", "extraData", "message", "orderId", "orderInfo",
+    "orderType", "partnerCode", "payType", "requestId", "responseTime",
+    "resultCode", "transId",
+]
+
+def _hmac(secret: str, message: str, digest) -> str:
+    return hmac.new(secret.encode(), message.encode(), digest).hexdigest()
+
+def vnpay_signature(params: dict, secret: str) -> str:
+    signed = sorted(
+        (k, v) for k, v in params.items()
+        if k.startswith("vnp_") and k not in ("vnp_SecureHash", "vnp_SecureHashType")
+    )
+    message = "&".join(f"{k}={quote_plus(str(v))}" for k, v in signed)
+    return _hmac(secret, message, hashlib.sha512)
+
+def momo_signature(params: dict, secret: str) -> str:
+    message = "&".join(f"{k}={params.get(k, '')}" for k in MOMO_SIGNED_FIELDS)
+    return _hmac(secret, message, hashlib.sha256)
+
+def zalopay_signature(data: str, secret: str) -> str:
+    return _hmac(secret, data, hashlib.sha256)
+
+def sign(gateway: str, params: dict, secret: str) -> dict:
+    """Return the callback payload a gateway would send for `params` (used by the simulator)"""
+    if gateway == "vnpay":
+        return {**params, "vnp_SecureHash": vnpay_signature(params, secret)}
+    if gateway == "momo":
+        return {**params, "signature": momo_signature(params, secret)}
+    if gateway == "zalopay":
+        data = json.dumps(params, separators=(",", ":"))
+        return {"data": data, "mac": zalopay_signature(data, secret), "type": 1}
+    raise GatewayError(f"Unsupported gateway: {gateway}")
+
+def parse_notification(gateway: str, payload: dict, secret: Optional[str]) -> GatewayNotification:
+    """Verify a callback's signature and normalize it"""
+    if not secret:
+        raise GatewayError(f"No secret configured for {gateway}")
+    try:
+        if gateway == "vnpay":
+            expected = vnpay_signature(payload, secret)
+            signature = payload.get("vnp_SecureHash", "")
+            fields = {
+                "transaction_id": payload["vnp_TransactionNo"],
+                "payment_id": payload["vnp_TxnRef"],
+                # VNPay sends amounts multiplied by 100
+                "amount": int(payload["vnp_Amount"]) / 100,
+                "success": payload.get("vnp_ResponseCode") == "00"
+                and payload.get("vnp_TransactionStatus", "00") == "00",
+                "notification_id": ":".join([
+                    payload["vnp_TxnRef"], payload["vnp_TransactionNo"],
+                    payload.get("vnp_ResponseCode", ""),
+                    # Failed attempts all have TransactionNo "0"; PayDate tells them apart
+                    payload.get("vnp_PayDate", "") if payload["vnp_TransactionNo"] == "0" else "",
+                ]).rstrip(":"),
+            }
+        elif gateway == "momo":
+            expected = momo_signature(payload, secret)
+            signature = payload.get("signature", "")
+            fields = {
+                "transaction_id": str(payload["transId"]),
+                "payment_id": payload["orderId"],
+                "amount": float(payload["amount"]),
+                "success": int(payload["resultCode"]) == 0,
+                "notification_id": f"{payload['orderId']}:{payload['requestId']}:"
+                                   f"{payload['transId']}:{payload['resultCode']}",
+            }
+        elif gateway == "zalopay":
+            expected = zalopay_signature(payload.get("data", ""), secret)
+            signature = payload.get("mac", "")
+            data = json.loads(payload["data"])
+            fields = {
+                "transaction_id": str(data["zp_trans_id"]),
+                "payment_id": data["app_trans_id"],
+                "amount": float(data["amount"]),
+                # ZaloPay only calls back for successful payments
+                "success": True,
+                "notification_id": f"{data['app_trans_id']}:{data['zp_trans_id']}",
+            }
+        else:
+            raise GatewayError(f"Unsupported gateway: {gateway}")
+    except (KeyError, TypeError, ValueError) as e:
+        if isinstance(e, GatewayError):
+            raise
+        raise GatewayError(f"Malformed {gateway} callback: {e}")
+
+    if not hmac.compare_digest(expected, str(signature).lower()):
+        raise GatewayError("Invalid signature")
+    return GatewayNotification(gateway=gateway, **fields)
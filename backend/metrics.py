@@ -0,0 +1,203 @@
+"""
+Prometheus metrics for the clinic backend.
+
+Served in the text exposition format at GET /api/metrics. Values are per
+worker process, so scrape every worker (or run one per pod):
+
+    http_request_duration_seconds     latency per api_router route template, method and status
+    mongodb_command_duration_seconds  every command the Motor client sends, by command and collection
+    mongodb_pool_*                    pool size, checked-out and waiting connections per server
+    socketio_connected_clients        live sockets per namespace, read at scrape time
+    socketio_rooms                    named rooms (excluding per-socket rooms) per namespace
+    socketio_emits_total              server emits by event; rate() gives emits per second
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import socketio
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "API request latency",
+    ["method", "route", "status"], buckets=REQUEST_BUCKETS
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round-trip time",
+    ["command", "collection", "outcome"], buckets=COMMAND_BUCKETS
+)
+MONGO_POOL_MAX = Gauge("mongodb_pool_max_size", "Configured maxPoolSize", ["address"])
+MONGO_POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Open pooled connections", ["address"])
+MONGO_POOL_IN_USE = Gauge("mongodb_pool_connections_in_use", "Checked-out connections", ["address"])
+MONGO_POOL_WAITING = Gauge("mongodb_pool_checkouts_waiting", "Operations waiting for a connection", ["address"])
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection checkouts", ["address", "reason"]
+)
+SOCKETIO_EMITS = Counter("socketio_emits_total", "Socket.IO server emits", ["event"])
+
+# ASGI scope of the request being handled; Motor copies the context into its
+# executor threads, so command listeners can see which route issued a command
+current_request = ContextVar("current_request", default=None)
+
+def current_route() -> Optional[str]:
+    """'METHOD /route/{template}' of the request in progress, None outside requests"""
+    scope = current_request.get()
+    if scope is None:
+        return None
+    return f"{scope['method']} {getattr(scope.get('route'), 'path', scope['path'])}"
+
+def _address(address) -> str:
+    host, port = address
+    return f"{host}:{port}"
+
+def command_collection(command_name: str, command: dict) -> str:
+    """Collection a command targets ('' for database or admin commands)"""
+    target = command.get(command_name)
+    if isinstance(target, str):
+        return target
+    # getMore carries the cursor id under its name and the collection separately
+    return command.get("collection", "") if command_name == "getMore" else ""
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command; pymongo calls this from Motor's executor threads"""
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        self._started[(event.connection_id, event.request_id)] = (
+            event.command_name, command_collection(event.command_name, event.command)
+        )
+
+    def _finish(self, event, outcome: str):
+        command_name, collection = self._started.pop(
+            (event.connection_id, event.request_id), (event.command_name, "")
+        )
+        MONGO_COMMAND_LATENCY.labels(command_name, collection, outcome).observe(
+            event.duration_micros / 1e6
+        )
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Tracks pool size and utilization per server"""
+
+    def pool_created(self, event):
+        MONGO_POOL_MAX.labels(_address(event.address)).set(event.options.get("maxPoolSize", 100))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = _address(event.address)
+        for gauge in (MONGO_POOL_CONNECTIONS, MONGO_POOL_IN_USE, MONGO_POOL_WAITING):
+            gauge.labels(address).set(0)
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.labels(_address(event.address)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(_address(event.address)).dec()
+
+    def connection_check_out_started(self, event):
+        MONGO_POOL_WAITING.labels(_address(event.address)).inc()
+
+    def connection_check_out_failed(self, event):
+        address = _address(event.address)
+        MONGO_POOL_WAITING.labels(address).dec()
+        MONGO_POOL_CHECKOUT_FAILURES.labels(address, event.reason).inc()
+
+    def connection_checked_out(self, event):
+        address = _address(event.address)
+        MONGO_POOL_WAITING.labels(address).dec()
+        MONGO_POOL_IN_USE.labels(address).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_IN_USE.labels(_address(event.address)).dec()
+
+def mongo_listeners() -> list:
+    return [MongoCommandListener(), MongoPoolListener()]
+
+class InstrumentedAsyncServer(socketio.AsyncServer):
+    """AsyncServer that counts emits and reports live clients and rooms"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        REGISTRY.register(SocketIOCollector(self))
+
+    async def emit(self, event, *args, **kwargs):
+        SOCKETIO_EMITS.labels(event).inc()
+        return await super().emit(event, *args, **kwargs)
+
+class SocketIOCollector:
+    def __init__(self, server: socketio.AsyncServer):
+        self.server = server
+
+    def collect(self):
+        clients = GaugeMetricFamily(
+            "socketio_connected_clients", "Connected Socket.IO clients", labels=["namespace"]
+        )
+        rooms = GaugeMetricFamily(
+            "socketio_rooms", "Named Socket.IO rooms with members", labels=["namespace"]
+        )
+        # rooms[namespace][room][sid]; room None holds every socket, and each
+        # socket also sits in a room named after its sid
+        for namespace, namespace_rooms in list(self.server.manager.rooms.items()):
+            sids = namespace_rooms.get(None, {})
+            clients.add_metric([namespace], len(sids))
+            rooms.add_metric([namespace], sum(
+                1 for room in list(namespace_rooms) if room is not None and room not in sids
+            ))
+        yield clients
+        yield rooms
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing requests under `prefix` by their route template"""
+
+    def __init__(self, app, prefix: str = "/api"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        token = current_request.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            # The router stores the matched route in the shared scope; unmatched
+            # paths share one label so 404 scans cannot explode cardinality
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
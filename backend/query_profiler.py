@@ -0,0 +1,173 @@
+"""
+Slow MongoDB command capture.
+
+Enabled by setting SLOW_QUERY_MS. Every command slower than the threshold
+is recorded in a bounded ring buffer with:
+
+    route      'METHOD /api/...' template of the request that issued it
+               (None for background workers and Socket.IO handlers)
+    shape      the filter / pipeline with every literal replaced by '?'
+    plan       explain (queryPlanner) stages, e.g. ['FETCH', 'IXSCAN'] or ['COLLSCAN']
+
+Explains run on the event loop after the slow command completes, once per
+(collection, command, shape), so a hot slow query costs one explain.
+"""
+
+import asyncio
+import json
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Optional
+
+from pymongo import monitoring
+
+# Commands that can be explained, and where each keeps its filter
+EXPLAINABLE = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "update": "updates",
+    "delete": "deletes",
+}
+RECORDED = set(EXPLAINABLE) | {"insert", "getMore"}
+# Session and transport fields the driver adds, which explain rejects
+DRIVER_FIELDS = {
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber",
+    "readConcern", "writeConcern", "signature", "cursor",
+}
+
+# Pipeline options whose string values name collections or fields, not data
+STRUCTURAL_KEYS = {"from", "as", "localField", "foreignField", "path", "coll"}
+
+def query_shape(value):
+    """Strip literal values, keeping field names, operators and $field paths"""
+    if isinstance(value, dict):
+        return {
+            key: item if key in STRUCTURAL_KEYS and isinstance(item, str) else query_shape(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, str) and value.startswith("$"):
+        return value
+    if isinstance(value, (list, tuple)):
+        # [a, b, c] of one shape collapses to one element, so $in lists of any length match
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def command_shape(command_name: str, command: dict):
+    target = command.get(EXPLAINABLE[command_name])
+    if command_name in ("update", "delete"):
+        # Bulk writes: the filter of each statement
+        return query_shape([statement.get("q") for statement in target or []])
+    shape = query_shape(target)
+    if command_name == "find" and command.get("sort"):
+        shape = {"filter": shape, "sort": dict(command["sort"])}
+    return shape
+
+def explainable_command(command_name: str, command: dict) -> dict:
+    """The original command without driver fields; bulk writes keep their first statement"""
+    explain = {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+    if command_name == "aggregate":
+        explain["cursor"] = {}
+    if command_name in ("update", "delete"):
+        statements = EXPLAINABLE[command_name]
+        explain[statements] = list(explain.get(statements, []))[:1]
+    return explain
+
+class SlowQueryProfiler(monitoring.CommandListener):
+    """Command listener keeping the slowest recent commands and their plans"""
+
+    def __init__(self, threshold_ms: float, size: int, route: Callable[[], Optional[str]]):
+        self.threshold_ms = threshold_ms
+        self.entries = deque(maxlen=size)
+        self._route = route
+        self._started = {}
+        self._plans = OrderedDict()
+        self._plan_cache_size = size
+        self._lock = threading.Lock()
+        self._loop = None
+        self._explain = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop, explain):
+        """Start capturing plans; `explain(database, command)` is a coroutine returning stages"""
+        self._loop = loop
+        self._explain = explain
+
+    def started(self, event):
+        if event.command_name in RECORDED:
+            self._started[(event.connection_id, event.request_id)] = (
+                self._route(), event.database_name, event.command
+            )
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+    def _finish(self, event, outcome: str):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if started is None or duration_ms < self.threshold_ms:
+            return
+        route, database, command = started
+        command_name = event.command_name
+        collection = command.get(command_name)
+        if command_name == "getMore":
+            collection = command.get("collection")
+        entry = {
+            "timestamp": datetime.utcnow(),
+            "route": route,
+            "database": database,
+            "collection": collection,
+            "command": command_name,
+            "duration_ms": round(duration_ms, 2),
+            "outcome": outcome,
+            "shape": command_shape(command_name, command) if command_name in EXPLAINABLE else None,
+            "plan": None,
+        }
+        self.entries.append(entry)
+        if entry["shape"] is None or self._loop is None:
+            return
+
+        key = (database, collection, command_name, json.dumps(entry["shape"], sort_keys=True))
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                # Placeholder so concurrent slow calls of one shape explain once
+                plan = self._plans[key] = {"stages": None}
+                while len(self._plans) > self._plan_cache_size:
+                    self._plans.popitem(last=False)
+                explain = explainable_command(command_name, command)
+                self._loop.call_soon_threadsafe(
+                    self._loop.create_task, self._run_explain(database, explain, plan)
+                )
+        entry["plan"] = plan
+
+    async def _run_explain(self, database: str, command: dict, plan: dict):
+        try:
+            stages = await self._explain(database, command)
+            plan.update({
+                "stages": stages,
+                "collscan": "COLLSCAN" in stages,
+                "in_memory_sort": "SORT" in stages,
+            })
+        except Exception as e:
+            plan["error"] = str(e)
+
+    def snapshot(self, limit: Optional[int] = None) -> list:
+        """Recorded commands, newest first"""
+        entries = list(self.entries)[::-1]
+        return entries[:limit] if limit else entries
+
+    def clear(self):
+        self.entries.clear()
+        with self._lock:
+            self._plans.clear()
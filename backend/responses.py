@@ -0,0 +1,45 @@
+"""
+JSON rendering for API responses.
+
+JSON_RESPONSE selects the app's default response class:
+
+    orjson  OrjsonResponse; datetimes and dates in ISO 8601 as jsonable_encoder
+            writes them, ObjectId as its hex string, numpy scalars and arrays
+    json    starlette's JSONResponse (stdlib json), the previous behaviour
+
+Rendering is only half the cost: FastAPI still runs jsonable_encoder over
+whatever a route returns unless the route declares a response_model, in
+which case pydantic-core validates and serializes it. List endpoints
+therefore declare typed response models.
+"""
+
+import orjson
+from bson import ObjectId
+from starlette.responses import JSONResponse
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def default(value):
+    """Types orjson does not serialize natively"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=default, option=OPTIONS)
+
+class OrjsonResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+RESPONSE_CLASSES = {
+    "orjson": OrjsonResponse,
+    "json": JSONResponse,
+}
+
+def response_class(name: str):
+    if name not in RESPONSE_CLASSES:
+        raise ValueError(f"Unsupported JSON_RESPONSE: {name}")
+    return RESPONSE_CLASSES[name]
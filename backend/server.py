@@ -1,42 +1,153 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import copy
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
+from zoneinfo import ZoneInfo
 import jwt
 from passlib.context import CryptContext
 from bson import ObjectId
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import time
 import socketio
+import numpy as np
+import qrcode
+import qrcode.image.svg
+
+import availability
+import compression
+import gateways
+import metrics
+import query_profiler
+import responses
+from socket_manager import create_client_manager
+from storage import InvalidatingRepository, conversations_pipeline, create_storage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Slow query profiler (debug): record commands slower than SLOW_QUERY_MS
+SLOW_QUERY_MS = os.environ.get("SLOW_QUERY_MS")
+SLOW_QUERY_BUFFER = int(os.environ.get("SLOW_QUERY_BUFFER", 200))
+slow_queries = query_profiler.SlowQueryProfiler(
+    float(SLOW_QUERY_MS), SLOW_QUERY_BUFFER, metrics.current_route
+) if SLOW_QUERY_MS else None
+
+# Storage engine behind the handlers: mongo, or memory for handler tests
+# and benchmarks without a server (see storage.py)
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "mongo")
+
+# MongoDB connection (the client connects lazily, so the memory engine never uses it)
+mongo_url = (
+    os.environ['MONGO_URL'] if STORAGE_ENGINE == "mongo"
+    else os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+)
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=metrics.mongo_listeners() + ([slow_queries] if slow_queries else [])
+)
 db = client[os.environ.get('DB_NAME', 'clinic_db')]
 
+# Index bootstrap at startup: create, verify (report missing, never build), off
+INDEX_MODE = os.environ.get("INDEX_MODE", "create")
+
+# Payment lifecycle worker
+PAYMENT_SWEEP_INTERVAL = float(os.environ.get("PAYMENT_SWEEP_INTERVAL", 30))
+PAYMENT_SWEEP_BATCH = int(os.environ.get("PAYMENT_SWEEP_BATCH", 500))
+PAYMENT_EXPIRED_TTL_DAYS = os.environ.get("PAYMENT_EXPIRED_TTL_DAYS")  # unset keeps expired payments
+
+# Payment gateway notifications (IPN)
+GATEWAY_SECRETS = {
+    "vnpay": os.environ.get("VNPAY_HASH_SECRET"),
+    "momo": os.environ.get("MOMO_SECRET_KEY"),
+    "zalopay": os.environ.get("ZALOPAY_KEY2"),
+}
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 10000))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 500))
+WEBHOOK_BATCH_WAIT = float(os.environ.get("WEBHOOK_BATCH_WAIT", 0.05))  # seconds
+# Notifications still queued this long (seconds) are re-enqueued by one worker
+WEBHOOK_REQUEUE_AFTER = float(os.environ.get("WEBHOOK_REQUEUE_AFTER", 60))
+
+# Rendered payment QR images (per worker)
+QR_CACHE_SIZE = int(os.environ.get("QR_CACHE_SIZE", 2000))
+QR_BOX_SIZE = int(os.environ.get("QR_BOX_SIZE", 8))
+
+# Doctor directory and specializations responses (per worker); other workers
+# pick up a new or changed doctor after at most DIRECTORY_CACHE_TTL seconds
+DIRECTORY_CACHE_SIZE = int(os.environ.get("DIRECTORY_CACHE_SIZE", 2000))
+DIRECTORY_CACHE_TTL = float(os.environ.get("DIRECTORY_CACHE_TTL", 60))
+
+# Idempotency-Key replay for create endpoints
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 30))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10000))
+
+# Default response rendering: orjson, or json for the stdlib encoder (see responses.py)
+JSON_RESPONSE = os.environ.get("JSON_RESPONSE", "orjson")
+
+# Response compression (see compression.py); empty COMPRESSION_ENCODINGS disables it
+COMPRESSION_ENCODINGS = [
+    encoding.strip() for encoding in os.environ.get("COMPRESSION_ENCODINGS", "br,gzip").split(",")
+    if encoding.strip()
+]
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))  # bytes
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
+
+# Bearer token required by GET /api/metrics when set
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Appointment slots
+SLOT_MINUTES = int(os.environ.get("APPOINTMENT_SLOT_MINUTES", 30))
+DEFAULT_AVAILABLE_HOURS = "08:00-17:00"
+# Appointment dates and times (and starts_at) are wall-clock times here
+CLINIC_TIMEZONE = ZoneInfo(os.environ.get("CLINIC_TIMEZONE", "Asia/Ho_Chi_Minh"))
+
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 
-# Socket.IO setup for real-time chat
-sio = socketio.AsyncServer(
+# Password hashing pool (bcrypt is CPU bound and must not run on the event loop)
+HASH_POOL_KIND = os.environ.get("HASH_POOL_KIND", "thread")  # thread, process
+HASH_POOL_WORKERS = int(os.environ.get("HASH_POOL_WORKERS", os.cpu_count() or 2))
+HASH_POOL_MAX_QUEUE = int(os.environ.get("HASH_POOL_MAX_QUEUE", 64))
+
+# Principal cache (authenticated user documents, keyed by user id)
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 60))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 10000))
+
+# Socket.IO setup for real-time chat; set SOCKETIO_MESSAGE_QUEUE to fan out
+# across uvicorn workers (see socket_manager.py)
+sio = metrics.InstrumentedAsyncServer(
     async_mode='asgi',
-    cors_allowed_origins='*'
+    cors_allowed_origins='*',
+    client_manager=create_client_manager(
+        os.environ.get("SOCKETIO_MESSAGE_QUEUE"), mongo_url, db.name
+    )
 )
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=responses.response_class(JSON_RESPONSE))
 api_router = APIRouter(prefix="/api")
 
 # Wrap FastAPI app with Socket.IO
@@ -59,6 +170,8 @@ class UserRegister(BaseModel):
     address: Optional[str] = None
     id_card: Optional[str] = None
     specialization: Optional[str] = None  # For doctors
+    available_days: Optional[List[str]] = None  # For doctors, e.g. ["monday", "friday"]
+    available_hours: Optional[str] = None  # For doctors, e.g. "08:00-17:00"
     medical_history: Optional[str] = None  # For patients
 
 class UserLogin(BaseModel):
@@ -85,7 +198,7 @@ class Doctor(BaseModel):
     phone: str
     specialization: str
     available_days: List[str] = []
-    available_hours: str = "08:00-17:00"
+    available_hours: str = DEFAULT_AVAILABLE_HOURS
 
 class Appointment(BaseModel):
     id: str
@@ -100,6 +213,7 @@ class Appointment(BaseModel):
     payment_status: str = "unpaid"  # unpaid, paid
     amount: float
     notes: Optional[str] = None
+    version: int = 1  # incremented on every write, used for optimistic concurrency
     created_at: datetime
 
 class AppointmentCreate(BaseModel):
@@ -113,6 +227,17 @@ class AppointmentUpdate(BaseModel):
     appointment_time: Optional[str] = None
     status: Optional[str] = None
     notes: Optional[str] = None
+    version: Optional[int] = None  # expected current version, 409 on mismatch
+
+# Allowed appointment status transitions: target status -> source statuses
+APPOINTMENT_TRANSITIONS = {
+    "pending": ["pending"],
+    "confirmed": ["pending", "confirmed"],
+    "completed": ["confirmed", "completed"],
+    "cancelled": ["pending", "confirmed"],
+}
+# Statuses that hold a slot and may move to another one
+RESCHEDULABLE_STATUSES = ["pending", "confirmed"]
 
 class Message(BaseModel):
     id: str
@@ -132,6 +257,71 @@ class PaymentRequest(BaseModel):
     amount: float
     gateway: str  # vnpay, momo, zalopay
 
+# Response models of the list endpoints; pydantic-core serializes these
+# instead of jsonable_encoder walking every item
+
+class AppointmentListItem(BaseModel):
+    id: str
+    patient_name: str
+    doctor_name: str
+    appointment_date: str
+    appointment_time: str
+    specialization: str
+    status: str
+    payment_status: str
+    amount: float
+    notes: Optional[str] = None
+    version: int = 0
+    cursor: str
+
+class ScheduleEntry(BaseModel):
+    id: str
+    patient_name: str
+    doctor_id: str
+    doctor_name: str
+    specialization: str
+    starts_at: str
+    duration_minutes: int
+    appointment_date: str
+    appointment_time: str
+    status: str
+    payment_status: str
+
+class AvailableSlot(BaseModel):
+    date: str
+    time: str
+
+class DoctorAvailability(BaseModel):
+    doctor_id: str
+    full_name: str
+    specialization: str
+    slots: List[AvailableSlot]
+
+class ChatLastMessage(BaseModel):
+    message: str
+    timestamp: str
+    sender_name: str
+
+class ChatListItem(BaseModel):
+    id: str
+    appointment_id: str
+    patient_name: str
+    doctor_name: str
+    specialization: str
+    appointment_date: str
+    appointment_time: str
+    status: str
+    last_message: Optional[ChatLastMessage] = None
+    unread_count: int = 0
+
+class MessageListItem(BaseModel):
+    id: str
+    sender_name: str
+    sender_role: str
+    message: str
+    timestamp: str
+    cursor: str
+
 # ==================== HELPER FUNCTIONS ====================
 
 def hash_password(password: str) -> str:
@@ -140,6 +330,126 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+class PasswordHasher:
+    """Runs bcrypt hash/verify in a worker pool with a bounded backlog.
+
+    Jobs beyond `workers + max_queue` are rejected with a 503 instead of
+    queueing without limit, so a login burst cannot pile up unbounded work.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = 2, max_queue: int = 64):
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def run(self, func, *args):
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"}
+            )
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher(HASH_POOL_KIND, HASH_POOL_WORKERS, HASH_POOL_MAX_QUEUE)
+
+class LRUCache:
+    """Size-bounded LRU cache with per-entry TTL and hit/miss counters"""
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+principal_cache = LRUCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+def invalidate_user(user_id: Optional[str]):
+    """Drop a cached principal, or all of them for None.
+
+    storage.users calls this after every write (see InvalidatingRepository),
+    so role, profile and deletion changes take effect on the next request.
+    """
+    if user_id is None:
+        principal_cache.clear()
+    else:
+        principal_cache.invalidate(user_id)
+
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
@@ -147,41 +457,402 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def appointment_owner_filter(current_user) -> dict:
+    """Mongo predicate restricting appointments to those the user may access"""
+    if current_user["role"] == "patient":
+        return {"patient_id": current_user["_id"]}
+    if current_user["role"] == "doctor":
+        return {"doctor_id": current_user["_id"]}
+    return {}
+
+def version_filter(version: Optional[int]) -> dict:
+    if version is None:
+        return {}
+    if version == 0:
+        # Documents written before versioning have no version field
+        return {"version": {"$in": [0, None]}}
+    return {"version": version}
+
+async def raise_appointment_write_error(appointment_id: str, current_user, conflict_detail: str):
+    """Explain why a conditional appointment write matched nothing"""
+    appointment = await storage.appointments.find_one({"_id": appointment_id})
+    if not appointment:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    owner_filter = appointment_owner_filter(current_user)
+    if any(appointment.get(field) != value for field, value in owner_filter.items()):
+        raise HTTPException(status_code=403, detail="Access denied")
+    raise HTTPException(
+        status_code=409,
+        detail={
+            "message": conflict_detail,
+            "status": appointment["status"],
+            "payment_status": appointment.get("payment_status"),
+            "version": appointment.get("version", 0)
+        }
+    )
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check: a list of (possibly weak) tags, or *"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def encode_cursor(timestamp: datetime, doc_id: str) -> str:
+    """Opaque keyset cursor for a (timestamp, _id) position"""
+    raw = f"{timestamp.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), doc_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(field: str, cursor: str, direction: str) -> dict:
+    """Mongo predicate selecting documents strictly before/after a cursor on (field, _id)"""
+    value, doc_id = decode_cursor(cursor)
+    op = "$lt" if direction == "before" else "$gt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "_id": {op: doc_id}}
+    ]}
+
+async def fetch_page(
+    repository,
+    query: dict,
+    sort_field: str,
+    order: int,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None
+):
+    """Fetch one keyset page ordered by (sort_field, _id).
+
+    Returns (documents, has_more). `cursor` continues after the given
+    position in the requested order.
+    """
+    if cursor:
+        keyset = keyset_filter(sort_field, cursor, "before" if order == -1 else "after")
+        query = {"$and": [query, keyset]} if "$or" in query else {**query, **keyset}
+    docs = await repository.find(
+        query, projection=projection,
+        sort=[(sort_field, order), ("_id", order)], limit=limit + 1
+    )
+    return docs[:limit], len(docs) > limit
+
+def starts_at_range(date_from: Optional[date], date_to: Optional[date]) -> dict:
+    """Match appointments starting within an inclusive day range"""
+    if date_from is None and date_to is None:
+        return {}
+    date_from = date_from or date_to
+    date_to = date_to or date_from
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to is before date_from")
+    return {"starts_at": {
+        "$gte": datetime.combine(date_from, datetime.min.time()),
+        "$lt": datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    }}
+
+async def authenticate_token(token: str):
+    """Resolve a JWT to its user document, raising 401 on any failure"""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"_id": user_id})
+        user = principal_cache.get(user_id)
         if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
+            user = await storage.users.find_one({"_id": user_id})
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            principal_cache.set(user_id, user)
         
-        return user
+        # Handlers may modify current_user; the cached document must not change
+        return copy.deepcopy(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def get_accessible_appointment(appointment_id: str, current_user, projection=None) -> dict:
+    """Load an appointment the user participates in (admins see all), else 404/403"""
+    appointment = await storage.appointments.find_one({"_id": appointment_id}, projection=projection)
+    if not appointment:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    owner_filter = appointment_owner_filter(current_user)
+    if any(appointment.get(field) != value for field, value in owner_filter.items()):
+        raise HTTPException(status_code=403, detail="Access denied")
+    return appointment
+
+async def get_current_admin(current_user = Depends(get_current_user)):
+    if current_user["role"] != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return current_user
+
+# ==================== INDEXES ====================
+
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel(
+            [("role", ASCENDING), ("specialization", ASCENDING),
+             ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="role_specialization_created"
+        ),
+        IndexModel(
+            [("role", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="role_created"
+        ),
+    ],
+    "appointments": [
+        IndexModel(
+            [("patient_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="patient_created"
+        ),
+        IndexModel(
+            [("doctor_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="doctor_created"
+        ),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created"),
+        IndexModel([("doctor_id", ASCENDING), ("starts_at", ASCENDING)], name="doctor_starts_at"),
+        IndexModel([("starts_at", ASCENDING)], name="starts_at"),
+        # One active appointment per (doctor, date, slot); cancelled appointments drop slot_key
+        IndexModel(
+            [("slot_key", ASCENDING)],
+            name="slot_key_unique",
+            unique=True,
+            partialFilterExpression={"slot_key": {"$exists": True}}
+        ),
+    ],
+    "messages": [
+        IndexModel(
+            [("appointment_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+            name="appointment_timestamp"
+        ),
+    ],
+    "payments": [
+        IndexModel([("appointment_id", ASCENDING)], name="appointment"),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        # Only expired payments carry expired_at, so paid ones are never removed
+        *([IndexModel(
+            [("expired_at", ASCENDING)],
+            name="expired_ttl",
+            expireAfterSeconds=int(float(PAYMENT_EXPIRED_TTL_DAYS) * 86400)
+        )] if PAYMENT_EXPIRED_TTL_DAYS else []),
+    ],
+    "payment_notifications": [
+        IndexModel([("status", ASCENDING), ("received_at", ASCENDING)], name="status_received"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "doctor_schedules": [
+        IndexModel([("doctor_id", ASCENDING), ("date", ASCENDING)], name="doctor_date"),
+    ],
+}
+
+storage = create_storage(STORAGE_ENGINE, db, REQUIRED_INDEXES)
+storage.users = InvalidatingRepository(storage.users, invalidate_user)
+
+# Query shapes issued by the routes, checked against REQUIRED_INDEXES with explain
+QUERY_SHAPES = [
+    {"route": "POST /auth/login", "collection": "users", "filter": {"email": "x@y.vn"}},
+    {"route": "GET /doctors", "collection": "users",
+     "filter": {"role": "doctor"}, "sort": [("created_at", 1), ("_id", 1)]},
+    {"route": "GET /doctors?specialization", "collection": "users",
+     "filter": {"role": "doctor", "specialization": "Nội khoa"},
+     "sort": [("created_at", 1), ("_id", 1)]},
+    {"route": "GET /appointments (patient)", "collection": "appointments",
+     "filter": {"patient_id": "p"}, "sort": [("created_at", -1), ("_id", -1)]},
+    {"route": "GET /appointments (doctor)", "collection": "appointments",
+     "filter": {"doctor_id": "d"}, "sort": [("created_at", -1), ("_id", -1)]},
+    {"route": "GET /appointments (admin)", "collection": "appointments",
+     "filter": {}, "sort": [("created_at", -1), ("_id", -1)]},
+    {"route": "GET /messages/{appointment_id}", "collection": "messages",
+     "filter": {"appointment_id": "a"}, "sort": [("timestamp", -1), ("_id", -1)]},
+    {"route": "GET /doctors/{doctor_id}/schedule", "collection": "appointments",
+     "filter": {"doctor_id": "d", "starts_at": {"$gte": datetime(2025, 1, 6), "$lt": datetime(2025, 1, 13)}},
+     "sort": [("starts_at", 1)]},
+    {"route": "GET /admin/appointments/day", "collection": "appointments",
+     "filter": {"starts_at": {"$gte": datetime(2025, 1, 6), "$lt": datetime(2025, 1, 7)}},
+     "sort": [("starts_at", 1)]},
+    {"route": "POST /payments/confirm/{appointment_id}", "collection": "payments",
+     "filter": {"appointment_id": "a", "status": "pending"}},
+    {"route": "GET /chats (doctor)", "collection": "appointments",
+     "pipeline": conversations_pipeline({"doctor_id": "d"}, 100)},
+    {"route": "GET /chats (admin)", "collection": "appointments",
+     "pipeline": conversations_pipeline({}, 100)},
+    {"route": "GET /availability", "collection": "doctor_schedules",
+     "filter": {"doctor_id": {"$in": ["d1", "d2"]}, "date": {"$gte": "2025-01-06", "$lte": "2025-02-04"}}},
+    {"route": "GET /doctors/{doctor_id}/availability", "collection": "doctor_schedules",
+     "filter": {"_id": "d:2025-01-06"}},
+    {"route": "payment sweeper", "collection": "payments",
+     "filter": {"status": "pending", "expires_at": {"$lt": datetime(2025, 1, 6)}},
+     "sort": [("expires_at", 1)]},
+    {"route": "payment notification requeue", "collection": "payment_notifications",
+     "filter": {"status": "queued", "received_at": {"$lt": datetime(2025, 1, 6)}, "$or": [
+         {"requeued_at": {"$exists": False}}, {"requeued_at": {"$lt": datetime(2025, 1, 6)}}
+     ]},
+     "sort": [("received_at", 1)]},
+    {"route": "payment notification batch", "collection": "payment_notifications",
+     "filter": {"_id": {"$in": ["vnpay:1", "vnpay:2"]}}},
+    {"route": "POST /messages/{appointment_id}/read", "collection": "conversations",
+     "filter": {"_id": "a"}},
+]
+
+# Index options that change behaviour; an index with the right keys but
+# different options does not count as present
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+def index_key(model: IndexModel) -> tuple:
+    return tuple(model.document["key"].items())
+
+def index_options(spec: dict) -> dict:
+    return {
+        option: spec[option] for option in INDEX_OPTIONS
+        if spec.get(option) is not None and spec.get(option) is not False
+    }
+
+async def ensure_indexes(database=None, mode: str = "create") -> dict:
+    """Create the required indexes idempotently, or only report missing ones.
+
+    Returns {collection: [missing index names]}; in create mode the list holds
+    indexes that could not be built (e.g. duplicate emails blocking a unique index).
+    An existing index with the required keys but other options (unique,
+    partialFilterExpression, expireAfterSeconds, ...) is reported as
+    "<name> (options differ)"; create mode fixes a TTL change in place with
+    collMod and leaves other differences to be rebuilt by hand.
+    """
+    database = database if database is not None else db
+    missing = {}
+    for collection, models in REQUIRED_INDEXES.items():
+        existing = await database[collection].index_information()
+        by_key = {
+            tuple((field, direction) for field, direction in info["key"]): (name, info)
+            for name, info in existing.items()
+        }
+        for model in models:
+            name = model.document["name"]
+            found = by_key.get(index_key(model))
+            if found is None:
+                if mode != "create":
+                    missing.setdefault(collection, []).append(name)
+                    continue
+                try:
+                    await database[collection].create_indexes([model])
+                    logger.info(f"Created index {collection}.{name}")
+                except OperationFailure as e:
+                    logger.error(f"Could not create index {collection}.{name}: {e}")
+                    missing.setdefault(collection, []).append(name)
+                continue
+            
+            existing_name, info = found
+            wanted, actual = index_options(model.document), index_options(info)
+            if wanted == actual:
+                continue
+            ttl_only = (
+                {option for option in set(wanted) | set(actual) if wanted.get(option) != actual.get(option)}
+                == {"expireAfterSeconds"} and "expireAfterSeconds" in actual and "expireAfterSeconds" in wanted
+            )
+            if mode == "create" and ttl_only:
+                try:
+                    await database.command({"collMod": collection, "index": {
+                        "name": existing_name, "expireAfterSeconds": wanted["expireAfterSeconds"]
+                    }})
+                    logger.info(f"Changed TTL of index {collection}.{existing_name}")
+                    continue
+                except OperationFailure as e:
+                    logger.error(f"Could not change TTL of index {collection}.{existing_name}: {e}")
+            logger.warning(
+                f"Index {collection}.{existing_name} has options {actual}, expected {wanted}; "
+                f"drop it so {name} can be rebuilt"
+            )
+            missing.setdefault(collection, []).append(f"{name} (options differ)")
+        if collection in missing and mode != "create":
+            logger.warning(f"Missing indexes on {collection}: {', '.join(missing[collection])}")
+    return missing
+
+def plan_stages(plan: dict) -> list:
+    """Flatten the stage names of an explain winningPlan"""
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += plan_stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return [stage for stage in stages if stage]
+
+async def explain_command(database_name: str, command: dict) -> list:
+    """Winning plan stages of an arbitrary command (used by the slow query profiler)"""
+    explained = await client[database_name].command(
+        {"explain": command, "verbosity": "queryPlanner"}
+    )
+    planner = explained.get("queryPlanner")
+    if planner is None:
+        # Aggregations report the plan of their initial $cursor stage
+        planner = explained["stages"][0]["$cursor"]["queryPlanner"]
+    return plan_stages(planner["winningPlan"])
+
+async def explain_query_shapes(database=None) -> list:
+    """Explain every QUERY_SHAPES entry and flag collection scans and in-memory sorts"""
+    database = database if database is not None else db
+    report = []
+    for shape in QUERY_SHAPES:
+        if "pipeline" in shape:
+            command = {"aggregate": shape["collection"], "pipeline": shape["pipeline"], "cursor": {}}
+        else:
+            command = {"find": shape["collection"], "filter": shape["filter"]}
+            if shape.get("sort"):
+                command["sort"] = dict(shape["sort"])
+        explained = await database.command("explain", command, verbosity="queryPlanner")
+        planner = explained.get("queryPlanner")
+        if planner is None:
+            # Aggregations report the plan of their initial $cursor stage
+            planner = explained["stages"][0]["$cursor"]["queryPlanner"]
+        stages = plan_stages(planner["winningPlan"])
+        report.append({
+            "route": shape["route"],
+            "collection": shape["collection"],
+            "stages": stages,
+            "supported": "COLLSCAN" not in stages and "SORT" not in stages
+        })
+    return report
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await storage.users.find_one({"email": user_data.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
     user_id = str(uuid.uuid4())
     user_dict = user_data.dict()
-    user_dict["password"] = hash_password(user_data.password)
+    if user_data.role == UserRole.DOCTOR:
+        try:
+            user_dict["available_days"] = availability.normalize_days(user_data.available_days)
+            user_dict["available_hours"] = user_data.available_hours or DEFAULT_AVAILABLE_HOURS
+            availability.parse_hours(user_dict["available_hours"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    user_dict["password"] = await password_hasher.hash(user_data.password)
     user_dict["_id"] = user_id
     user_dict["created_at"] = datetime.utcnow()
     
-    await db.users.insert_one(user_dict)
+    try:
+        await storage.users.insert(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    if user_data.role == UserRole.DOCTOR:
+        invalidate_doctor(user_id)
     
     # Create token
     token = create_access_token({"sub": user_id, "role": user_data.role})
@@ -198,8 +869,8 @@ async def register(user_data: UserRegister):
 
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    user = await storage.users.find_one({"email": credentials.email})
+    if not user or not await password_hasher.verify(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_access_token({"sub": user["_id"], "role": user["role"]})
@@ -233,64 +904,482 @@ async def get_me(current_user = Depends(get_current_user)):
 
 # ==================== DOCTOR ROUTES ====================
 
+# Serialized responses keyed by directory_version, so one bump drops every
+# cached list page; the ETag is a hash of the body, so workers agree on it
+directory_cache = LRUCache(DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL)
+directory_version = 0
+
+def invalidate_doctor(doctor_id: str):
+    """Must be called whenever a doctor is created, modified or deleted"""
+    global directory_version
+    directory_version += 1
+    directory_cache.invalidate(("doctor", doctor_id))
+
+async def directory_response(request: Request, key, build) -> Response:
+    """Serve a cached directory resource; `build()` returns (content, headers) on a miss"""
+    entry = directory_cache.get(key)
+    if entry is None:
+        version = directory_version
+        content, headers = await build()
+        body = responses.dumps(content)
+        entry = {
+            "body": body,
+            "etag": '"' + hashlib.sha1(body).hexdigest() + '"',
+            "headers": headers
+        }
+        if version == directory_version:  # not invalidated while building
+            directory_cache.set(key, entry)
+    
+    # no-cache: clients keep the body but revalidate, which costs a 304
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", **entry["headers"]}
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type="application/json", headers=headers)
+
 @api_router.get("/doctors")
-async def get_doctors(specialization: Optional[str] = None):
-    query = {"role": "doctor"}
-    if specialization:
-        query["specialization"] = specialization
+async def get_doctors(
+    request: Request,
+    specialization: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500)
+):
+    async def build():
+        query = {"role": "doctor"}
+        if specialization:
+            query["specialization"] = specialization
+        
+        doctors, has_more = await fetch_page(
+            storage.users, query, "created_at", 1, limit, cursor,
+            projection={"full_name": 1, "email": 1, "phone": 1, "specialization": 1, "created_at": 1}
+        )
+        return [
+            {
+                "id": doc["_id"],
+                "full_name": doc["full_name"],
+                "email": doc["email"],
+                "phone": doc.get("phone"),
+                "specialization": doc.get("specialization", "General"),
+                "cursor": encode_cursor(doc["created_at"], doc["_id"])
+            }
+            for doc in doctors
+        ], {"X-Has-More": "true" if has_more else "false"}
     
-    doctors = await db.users.find(query).to_list(100)
+    key = ("doctors", directory_version, specialization, cursor, limit)
+    return await directory_response(request, key, build)
+
+@api_router.get("/doctors/{doctor_id}")
+async def get_doctor(doctor_id: str, request: Request):
+    async def build():
+        doctor = await storage.users.find_one({"_id": doctor_id, "role": "doctor"})
+        if not doctor:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        
+        return {
+            "id": doctor["_id"],
+            "full_name": doctor["full_name"],
+            "email": doctor["email"],
+            "phone": doctor.get("phone"),
+            "specialization": doctor.get("specialization", "General"),
+            "available_days": doctor.get("available_days") or [],
+            "available_hours": doctor.get("available_hours") or DEFAULT_AVAILABLE_HOURS
+        }, {}
     
-    return [
+    return await directory_response(request, ("doctor", doctor_id), build)
+
+@api_router.get("/doctors/{doctor_id}/availability")
+async def get_doctor_availability(doctor_id: str, date: str):
+    """Free and booked slots for one doctor on one day"""
+    doctor = await storage.users.find_one({"_id": doctor_id, "role": "doctor"})
+    if not doctor:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    try:
+        day = availability.parse_day(date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    days, hours = doctor_schedule(doctor)
+    if not availability.works_on(days, day):
+        return {"doctor_id": doctor_id, "date": day.isoformat(), "slot_minutes": SLOT_MINUTES, "slots": []}
+    
+    schedule = await storage.doctor_schedules.find_one({"_id": schedule_id(doctor_id, day)})
+    occupied = schedule["occupied"] if schedule else 0
+    return {
+        "doctor_id": doctor_id,
+        "date": day.isoformat(),
+        "slot_minutes": SLOT_MINUTES,
+        "slots": [
+            {"time": time_value, "available": not occupied & availability.slot_mask(i)}
+            for i, time_value in enumerate(availability.slot_times(hours, SLOT_MINUTES))
+        ]
+    }
+
+def schedule_entry(apt: dict) -> dict:
+    return {
+        "id": apt["_id"],
+        "patient_name": apt["patient_name"],
+        "doctor_id": apt["doctor_id"],
+        "doctor_name": apt["doctor_name"],
+        "specialization": apt["specialization"],
+        "starts_at": apt["starts_at"].isoformat(),
+        "duration_minutes": apt.get("duration_minutes", SLOT_MINUTES),
+        "appointment_date": apt["appointment_date"],
+        "appointment_time": apt["appointment_time"],
+        "status": apt["status"],
+        "payment_status": apt["payment_status"]
+    }
+
+SCHEDULE_PROJECTION = {
+    "patient_name": 1, "doctor_id": 1, "doctor_name": 1, "specialization": 1,
+    "starts_at": 1, "duration_minutes": 1, "appointment_date": 1,
+    "appointment_time": 1, "status": 1, "payment_status": 1
+}
+
+@api_router.get("/doctors/{doctor_id}/schedule", response_model=List[ScheduleEntry])
+async def get_doctor_schedule(
+    doctor_id: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    include_cancelled: bool = False,
+    current_user = Depends(get_current_user)
+):
+    """A doctor's appointments in a day range (default: the next 7 days), by start time"""
+    if current_user["role"] != UserRole.ADMIN and current_user["_id"] != doctor_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    date_from = date_from or datetime.utcnow().date()
+    date_to = date_to or date_from + timedelta(days=6)
+    if (date_to - date_from).days > 92:
+        raise HTTPException(status_code=400, detail="Date range must not exceed 92 days")
+    
+    query = {"doctor_id": doctor_id, **starts_at_range(date_from, date_to)}
+    if not include_cancelled:
+        query["status"] = {"$ne": "cancelled"}
+    appointments = await storage.appointments.find(
+        query, projection=SCHEDULE_PROJECTION, sort=[("starts_at", 1)]
+    )
+    return [schedule_entry(apt) for apt in appointments]
+
+@api_router.get("/availability", response_model=List[DoctorAvailability])
+async def search_availability(
+    specialization: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(3, ge=1, le=20)
+):
+    """Earliest free slots of every doctor in a specialization over a date range"""
+    now = clinic_now()
+    try:
+        start = availability.parse_day(date_from) if date_from else now.date()
+        end = availability.parse_day(date_to) if date_to else start + timedelta(days=29)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    start = max(start, now.date())
+    days = (end - start).days + 1
+    if days < 1 or days > 31:
+        raise HTTPException(status_code=400, detail="Date range must span 1 to 31 days")
+    day_list = [start + timedelta(days=offset) for offset in range(days)]
+    
+    doctors = await storage.users.find(
+        {"role": "doctor", "specialization": specialization},
+        projection={"full_name": 1, "specialization": 1, "available_days": 1, "available_hours": 1},
+        limit=1000
+    )
+    if not doctors:
+        return []
+    
+    # Working-hours and occupancy bitmaps as (doctors, days) matrices
+    row_of = {doc["_id"]: row for row, doc in enumerate(doctors)}
+    working = np.zeros((len(doctors), days), dtype=np.uint64)
+    occupied = np.zeros((len(doctors), days), dtype=np.uint64)
+    hours_start = []
+    for row, doc in enumerate(doctors):
+        available_days, hours = doctor_schedule(doc)
+        try:
+            mask = availability.full_day_mask(availability.slot_count(hours, SLOT_MINUTES))
+            hours_start.append(availability.parse_hours(hours)[0])
+        except ValueError:
+            hours_start.append(0)
+            continue
+        for column, day in enumerate(day_list):
+            if availability.works_on(available_days, day):
+                working[row, column] = mask
+        if day_list[0] == now.date() and working[row, 0]:
+            # Today's slots that have already started are not offered
+            started = sum(
+                slot_started(day_list[0], time_value, now)
+                for time_value in availability.slot_times(hours, SLOT_MINUTES)
+            )
+            working[row, 0] = mask & ~availability.full_day_mask(started)
+    
+    schedules = await storage.doctor_schedules.find(
         {
-            "id": doc["_id"],
+            "doctor_id": {"$in": list(row_of)},
+            "date": {"$gte": start.isoformat(), "$lte": end.isoformat()}
+        },
+        projection={"doctor_id": 1, "date": 1, "occupied": 1}
+    )
+    for schedule in schedules:
+        column = (date.fromisoformat(schedule["date"]) - start).days
+        occupied[row_of[schedule["doctor_id"]], column] = schedule["occupied"]
+    
+    rows, columns, indexes = availability.earliest_free_slots(working, occupied, limit)
+    results = [
+        {
+            "doctor_id": doc["_id"],
             "full_name": doc["full_name"],
-            "email": doc["email"],
-            "phone": doc.get("phone"),
-            "specialization": doc.get("specialization", "General")
+            "specialization": doc.get("specialization", "General"),
+            "slots": []
         }
         for doc in doctors
     ]
+    for row, column, index in zip(rows.tolist(), columns.tolist(), indexes.tolist()):
+        results[row]["slots"].append({
+            "date": day_list[column].isoformat(),
+            "time": availability.format_time(hours_start[row] + index * SLOT_MINUTES)
+        })
+    return results
 
-@api_router.get("/doctors/{doctor_id}")
-async def get_doctor(doctor_id: str):
-    doctor = await db.users.find_one({"_id": doctor_id, "role": "doctor"})
-    if not doctor:
-        raise HTTPException(status_code=404, detail="Doctor not found")
+SPECIALIZATIONS = [
+    {"id": "1", "name": "Nội khoa"},
+    {"id": "2", "name": "Ngoại khoa"},
+    {"id": "3", "name": "Nhi khoa"},
+    {"id": "4", "name": "Sản phụ khoa"},
+    {"id": "5", "name": "Tim mạch"},
+    {"id": "6", "name": "Da liễu"},
+    {"id": "7", "name": "Mắt"},
+    {"id": "8", "name": "Tai Mũi Họng"},
+]
+
+@api_router.get("/specializations")
+async def get_specializations(request: Request):
+    async def build():
+        return SPECIALIZATIONS, {}
     
+    return await directory_response(request, ("specializations",), build)
+
+# ==================== AVAILABILITY ====================
+
+def doctor_schedule(doctor: dict):
+    return (
+        doctor.get("available_days") or [],
+        doctor.get("available_hours") or DEFAULT_AVAILABLE_HOURS
+    )
+
+def clinic_now() -> datetime:
+    """Current clinic local time, naive like starts_at"""
+    return datetime.now(CLINIC_TIMEZONE).replace(tzinfo=None)
+
+def slot_started(day: date, appointment_time: str, now: datetime) -> bool:
+    """A slot can no longer be booked once its start time has come"""
+    return schedule_fields(day, appointment_time)["starts_at"] <= now
+
+def schedule_id(doctor_id: str, day: date) -> str:
+    return f"{doctor_id}:{day.isoformat()}"
+
+def resolve_slot(doctor: dict, appointment_date: str, appointment_time: str):
+    """Validate a requested date/time against the doctor's hours -> (day, slot index)"""
+    days, hours = doctor_schedule(doctor)
+    try:
+        day = availability.parse_day(appointment_date)
+        index = availability.slot_index(hours, appointment_time, SLOT_MINUTES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if slot_started(day, appointment_time, clinic_now()):
+        raise HTTPException(status_code=400, detail="Appointment time is in the past")
+    if not availability.works_on(days, day):
+        raise HTTPException(status_code=400, detail="Doctor is not available on this day")
+    return day, index
+
+def slot_fields(doctor_id: str, day: date, index: int) -> dict:
     return {
-        "id": doctor["_id"],
-        "full_name": doctor["full_name"],
-        "email": doctor["email"],
-        "phone": doctor.get("phone"),
-        "specialization": doctor.get("specialization", "General")
+        "slot_date": day.isoformat(),
+        "slot_index": index,
+        "slot_key": f"{schedule_id(doctor_id, day)}:{index}"
     }
 
-@api_router.get("/specializations")
-async def get_specializations():
-    return [
-        {"id": "1", "name": "Nội khoa"},
-        {"id": "2", "name": "Ngoại khoa"},
-        {"id": "3", "name": "Nhi khoa"},
-        {"id": "4", "name": "Sản phụ khoa"},
-        {"id": "5", "name": "Tim mạch"},
-        {"id": "6", "name": "Da liễu"},
-        {"id": "7", "name": "Mắt"},
-        {"id": "8", "name": "Tai Mũi Họng"},
-    ]
+def schedule_fields(day: date, appointment_time: str) -> dict:
+    """Normalized, range-indexable start time (clinic local time) and duration"""
+    start = availability.parse_time(appointment_time)
+    return {
+        "starts_at": datetime.combine(day, datetime.min.time()) + timedelta(minutes=start),
+        "duration_minutes": SLOT_MINUTES
+    }
+
+async def reserve_slot(doctor_id: str, day: date, index: int) -> bool:
+    """Atomically set the slot's bit in the doctor's day bitmap; False if already taken"""
+    mask = availability.slot_mask(index)
+    for _ in range(2):
+        try:
+            await storage.doctor_schedules.update_one(
+                {"_id": schedule_id(doctor_id, day), "occupied": {"$bitsAllClear": mask}},
+                {
+                    "$bit": {"occupied": {"or": mask}},
+                    "$setOnInsert": {"doctor_id": doctor_id, "date": day.isoformat()}
+                },
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Either the bit is set, or a concurrent booking created the day
+            # document first; the retry tells the two apart
+            continue
+    return False
+
+async def release_slot(doctor_id: str, slot_date: Optional[str], index: Optional[int]):
+    if slot_date is None or index is None:
+        return
+    await storage.doctor_schedules.update_one(
+        {"_id": f"{doctor_id}:{slot_date}"},
+        {"$bit": {"occupied": {"and": ~availability.slot_mask(index)}}}
+    )
+
+# ==================== IDEMPOTENCY ====================
+
+idempotency_cache = LRUCache(IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL_HOURS * 3600)
+# Requests currently executing in this worker, so duplicates await them
+idempotency_inflight = {}
+
+def request_fingerprint(payload: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(jsonable_encoder(payload), sort_keys=True).encode()
+    ).hexdigest()
+
+def replay_response(record: dict, fingerprint: str) -> JSONResponse:
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used with a different request"
+        )
+    return JSONResponse(
+        record["body"], status_code=record["status_code"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+async def claim_idempotency_key(record_id: str, fingerprint: str) -> Optional[dict]:
+    """Claim a key for this request; returns the existing record if someone else holds it"""
+    now = datetime.utcnow()
+    try:
+        await storage.idempotency_keys.insert({
+            "_id": record_id,
+            "status": "in_progress",
+            "fingerprint": fingerprint,
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # Take over a key whose owner died mid-request
+    taken = await storage.idempotency_keys.find_one_and_update(
+        {"_id": record_id, "status": "in_progress", "locked_until": {"$lt": now},
+         "fingerprint": fingerprint},
+        {"$set": {"locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+    )
+    if taken:
+        return None
+    return await storage.idempotency_keys.find_one({"_id": record_id})
+
+async def wait_for_idempotency_key(record_id: str, record: dict) -> dict:
+    """Poll a key held by another worker until its response is stored"""
+    deadline = time.monotonic() + IDEMPOTENCY_LOCK_SECONDS
+    while record and record["status"] == "in_progress" and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        record = await storage.idempotency_keys.find_one({"_id": record_id})
+    if not record or record["status"] != "done":
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress"
+        )
+    return record
+
+async def store_idempotent_result(record_id: str, fingerprint: str, status_code: int, body):
+    record = {"fingerprint": fingerprint, "status_code": status_code, "body": body}
+    await storage.idempotency_keys.update_one(
+        {"_id": record_id},
+        {"$set": {"status": "done", **record}, "$unset": {"locked_until": ""}}
+    )
+    idempotency_cache.set(record_id, record)
+
+async def release_idempotency_key(record_id: str):
+    await storage.idempotency_keys.delete_one({"_id": record_id, "status": "in_progress"})
+
+async def run_idempotent(key: Optional[str], scope: str, user: dict, payload: dict, operation):
+    """Run `operation` once per (user, scope, Idempotency-Key) and replay its response.
+
+    Successful and 4xx responses are stored for IDEMPOTENCY_TTL_HOURS; server
+    errors release the key so the client's retry runs again.
+    """
+    if key is None:
+        return await operation()
+    if not 0 < len(key) <= 255:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+    
+    record_id = f"{scope}:{user['_id']}:{key}"
+    fingerprint = request_fingerprint(payload)
+    record = idempotency_cache.get(record_id)
+    if record is not None:
+        return replay_response(record, fingerprint)
+    
+    inflight = idempotency_inflight.get(record_id)
+    if inflight is not None:
+        await asyncio.shield(inflight)
+        record = idempotency_cache.get(record_id)
+        if record is None:
+            # The first attempt failed with a server error, so this one runs
+            return await run_idempotent(key, scope, user, payload, operation)
+        return replay_response(record, fingerprint)
+    
+    done = asyncio.get_running_loop().create_future()
+    idempotency_inflight[record_id] = done
+    try:
+        record = await claim_idempotency_key(record_id, fingerprint)
+        if record is not None:
+            record = await wait_for_idempotency_key(record_id, record)
+            idempotency_cache.set(record_id, record)
+            return replay_response(record, fingerprint)
+        
+        try:
+            result = await operation()
+        except HTTPException as e:
+            if e.status_code < 500:
+                await store_idempotent_result(
+                    record_id, fingerprint, e.status_code, {"detail": e.detail}
+                )
+                raise
+            await release_idempotency_key(record_id)
+            raise
+        except BaseException:
+            await release_idempotency_key(record_id)
+            raise
+        body = jsonable_encoder(result)
+        await store_idempotent_result(record_id, fingerprint, 200, body)
+        return body
+    finally:
+        del idempotency_inflight[record_id]
+        done.set_result(None)
 
 # ==================== APPOINTMENT ROUTES ====================
 
 @api_router.post("/appointments")
 async def create_appointment(
     appointment_data: AppointmentCreate,
+    idempotency_key: Optional[str] = Header(None),
     current_user = Depends(get_current_user)
 ):
+    return await run_idempotent(
+        idempotency_key, "appointments", current_user, appointment_data.dict(),
+        lambda: book_appointment(appointment_data, current_user)
+    )
+
+async def book_appointment(appointment_data: AppointmentCreate, current_user: dict):
     # Get doctor info
-    doctor = await db.users.find_one({"_id": appointment_data.doctor_id, "role": "doctor"})
+    doctor = await storage.users.find_one({"_id": appointment_data.doctor_id, "role": "doctor"})
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     
+    day, index = resolve_slot(
+        doctor, appointment_data.appointment_date, appointment_data.appointment_time
+    )
+    
     # Create appointment
     appointment_id = str(uuid.uuid4())
     appointment = {
@@ -308,10 +1397,31 @@ async def create_appointment(
         "payment_status": "unpaid",
         "amount": 500000.0,  # Default amount
         "notes": appointment_data.notes,
-        "created_at": datetime.utcnow()
+        "version": 1,
+        "created_at": datetime.utcnow(),
+        **schedule_fields(day, appointment_data.appointment_time),
+        **slot_fields(appointment_data.doctor_id, day, index)
     }
     
-    await db.appointments.insert_one(appointment)
+    try:
+        await storage.appointments.insert(appointment)
+    except DuplicateKeyError:
+        # The unique slot index holds another live booking of this slot
+        raise HTTPException(status_code=409, detail="This time slot is already booked")
+    
+    # The bitmap follows the appointment, so a crash between the two writes
+    # leaves a booked slot that search shows as free (the unique index still
+    # refuses it) rather than a bit that no appointment references
+    if not await reserve_slot(appointment_data.doctor_id, day, index):
+        holder = await storage.appointments.find_one(
+            {"slot_key": appointment["slot_key"], "_id": {"$ne": appointment_id}},
+            projection={"_id": 1}
+        )
+        if holder is not None:
+            # Booked concurrently while the unique slot index was not built
+            await storage.appointments.delete_one({"_id": appointment_id})
+            raise HTTPException(status_code=409, detail="This time slot is already booked")
+        # Otherwise the bit was left behind by a booking that no longer holds it
     
     return {
         "id": appointment_id,
@@ -319,17 +1429,40 @@ async def create_appointment(
         "appointment": appointment
     }
 
-@api_router.get("/appointments")
-async def get_appointments(current_user = Depends(get_current_user)):
-    # Get appointments based on user role
-    if current_user["role"] == "patient":
-        query = {"patient_id": current_user["_id"]}
-    elif current_user["role"] == "doctor":
-        query = {"doctor_id": current_user["_id"]}
-    else:  # admin
-        query = {}
+@api_router.get("/appointments", response_model=List[AppointmentListItem])
+async def get_appointments(
+    response: Response,
+    status: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    current_user = Depends(get_current_user)
+):
+    """List appointments newest first, one keyset page at a time"""
+    # Role restriction always wins over the optional filters
+    query = {}
+    if doctor_id:
+        query["doctor_id"] = doctor_id
+    if patient_id:
+        query["patient_id"] = patient_id
+    query.update(appointment_owner_filter(current_user))
+    if status:
+        query["status"] = status
+    query.update(starts_at_range(date_from, date_to))
     
-    appointments = await db.appointments.find(query).sort("created_at", -1).to_list(100)
+    appointments, has_more = await fetch_page(
+        storage.appointments, query, "created_at", -1, limit, cursor,
+        projection={
+            "patient_name": 1, "doctor_name": 1, "appointment_date": 1,
+            "appointment_time": 1, "specialization": 1, "status": 1,
+            "payment_status": 1, "amount": 1, "notes": 1, "version": 1,
+            "created_at": 1
+        }
+    )
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     
     return [
         {
@@ -342,14 +1475,16 @@ async def get_appointments(current_user = Depends(get_current_user)):
             "status": apt["status"],
             "payment_status": apt["payment_status"],
             "amount": apt["amount"],
-            "notes": apt.get("notes")
+            "notes": apt.get("notes"),
+            "version": apt.get("version", 0),
+            "cursor": encode_cursor(apt["created_at"], apt["_id"])
         }
         for apt in appointments
     ]
 
 @api_router.get("/appointments/{appointment_id}")
 async def get_appointment(appointment_id: str, current_user = Depends(get_current_user)):
-    appointment = await db.appointments.find_one({"_id": appointment_id})
+    appointment = await storage.appointments.find_one({"_id": appointment_id})
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
@@ -367,88 +1502,138 @@ async def update_appointment(
     update_data: AppointmentUpdate,
     current_user = Depends(get_current_user)
 ):
-    appointment = await db.appointments.find_one({"_id": appointment_id})
-    if not appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+    update_dict = {
+        k: v for k, v in update_data.dict(exclude={"version"}).items() if v is not None
+    }
+    if not update_dict:
+        return {"message": "Appointment updated successfully"}
     
-    # Only patient can update their own appointments
-    if current_user["role"] == "patient" and appointment["patient_id"] != current_user["_id"]:
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Ownership, status transition and version are checked by the write itself
+    query = {"_id": appointment_id, **appointment_owner_filter(current_user)}
+    query.update(version_filter(update_data.version))
+    if "status" in update_dict:
+        if update_dict["status"] not in APPOINTMENT_TRANSITIONS:
+            raise HTTPException(status_code=400, detail="Invalid status")
+        query["status"] = {"$in": APPOINTMENT_TRANSITIONS[update_dict["status"]]}
     
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
-    if update_dict:
-        await db.appointments.update_one({"_id": appointment_id}, {"$set": update_dict})
+    update = {"$set": update_dict, "$inc": {"version": 1}}
+    cancelling = update_dict.get("status") == "cancelled"
+    new_slot = None
+    if cancelling:
+        update["$unset"] = {"slot_key": ""}
+    elif "appointment_date" in update_dict or "appointment_time" in update_dict:
+        # Rescheduling: only live appointments may take a slot, and the new
+        # slot is held before moving the appointment into it
+        allowed = query.get("status", {}).get("$in", RESCHEDULABLE_STATUSES)
+        query["status"] = {"$in": [value for value in allowed if value in RESCHEDULABLE_STATUSES]}
+        current = await storage.appointments.find_one(query, projection={
+            "doctor_id": 1, "appointment_date": 1, "appointment_time": 1,
+            "slot_date": 1, "slot_index": 1
+        })
+        if current is None:
+            await raise_appointment_write_error(
+                appointment_id, current_user, "Appointment was modified or cannot be updated"
+            )
+        doctor = await storage.users.find_one({"_id": current["doctor_id"]}) or {}
+        day, index = resolve_slot(
+            doctor,
+            update_dict.get("appointment_date", current["appointment_date"]),
+            update_dict.get("appointment_time", current["appointment_time"])
+        )
+        if (day.isoformat(), index) != (current.get("slot_date"), current.get("slot_index")):
+            new_slot = (current["doctor_id"], day, index)
+            if not await reserve_slot(*new_slot):
+                raise HTTPException(status_code=409, detail="This time slot is already booked")
+            update_dict.update(slot_fields(*new_slot))
+        update_dict.update(schedule_fields(
+            day, update_dict.get("appointment_time", current["appointment_time"])
+        ))
+    
+    try:
+        previous = await storage.appointments.find_one_and_update(
+            query,
+            update,
+            projection={"version": 1, "doctor_id": 1, "slot_date": 1, "slot_index": 1},
+            return_after=False
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="This time slot is already booked")
+    if previous is None:
+        if new_slot:
+            await release_slot(new_slot[0], new_slot[1].isoformat(), new_slot[2])
+        await raise_appointment_write_error(
+            appointment_id, current_user, "Appointment was modified or cannot be updated"
+        )
+    
+    if cancelling or new_slot:
+        await release_slot(
+            previous["doctor_id"], previous.get("slot_date"), previous.get("slot_index")
+        )
     
-    return {"message": "Appointment updated successfully"}
+    return {
+        "message": "Appointment updated successfully",
+        "version": previous.get("version", 0) + 1
+    }
 
 @api_router.delete("/appointments/{appointment_id}")
-async def cancel_appointment(appointment_id: str, current_user = Depends(get_current_user)):
-    appointment = await db.appointments.find_one({"_id": appointment_id})
-    if not appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
-    
-    # Only patient can cancel their own appointments
-    if current_user["role"] == "patient" and appointment["patient_id"] != current_user["_id"]:
-        raise HTTPException(status_code=403, detail="Access denied")
+async def cancel_appointment(
+    appointment_id: str,
+    version: Optional[int] = None,
+    current_user = Depends(get_current_user)
+):
+    query = {
+        "_id": appointment_id,
+        "status": {"$in": APPOINTMENT_TRANSITIONS["cancelled"]},
+        **appointment_owner_filter(current_user)
+    }
+    query.update(version_filter(version))
     
-    await db.appointments.update_one(
-        {"_id": appointment_id},
-        {"$set": {"status": "cancelled"}}
+    appointment = await storage.appointments.find_one_and_update(
+        query,
+        {"$set": {"status": "cancelled"}, "$unset": {"slot_key": ""}, "$inc": {"version": 1}},
+        projection={"version": 1, "doctor_id": 1, "slot_date": 1, "slot_index": 1},
+        return_after=True
+    )
+    if appointment is None:
+        await raise_appointment_write_error(
+            appointment_id, current_user, "Appointment was modified or cannot be cancelled"
+        )
+    await release_slot(
+        appointment["doctor_id"], appointment.get("slot_date"), appointment.get("slot_index")
     )
     
-    return {"message": "Appointment cancelled successfully"}
+    return {"message": "Appointment cancelled successfully", "version": appointment["version"]}
 
 # ==================== CHAT ROUTES ====================
 
-@api_router.get("/chats")
+@api_router.get("/chats", response_model=List[ChatListItem])
 async def get_chats(current_user = Depends(get_current_user)):
     """Get list of conversations (appointments with messages) for the user"""
-    # Get appointments based on user role
-    if current_user["role"] == "patient":
-        query = {"patient_id": current_user["_id"]}
-    elif current_user["role"] == "doctor":
-        query = {"doctor_id": current_user["_id"]}
-    else:  # admin
-        query = {}
+    query = appointment_owner_filter(current_user)
     
-    # Get appointments that have at least one message or are confirmed/completed
-    appointments = await db.appointments.find(query).sort("created_at", -1).to_list(100)
+    # Appointments joined with their conversation summary (kept up to date
+    # by send_message) instead of two queries per appointment
+    appointments = await storage.appointments.with_conversations(query, 100)
     
     chats = []
     for apt in appointments:
-        # Get last message for this appointment
-        last_message = await db.messages.find_one(
-            {"appointment_id": apt["_id"]},
-            sort=[("timestamp", -1)]
-        )
-        
-        # Get unread message count
-        unread_count = 0
-        if last_message:
-            unread_count = await db.messages.count_documents({
-                "appointment_id": apt["_id"],
-                "sender_id": {"$ne": current_user["_id"]},
-                "read": {"$ne": True}
-            })
-        
-        # Only include appointments that have messages or are confirmed
-        if last_message or apt["status"] in ["confirmed", "completed"]:
-            chats.append({
-                "id": apt["_id"],
-                "appointment_id": apt["_id"],
-                "patient_name": apt["patient_name"],
-                "doctor_name": apt["doctor_name"],
-                "specialization": apt["specialization"],
-                "appointment_date": apt["appointment_date"],
-                "appointment_time": apt["appointment_time"],
-                "status": apt["status"],
-                "last_message": {
-                    "message": last_message["message"] if last_message else None,
-                    "timestamp": last_message["timestamp"].isoformat() if last_message else None,
-                    "sender_name": last_message["sender_name"] if last_message else None
-                } if last_message else None,
-                "unread_count": unread_count
-            })
+        last_message = apt.get("last_message")
+        chats.append({
+            "id": apt["_id"],
+            "appointment_id": apt["_id"],
+            "patient_name": apt["patient_name"],
+            "doctor_name": apt["doctor_name"],
+            "specialization": apt["specialization"],
+            "appointment_date": apt["appointment_date"],
+            "appointment_time": apt["appointment_time"],
+            "status": apt["status"],
+            "last_message": {
+                "message": last_message["message"],
+                "timestamp": last_message["timestamp"].isoformat(),
+                "sender_name": last_message["sender_name"]
+            } if last_message else None,
+            "unread_count": (apt.get("unread") or {}).get(current_user["_id"], 0)
+        })
     
     return chats
 
@@ -457,61 +1642,348 @@ async def send_message(
     message_data: MessageCreate,
     current_user = Depends(get_current_user)
 ):
-    # Verify appointment exists
-    appointment = await db.appointments.find_one({"_id": message_data.appointment_id})
-    if not appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+    # Verify appointment exists and the user takes part in it
+    appointment = await get_accessible_appointment(
+        message_data.appointment_id, current_user, projection={"patient_id": 1, "doctor_id": 1}
+    )
+    return await create_message(appointment, current_user, message_data.message)
+
+@api_router.get("/messages/{appointment_id}", response_model=List[MessageListItem])
+async def get_messages(
+    appointment_id: str,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user = Depends(get_current_user)
+):
+    """Page through a conversation, oldest first within a page.
+
+    Without a cursor the newest page is returned. Pass a message's `cursor`
+    as `before` to load older messages or as `after` to catch up on newer ones.
+    """
+    # Verify access to appointment
+    await get_accessible_appointment(
+        appointment_id, current_user, projection={"patient_id": 1, "doctor_id": 1}
+    )
+    
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    
+    order = 1 if after else -1
+    messages, has_more = await fetch_page(
+        storage.messages, {"appointment_id": appointment_id}, "timestamp", order, limit,
+        after or before,
+        projection={"sender_name": 1, "sender_role": 1, "message": 1, "timestamp": 1}
+    )
+    if order == -1:
+        messages.reverse()
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     
+    return [
+        {
+            "id": msg["_id"],
+            "sender_name": msg["sender_name"],
+            "sender_role": msg["sender_role"],
+            "message": msg["message"],
+            "timestamp": msg["timestamp"].isoformat(),
+            "cursor": encode_cursor(msg["timestamp"], msg["_id"])
+        }
+        for msg in messages
+    ]
+
+@api_router.post("/messages/{appointment_id}/read")
+async def mark_messages_read(appointment_id: str, current_user = Depends(get_current_user)):
+    """Mark the whole conversation as read for the current user"""
+    await get_accessible_appointment(
+        appointment_id, current_user, projection={"patient_id": 1, "doctor_id": 1}
+    )
+    return await mark_conversation_read(appointment_id, current_user["_id"])
+
+# ==================== CONVERSATION SUMMARIES ====================
+
+async def create_message(appointment: dict, sender: dict, text: str, skip_sid: Optional[str] = None) -> dict:
+    """Persist a message, update the conversation summary and fan it out to the room"""
     message_id = str(uuid.uuid4())
     message = {
         "_id": message_id,
-        "appointment_id": message_data.appointment_id,
-        "sender_id": current_user["_id"],
-        "sender_name": current_user["full_name"],
-        "sender_role": current_user["role"],
-        "message": message_data.message,
+        "appointment_id": appointment["_id"],
+        "sender_id": sender["_id"],
+        "sender_name": sender["full_name"],
+        "sender_role": sender["role"],
+        "message": text,
         "timestamp": datetime.utcnow(),
         "read": False
     }
     
-    await db.messages.insert_one(message)
+    await storage.messages.insert(message)
+    await update_conversation_summary(appointment, message)
     
     # Emit to socket
     await sio.emit('new_message', {
         "id": message_id,
-        "appointment_id": message_data.appointment_id,
-        "sender_name": current_user["full_name"],
-        "sender_role": current_user["role"],
-        "message": message_data.message,
+        "appointment_id": appointment["_id"],
+        "sender_name": sender["full_name"],
+        "sender_role": sender["role"],
+        "message": text,
         "timestamp": message["timestamp"].isoformat()
-    }, room=message_data.appointment_id)
+    }, room=appointment["_id"], skip_sid=skip_sid)
     
     return message
 
-@api_router.get("/messages/{appointment_id}")
-async def get_messages(appointment_id: str, current_user = Depends(get_current_user)):
-    # Verify access to appointment
-    appointment = await db.appointments.find_one({"_id": appointment_id})
-    if not appointment:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+async def mark_conversation_read(appointment_id: str, user_id: str) -> dict:
+    """Move the user's read watermark to the last message and zero their unread counter.
+
+    Read state lives on the conversation summary, so this is one document
+    update no matter how many messages were unread.
+    """
+    conversation = await storage.conversations.find_one_and_update(
+        {"_id": appointment_id},
+        [{"$set": {
+            f"unread.{user_id}": 0,
+            f"read_up_to.{user_id}": "$last_message.timestamp"
+        }}],
+        projection={"read_up_to": 1},
+        return_after=True
+    )
+    read_up_to = ((conversation or {}).get("read_up_to") or {}).get(user_id)
+    result = {
+        "appointment_id": appointment_id,
+        "user_id": user_id,
+        "read_up_to": read_up_to.isoformat() if read_up_to else None,
+        "unread_count": 0
+    }
+    if read_up_to:
+        await sio.emit("messages_read", result, room=appointment_id)
+    return result
+
+async def update_conversation_summary(appointment: dict, message: dict):
+    """Record the last message and bump unread counters of the other participants"""
+    recipients = {appointment["patient_id"], appointment["doctor_id"]} - {message["sender_id"]}
+    await storage.conversations.update_one(
+        {"_id": appointment["_id"]},
+        {
+            "$set": {
+                "last_message": {
+                    "id": message["_id"],
+                    "message": message["message"],
+                    "timestamp": message["timestamp"],
+                    "sender_id": message["sender_id"],
+                    "sender_name": message["sender_name"]
+                },
+                # Senders have implicitly read everything up to their own message
+                f"read_up_to.{message['sender_id']}": message["timestamp"],
+                "updated_at": message["timestamp"]
+            },
+            "$inc": {
+                "message_count": 1,
+                **{f"unread.{user_id}": 1 for user_id in recipients}
+            },
+            # Earlier messages are left to backfill_conversation_summaries
+            "$setOnInsert": {"counted_from": message["timestamp"]}
+        },
+        upsert=True
+    )
+
+async def backfill_conversation_summaries() -> dict:
+    """Fold messages stored before their conversation summary existed into it.
+
+    A live summary counts messages from its counted_from on, so only older
+    messages are added here, with $inc/$max so that counts the live path
+    wrote in the meantime are kept. Summaries written before counted_from
+    existed are left alone.
+    """
+    cutoff = datetime.utcnow()
+    groups = await db.messages.aggregate([
+        {"$match": {"timestamp": {"$lt": cutoff}}},
+        {"$lookup": {
+            "from": "conversations",
+            "localField": "appointment_id",
+            "foreignField": "_id",
+            "as": "summary"
+        }},
+        {"$set": {"summary": {"$arrayElemAt": ["$summary", 0]}}},
+        {"$match": {"$expr": {"$lt": ["$timestamp", {"$cond": [
+            {"$eq": [{"$type": "$summary"}, "missing"]},
+            cutoff,
+            {"$ifNull": ["$summary.counted_from", datetime(1970, 1, 1)]}
+        ]}]}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": {
+                "appointment_id": "$appointment_id",
+                "sender_id": "$sender_id",
+                "read": {"$eq": ["$read", True]},
+                # Participants whose read watermark already covers the message
+                "read_by": {"$map": {
+                    "input": {"$filter": {
+                        "input": {"$objectToArray": {"$ifNull": ["$summary.read_up_to", {}]}},
+                        "cond": {"$gte": ["$$this.v", "$timestamp"]}
+                    }},
+                    "in": "$$this.k"
+                }}
+            },
+            "last": {"$last": {
+                "_id": "$_id",
+                "message": "$message",
+                "timestamp": "$timestamp",
+                "sender_id": "$sender_id",
+                "sender_name": "$sender_name"
+            }},
+            "count": {"$sum": 1}
+        }}
+    ], allowDiskUse=True).to_list(None)
+    if not groups:
+        return {"summaries": 0}
     
-    if current_user["role"] == "patient" and appointment["patient_id"] != current_user["_id"]:
-        raise HTTPException(status_code=403, detail="Access denied")
-    if current_user["role"] == "doctor" and appointment["doctor_id"] != current_user["_id"]:
-        raise HTTPException(status_code=403, detail="Access denied")
+    summaries = {}
+    for group in groups:
+        key = group["_id"]
+        summary = summaries.setdefault(key["appointment_id"], {
+            "last": None, "count": 0, "unread": []
+        })
+        if summary["last"] is None or group["last"]["timestamp"] > summary["last"]["timestamp"]:
+            summary["last"] = group["last"]
+        summary["count"] += group["count"]
+        if not key["read"]:
+            summary["unread"].append((key["sender_id"], set(key["read_by"]), group["count"]))
     
-    messages = await db.messages.find({"appointment_id": appointment_id}).sort("timestamp", 1).to_list(1000)
+    appointments = await db.appointments.find(
+        {"_id": {"$in": list(summaries)}},
+        projection={"patient_id": 1, "doctor_id": 1}
+    ).to_list(None)
     
-    return [
-        {
-            "id": msg["_id"],
-            "sender_name": msg["sender_name"],
-            "sender_role": msg["sender_role"],
-            "message": msg["message"],
-            "timestamp": msg["timestamp"].isoformat()
+    count_ops, last_message_ops = [], []
+    for apt in appointments:
+        summary = summaries[apt["_id"]]
+        last = summary["last"]
+        unread = {
+            user_id: sum(
+                count for sender_id, read_by, count in summary["unread"]
+                if sender_id != user_id and user_id not in read_by
+            )
+            for user_id in (apt["patient_id"], apt["doctor_id"])
         }
-        for msg in messages
-    ]
+        count_ops.append(UpdateOne(
+            {"_id": apt["_id"]},
+            {
+                "$inc": {
+                    "message_count": summary["count"],
+                    **{f"unread.{user_id}": count for user_id, count in unread.items() if count}
+                },
+                "$max": {"updated_at": last["timestamp"]},
+                "$setOnInsert": {"counted_from": cutoff}
+            },
+            upsert=True
+        ))
+        last_message_ops.append(UpdateOne(
+            {"_id": apt["_id"], "$or": [
+                {"last_message": {"$exists": False}},
+                {"last_message.timestamp": {"$lt": last["timestamp"]}}
+            ]},
+            {"$set": {"last_message": {
+                "id": last["_id"],
+                "message": last["message"],
+                "timestamp": last["timestamp"],
+                "sender_id": last["sender_id"],
+                "sender_name": last["sender_name"]
+            }}}
+        ))
+    if count_ops:
+        await db.conversations.bulk_write(count_ops, ordered=False)
+        await db.conversations.bulk_write(last_message_ops, ordered=False)
+    return {"summaries": len(count_ops)}
+
+# ==================== MIGRATIONS ====================
+
+MIGRATION_BATCH_SIZE = 1000
+MIGRATION_LEASE_SECONDS = 600
+
+async def run_migration(name: str, migration):
+    """Run a one-off data migration once per database"""
+    if await db.migrations.find_one({"_id": name}):
+        return
+    # Workers start together; the lease holder migrates and the others skip
+    if not await acquire_lease(f"migration:{name}", uuid.uuid4().hex, MIGRATION_LEASE_SECONDS):
+        logger.info(f"Migration {name} is running on another worker")
+        return
+    if await db.migrations.find_one({"_id": name}):
+        return
+    result = await migration()
+    try:
+        await db.migrations.insert_one({"_id": name, "applied_at": datetime.utcnow(), "result": result})
+    except DuplicateKeyError:
+        return  # recorded by a worker whose lease had expired
+    logger.info(f"Applied migration {name}: {result}")
+
+async def backfill_appointment_schedule() -> dict:
+    """Add starts_at/duration_minutes to legacy appointments and reserve their slots"""
+    doctors = {}
+    migrated = unparsable = reserved = 0
+    cursor = db.appointments.find(
+        {"starts_at": {"$exists": False}},
+        projection={"doctor_id": 1, "appointment_date": 1, "appointment_time": 1, "status": 1}
+    ).batch_size(MIGRATION_BATCH_SIZE)
+    
+    appointment_ops, slot_ops, schedule_ops = [], [], []
+    async def flush():
+        nonlocal reserved
+        if appointment_ops:
+            await db.appointments.bulk_write(appointment_ops, ordered=False)
+        if slot_ops:
+            # Written apart from the schedule fields: a slot_key clash must
+            # not cost the appointment its starts_at
+            try:
+                result = await db.appointments.bulk_write(slot_ops, ordered=False)
+                reserved += result.modified_count
+            except BulkWriteError as e:
+                # Two legacy bookings of one slot: the later one keeps no slot_key
+                reserved += e.details["nModified"]
+                logger.warning(f"Slot conflicts during backfill: {len(e.details['writeErrors'])}")
+        if schedule_ops:
+            await db.doctor_schedules.bulk_write(schedule_ops, ordered=False)
+        appointment_ops.clear()
+        slot_ops.clear()
+        schedule_ops.clear()
+    
+    today = datetime.utcnow().date()
+    async for apt in cursor:
+        try:
+            day = availability.parse_day(apt["appointment_date"])
+            fields = schedule_fields(day, apt["appointment_time"])
+        except (ValueError, KeyError):
+            unparsable += 1
+            continue
+        
+        if apt["doctor_id"] not in doctors:
+            doctors[apt["doctor_id"]] = await db.users.find_one(
+                {"_id": apt["doctor_id"]}, projection={"available_hours": 1}
+            ) or {}
+        if apt.get("status") in ("pending", "confirmed") and day >= today:
+            try:
+                _, hours = doctor_schedule(doctors[apt["doctor_id"]])
+                index = availability.slot_index(hours, apt["appointment_time"], SLOT_MINUTES)
+                slot_ops.append(UpdateOne(
+                    {"_id": apt["_id"], "slot_key": {"$exists": False}},
+                    {"$set": slot_fields(apt["doctor_id"], day, index)}
+                ))
+                schedule_ops.append(UpdateOne(
+                    {"_id": schedule_id(apt["doctor_id"], day)},
+                    {
+                        "$bit": {"occupied": {"or": availability.slot_mask(index)}},
+                        "$setOnInsert": {"doctor_id": apt["doctor_id"], "date": day.isoformat()}
+                    },
+                    upsert=True
+                ))
+            except ValueError:
+                pass
+        
+        appointment_ops.append(UpdateOne({"_id": apt["_id"]}, {"$set": fields}))
+        migrated += 1
+        if len(appointment_ops) >= MIGRATION_BATCH_SIZE:
+            await flush()
+    await flush()
+    return {"migrated": migrated, "reserved": reserved, "unparsable": unparsable}
 
 # ==================== PAYMENT ROUTES ====================
 
@@ -522,9 +1994,16 @@ VNPAY_CLIENT_ID = "14fced4c-832c-4402-b4e1-c735fa52d9e2"
 @api_router.post("/payments/create")
 async def create_payment(
     payment_data: PaymentRequest,
+    idempotency_key: Optional[str] = Header(None),
     current_user = Depends(get_current_user)
 ):
-    appointment = await db.appointments.find_one({"_id": payment_data.appointment_id})
+    return await run_idempotent(
+        idempotency_key, "payments", current_user, payment_data.dict(),
+        lambda: open_payment(payment_data, current_user)
+    )
+
+async def open_payment(payment_data: PaymentRequest, current_user: dict):
+    appointment = await storage.appointments.find_one({"_id": payment_data.appointment_id})
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
@@ -551,7 +2030,7 @@ async def create_payment(
         "expires_at": datetime.utcnow() + timedelta(minutes=15)
     }
     
-    await db.payments.insert_one(payment_record)
+    await storage.payments.insert(payment_record)
     
     return {
         "success": True,
@@ -564,18 +2043,74 @@ async def create_payment(
         "expires_at": payment_record["expires_at"].isoformat()
     }
 
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+qr_cache = LRUCache(QR_CACHE_SIZE)
+
+def render_qr(data: str, fmt: str) -> bytes:
+    factory = qrcode.image.svg.SvgPathImage if fmt == "svg" else None
+    image = qrcode.make(data, image_factory=factory, box_size=QR_BOX_SIZE, border=2)
+    buffer = io.BytesIO()
+    image.save(buffer)
+    return buffer.getvalue()
+
+def invalidate_payment_qr(payment_id: str):
+    for fmt in QR_MEDIA_TYPES:
+        qr_cache.invalidate((payment_id, fmt))
+
+@api_router.get("/payments/{payment_id}/qr")
+async def get_payment_qr(
+    payment_id: str,
+    request: Request,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    current_user = Depends(get_current_user)
+):
+    """Ready-to-display QR image for a pending payment, cached until the payment expires"""
+    entry = qr_cache.get((payment_id, format))
+    if entry is None:
+        payment = await storage.payments.find_one(
+            {"_id": payment_id},
+            projection={"patient_id": 1, "qr_code": 1, "status": 1, "expires_at": 1}
+        )
+        if not payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        if current_user["role"] != UserRole.ADMIN and payment["patient_id"] != current_user["_id"]:
+            raise HTTPException(status_code=403, detail="Access denied")
+        remaining = (payment["expires_at"] - datetime.utcnow()).total_seconds()
+        if payment["status"] != "pending" or remaining <= 0:
+            raise HTTPException(status_code=410, detail="Payment is no longer payable")
+        
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, render_qr, payment["qr_code"], format)
+        entry = {
+            "patient_id": payment["patient_id"],
+            "body": body,
+            "etag": '"' + hashlib.sha1(body).hexdigest() + '"',
+            "expires_at": payment["expires_at"]
+        }
+        qr_cache.set((payment_id, format), entry, ttl=remaining)
+    elif current_user["role"] != UserRole.ADMIN and entry["patient_id"] != current_user["_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    max_age = max(0, int((entry["expires_at"] - datetime.utcnow()).total_seconds()))
+    headers = {"ETag": entry["etag"], "Cache-Control": f"private, max-age={max_age}"}
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type=QR_MEDIA_TYPES[format], headers=headers)
+
 @api_router.get("/payments/status/{payment_id}")
 async def get_payment_status(payment_id: str, current_user = Depends(get_current_user)):
-    payment = await db.payments.find_one({"_id": payment_id})
+    payment = await storage.payments.find_one(
+        {"_id": payment_id},
+        projection={"patient_id": 1, "status": 1, "amount": 1, "gateway": 1, "expires_at": 1}
+    )
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
+    if current_user["role"] != UserRole.ADMIN and payment["patient_id"] != current_user["_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    # Check if payment expired
+    # Check if payment expired; the lifecycle worker persists the transition
     if payment["expires_at"] < datetime.utcnow() and payment["status"] == "pending":
-        await db.payments.update_one(
-            {"_id": payment_id},
-            {"$set": {"status": "expired"}}
-        )
         return {"status": "expired"}
     
     return {
@@ -586,25 +2121,402 @@ async def get_payment_status(payment_id: str, current_user = Depends(get_current
 
 @api_router.post("/payments/confirm/{appointment_id}")
 async def confirm_payment(appointment_id: str, current_user = Depends(get_current_user)):
-    # Update appointment payment status
-    await db.appointments.update_one(
-        {"_id": appointment_id},
-        {"$set": {"payment_status": "paid", "status": "confirmed"}}
+    # Update appointment payment status, only once and only for the owner
+    appointment = await storage.appointments.find_one_and_update(
+        {
+            "_id": appointment_id,
+            "payment_status": {"$ne": "paid"},
+            "status": {"$in": APPOINTMENT_TRANSITIONS["confirmed"]},
+            **appointment_owner_filter(current_user)
+        },
+        {"$set": {"payment_status": "paid", "status": "confirmed"}, "$inc": {"version": 1}},
+        projection={"version": 1},
+        return_after=True
     )
+    if appointment is None:
+        existing = await storage.appointments.find_one(
+            {"_id": appointment_id, **appointment_owner_filter(current_user)},
+            projection={"payment_status": 1}
+        )
+        if existing and existing.get("payment_status") == "paid":
+            return {"message": "Payment already confirmed"}
+        await raise_appointment_write_error(
+            appointment_id, current_user, "Appointment cannot be confirmed"
+        )
     
-    # Update payment status
-    await db.payments.update_many(
-        {"appointment_id": appointment_id},
-        {"$set": {"status": "paid", "paid_at": datetime.utcnow()}}
-    )
+    # Settle the pending payments one conditional write each, so a payment a
+    # webhook or the sweeper settled meanwhile is neither flipped nor pushed
+    now = datetime.utcnow()
+    while True:
+        payment = await storage.payments.find_one_and_update(
+            {"appointment_id": appointment_id, "status": "pending"},
+            {"$set": {"status": "paid", "paid_at": now}},
+            projection={"patient_id": 1, "appointment_id": 1}
+        )
+        if payment is None:
+            break
+        await notify_payment_status(payment, "paid")
     
     return {"message": "Payment confirmed successfully"}
 
+# ==================== PAYMENT LIFECYCLE ====================
+
+background_tasks = []
+
+def payment_room(payment_id: str) -> str:
+    return f"payment:{payment_id}"
+
+async def notify_payment_status(payment: dict, status: str):
+    """Push a payment transition once to its watchers and to the patient's sockets"""
+    invalidate_payment_qr(payment["_id"])
+    await sio.emit("payment_status", {
+        "payment_id": payment["_id"],
+        "appointment_id": payment["appointment_id"],
+        "status": status
+    }, room=[payment_room(payment["_id"]), user_room(payment["patient_id"])])
+
+async def acquire_lease(name: str, owner: str, seconds: float) -> bool:
+    """Best-effort leader election so only one worker runs a periodic job"""
+    now = datetime.utcnow()
+    try:
+        await storage.leases.update_one(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # held by another worker
+
+async def expire_pending_payments(now: Optional[datetime] = None) -> int:
+    """Expire one batch of overdue pending payments and notify their patients"""
+    now = now or datetime.utcnow()
+    overdue = await storage.payments.find(
+        {"status": "pending", "expires_at": {"$lt": now}},
+        projection={"patient_id": 1, "appointment_id": 1},
+        sort=[("expires_at", 1)], limit=PAYMENT_SWEEP_BATCH
+    )
+    if not overdue:
+        return 0
+    
+    ids = [p["_id"] for p in overdue]
+    await storage.payments.update_many(
+        {"_id": {"$in": ids}, "status": "pending"},
+        {"$set": {"status": "expired", "expired_at": now}}
+    )
+    # Payments paid between the find and the update were left alone; only
+    # the ones this sweep stamped with expired_at are pushed
+    expired = await storage.payments.find(
+        {"_id": {"$in": ids}, "status": "expired", "expired_at": now},
+        projection={"patient_id": 1, "appointment_id": 1}
+    )
+    for payment in expired:
+        await notify_payment_status(payment, "expired")
+    return len(overdue)
+
+async def payment_sweeper():
+    """Periodically expire pending payments past their expires_at"""
+    owner = uuid.uuid4().hex
+    while True:
+        try:
+            if await acquire_lease("payment_sweeper", owner, PAYMENT_SWEEP_INTERVAL * 2):
+                while await expire_pending_payments() == PAYMENT_SWEEP_BATCH:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Payment sweep failed")
+        await asyncio.sleep(PAYMENT_SWEEP_INTERVAL)
+
+# ==================== PAYMENT NOTIFICATIONS ====================
+
+payment_notifications = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+
+def gateway_ack(gateway: str, ok: bool, message: str = "success", status_code: int = 200):
+    """Acknowledge a callback in the format each gateway expects"""
+    if gateway == "vnpay":
+        body = {"RspCode": "00" if ok else "97", "Message": "Confirm Success" if ok else message}
+    elif gateway == "zalopay":
+        body = {"return_code": 1 if ok else -1, "return_message": message}
+    else:
+        body = {"resultCode": 0 if ok else 1, "message": message}
+    return JSONResponse(body, status_code=status_code)
+
+@api_router.api_route("/payments/webhook/{gateway}", methods=["GET", "POST"])
+async def payment_webhook(gateway: str, request: Request):
+    """Gateway IPN endpoint: verify, de-duplicate and queue for batched processing"""
+    if gateway not in GATEWAY_SECRETS:
+        raise HTTPException(status_code=404, detail="Unknown gateway")
+    
+    payload = dict(request.query_params)
+    if request.method == "POST":
+        try:
+            payload.update(await request.json())
+        except ValueError:
+            payload.update(await request.form())
+    
+    try:
+        notification = gateways.parse_notification(gateway, payload, GATEWAY_SECRETS[gateway])
+    except gateways.GatewayError as e:
+        logger.warning(f"Rejected {gateway} callback: {e}")
+        return gateway_ack(gateway, False, str(e), status_code=400)
+    
+    if payment_notifications.full():
+        # Not recorded yet, so the gateway's retry will be processed
+        return gateway_ack(gateway, False, "Busy", status_code=503)
+    
+    record = {
+        "_id": f"{gateway}:{notification.notification_id}",
+        **notification._asdict(),
+        "status": "queued",
+        "received_at": datetime.utcnow()
+    }
+    try:
+        await storage.payment_notifications.insert(record)
+    except DuplicateKeyError:
+        return gateway_ack(gateway, True, "Duplicate notification")
+    try:
+        payment_notifications.put_nowait(record)
+    except asyncio.QueueFull:
+        # Filled while the record was written; it stays queued for the requeuer
+        logger.warning(f"Notification queue full, deferring {record['_id']}")
+    return gateway_ack(gateway, True)
+
+async def next_notification_batch() -> list:
+    """Wait for one notification, then gather more for up to WEBHOOK_BATCH_WAIT"""
+    batch = [await payment_notifications.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WEBHOOK_BATCH_WAIT
+    while len(batch) < WEBHOOK_BATCH_SIZE:
+        if not payment_notifications.empty():
+            batch.append(payment_notifications.get_nowait())
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(payment_notifications.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+async def apply_payment_notifications(batch: list) -> dict:
+    """Apply a batch of verified notifications with one bulk write per collection.
+
+    Each write stamps the payment with the notification's id, so re-reading
+    the payments afterwards tells which ones this batch actually changed;
+    only those are pushed to patients.
+    """
+    now = datetime.utcnow()
+    payments = {
+        p["_id"]: p for p in await storage.payments.find(
+            {"_id": {"$in": list({n["payment_id"] for n in batch})}},
+            projection={"appointment_id": 1, "patient_id": 1, "amount": 1}
+        )
+    }
+    
+    payment_ops, appointment_ops = [], []
+    outcomes = {}
+    for notification in batch:
+        payment = payments.get(notification["payment_id"])
+        if payment is None:
+            outcome = "unknown_payment"
+        elif abs(payment["amount"] - notification["amount"]) >= 1:
+            outcome = "amount_mismatch"
+        elif notification["success"]:
+            payment_ops.append((
+                {"_id": payment["_id"], "status": {"$ne": "paid"}},
+                {"$set": {
+                    "status": "paid",
+                    "paid_at": now,
+                    "gateway_transaction_id": notification["transaction_id"],
+                    "last_notification_id": notification["_id"]
+                }}
+            ))
+            appointment_ops.append((
+                {
+                    "_id": payment["appointment_id"],
+                    "payment_status": {"$ne": "paid"},
+                    "status": {"$in": APPOINTMENT_TRANSITIONS["confirmed"]}
+                },
+                {"$set": {"payment_status": "paid", "status": "confirmed"}, "$inc": {"version": 1}}
+            ))
+            outcome = "applied"
+        else:
+            payment_ops.append((
+                {"_id": payment["_id"], "status": "pending"},
+                {"$set": {
+                    "status": "failed",
+                    "failed_at": now,
+                    "last_notification_id": notification["_id"]
+                }}
+            ))
+            outcome = "failed"
+        outcomes.setdefault(outcome, []).append(notification["_id"])
+    
+    await storage.payments.bulk_update(payment_ops)
+    await storage.appointments.bulk_update(appointment_ops)
+    for outcome, ids in outcomes.items():
+        await storage.payment_notifications.update_many(
+            {"_id": {"$in": ids}},
+            {"$set": {"status": outcome, "processed_at": now}}
+        )
+    
+    if payment_ops:
+        batch_ids = {notification["_id"] for notification in batch}
+        changed = await storage.payments.find(
+            {"_id": {"$in": list({query["_id"] for query, _ in payment_ops})},
+             "last_notification_id": {"$in": list(batch_ids)}},
+            projection={"status": 1}
+        )
+        for current in changed:
+            await notify_payment_status(payments[current["_id"]], current["status"])
+    return {outcome: len(ids) for outcome, ids in outcomes.items()}
+
+async def payment_notification_worker():
+    """Drain the notification queue in batches; unprocessed records stay queued in Mongo"""
+    while True:
+        batch = await next_notification_batch()
+        try:
+            await apply_payment_notifications(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Failed to apply {len(batch)} payment notifications")
+
+async def requeue_payment_notifications(now: Optional[datetime] = None) -> int:
+    """Re-enqueue notifications left queued by a restart or a full queue.
+
+    Only records queued for WEBHOOK_REQUEUE_AFTER are taken, so the worker
+    that accepted a record normally applies it; each record is claimed with
+    requeued_at before it is enqueued here.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=WEBHOOK_REQUEUE_AFTER)
+    stale = {"$or": [{"requeued_at": {"$exists": False}}, {"requeued_at": {"$lt": cutoff}}]}
+    pending = await storage.payment_notifications.find(
+        {"status": "queued", "received_at": {"$lt": cutoff}, **stale},
+        sort=[("received_at", 1)],
+        limit=payment_notifications.maxsize - payment_notifications.qsize()
+    )
+    requeued = 0
+    for record in pending:
+        claimed = await storage.payment_notifications.update_one(
+            {"_id": record["_id"], "status": "queued", **stale},
+            {"$set": {"requeued_at": now}}
+        )
+        if claimed:
+            payment_notifications.put_nowait(record)
+            requeued += 1
+    return requeued
+
+async def notification_requeuer():
+    """Periodically requeue stale notifications from the lease-holding worker only"""
+    owner = uuid.uuid4().hex
+    while True:
+        try:
+            if await acquire_lease("payment_notification_requeue", owner, WEBHOOK_REQUEUE_AFTER * 2):
+                await requeue_payment_notifications()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Payment notification requeue failed")
+        await asyncio.sleep(WEBHOOK_REQUEUE_AFTER)
+
+# ==================== METRICS ====================
+
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint for this worker (see metrics.py)"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+# ==================== ADMIN ROUTES ====================
+
+@api_router.get("/admin/appointments/day", response_model=List[ScheduleEntry])
+async def get_admin_day_view(
+    day: date = Query(..., alias="date"),
+    doctor_id: Optional[str] = None,
+    include_cancelled: bool = False,
+    current_user = Depends(get_current_admin)
+):
+    """All appointments starting on one day, by start time"""
+    query = starts_at_range(day, day)
+    if doctor_id:
+        query["doctor_id"] = doctor_id
+    if not include_cancelled:
+        query["status"] = {"$ne": "cancelled"}
+    appointments = await storage.appointments.find(
+        query, projection=SCHEDULE_PROJECTION, sort=[("starts_at", 1)]
+    )
+    return [schedule_entry(apt) for apt in appointments]
+
+@api_router.get("/admin/stats")
+async def get_admin_stats(current_user = Depends(get_current_admin)):
+    """In-process cache and worker pool counters for this worker"""
+    return {
+        "principal_cache": principal_cache.stats(),
+        "qr_cache": qr_cache.stats(),
+        "directory_cache": {**directory_cache.stats(), "version": directory_version},
+        "password_hasher": password_hasher.stats()
+    }
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = Query(50, ge=1, le=1000),
+    current_user = Depends(get_current_admin)
+):
+    """Recent slow Mongo commands of this worker with their query plans"""
+    if slow_queries is None:
+        return {"enabled": False, "threshold_ms": None, "queries": []}
+    return {
+        "enabled": True,
+        "threshold_ms": slow_queries.threshold_ms,
+        "queries": slow_queries.snapshot(limit)
+    }
+
+@api_router.delete("/admin/slow-queries")
+async def clear_slow_queries(current_user = Depends(get_current_admin)):
+    if slow_queries is not None:
+        slow_queries.clear()
+    return {"message": "Slow query log cleared"}
+
 # ==================== SOCKET.IO EVENTS ====================
 
+def user_room(user_id: str) -> str:
+    """Personal room every authenticated socket joins, for per-user notifications"""
+    return f"user:{user_id}"
+
+def socket_token(environ, auth) -> Optional[str]:
+    """JWT from the Socket.IO auth payload, the Authorization header or ?token="""
+    if isinstance(auth, dict) and auth.get("token"):
+        return auth["token"]
+    header = environ.get("HTTP_AUTHORIZATION", "")
+    if header.lower().startswith("bearer "):
+        return header[7:]
+    for pair in environ.get("QUERY_STRING", "").split("&"):
+        key, _, value = pair.partition("=")
+        if key == "token" and value:
+            return value
+    return None
+
+async def socket_user(sid) -> dict:
+    session = await sio.get_session(sid)
+    return session["user"]
+
 @sio.event
-async def connect(sid, environ):
-    print(f"Client {sid} connected")
+async def connect(sid, environ, auth=None):
+    token = socket_token(environ, auth)
+    if not token:
+        raise socketio.exceptions.ConnectionRefusedError("Authentication required")
+    try:
+        user = await authenticate_token(token)
+    except HTTPException as e:
+        raise socketio.exceptions.ConnectionRefusedError(e.detail)
+    await sio.save_session(sid, {"user": user})
+    await sio.enter_room(sid, user_room(user["_id"]))
+    print(f"Client {sid} connected as {user['_id']}")
 
 @sio.event
 async def disconnect(sid):
@@ -613,15 +2525,83 @@ async def disconnect(sid):
 @sio.event
 async def join_room(sid, data):
     appointment_id = data.get('appointment_id')
-    if appointment_id:
-        sio.enter_room(sid, appointment_id)
-        print(f"Client {sid} joined room {appointment_id}")
+    if not appointment_id:
+        return {"error": "appointment_id is required"}
+    try:
+        await get_accessible_appointment(
+            appointment_id, await socket_user(sid), projection={"patient_id": 1, "doctor_id": 1}
+        )
+    except HTTPException as e:
+        return {"error": e.detail}
+    await sio.enter_room(sid, appointment_id)
+    print(f"Client {sid} joined room {appointment_id}")
+    return {"ok": True}
+
+@sio.on("send_message")
+async def socket_send_message(sid, data):
+    """Persist and fan out a chat message without an HTTP round trip.
+
+    Acknowledged with the stored message id and timestamp.
+    """
+    appointment_id = data.get("appointment_id")
+    text = (data.get("message") or "").strip()
+    if not appointment_id or not text:
+        return {"error": "appointment_id and message are required"}
+    user = await socket_user(sid)
+    try:
+        appointment = await get_accessible_appointment(
+            appointment_id, user, projection={"patient_id": 1, "doctor_id": 1}
+        )
+    except HTTPException as e:
+        return {"error": e.detail}
+    message = await create_message(appointment, user, text, skip_sid=sid)
+    return {"id": message["_id"], "timestamp": message["timestamp"].isoformat()}
+
+@sio.event
+async def mark_read(sid, data):
+    """Socket equivalent of POST /messages/{appointment_id}/read, acknowledged with the result"""
+    user = await socket_user(sid)
+    try:
+        await get_accessible_appointment(
+            data.get("appointment_id"), user, projection={"patient_id": 1, "doctor_id": 1}
+        )
+    except HTTPException as e:
+        return {"error": e.detail}
+    return await mark_conversation_read(data["appointment_id"], user["_id"])
+
+@sio.event
+async def watch_payment(sid, data):
+    """Subscribe to a payment's transitions; acknowledged with its current status
+    so no transition can be missed between subscribing and the first event.
+    """
+    user = await socket_user(sid)
+    payment_id = data.get("payment_id")
+    if not payment_id:
+        return {"error": "payment_id is required"}
+    # Join before reading so a transition racing this call is still delivered
+    await sio.enter_room(sid, payment_room(payment_id))
+    payment = await storage.payments.find_one(
+        {"_id": payment_id},
+        projection={"patient_id": 1, "status": 1, "expires_at": 1}
+    )
+    if not payment or (user["role"] != UserRole.ADMIN and payment["patient_id"] != user["_id"]):
+        await sio.leave_room(sid, payment_room(payment_id))
+        return {"error": "Payment not found" if not payment else "Access denied"}
+    status = payment["status"]
+    if status == "pending" and payment["expires_at"] < datetime.utcnow():
+        status = "expired"
+    return {"payment_id": payment["_id"], "status": status}
+
+@sio.event
+async def unwatch_payment(sid, data):
+    if data.get("payment_id"):
+        await sio.leave_room(sid, payment_room(data["payment_id"]))
 
 @sio.event
 async def leave_room(sid, data):
     appointment_id = data.get('appointment_id')
     if appointment_id:
-        sio.leave_room(sid, appointment_id)
+        await sio.leave_room(sid, appointment_id)
         print(f"Client {sid} left room {appointment_id}")
 
 # Include the router
@@ -633,8 +2613,20 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Has-More", "ETag", "Idempotent-Replayed"],
+)
+
+app.add_middleware(
+    compression.CompressionMiddleware,
+    minimum_size=COMPRESSION_MIN_SIZE,
+    encodings=COMPRESSION_ENCODINGS,
+    gzip_level=COMPRESSION_GZIP_LEVEL,
+    brotli_quality=COMPRESSION_BROTLI_QUALITY,
 )
 
+# Outermost, so request latency includes every other middleware
+app.add_middleware(metrics.RequestMetricsMiddleware, prefix=api_router.prefix)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -642,6 +2634,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db():
+    if slow_queries is not None:
+        slow_queries.attach(asyncio.get_running_loop(), explain_command)
+    if storage.engine == "mongo":
+        # Index builds and migrations only apply to MongoDB; the memory engine
+        # builds its indexes from REQUIRED_INDEXES and starts empty
+        if INDEX_MODE != "off":
+            await ensure_indexes(mode=INDEX_MODE)
+        await run_migration("conversation_summaries_v1", backfill_conversation_summaries)
+        await run_migration("appointment_schedule_v1", backfill_appointment_schedule)
+    if PAYMENT_SWEEP_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(payment_sweeper()))
+    background_tasks.append(asyncio.create_task(notification_requeuer()))
+    background_tasks.append(asyncio.create_task(payment_notification_worker()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
     client.close()
+    password_hasher.shutdown()
@@ -0,0 +1,121 @@
+"""
+Cross-process Socket.IO client managers.
+
+With a single uvicorn worker the default in-memory manager is enough. When
+running several workers (or nodes) every emit must reach clients connected
+to any of them, so rooms are fanned out through a pub/sub backend selected
+by SOCKETIO_MESSAGE_QUEUE:
+
+    (unset) / memory      in-process only
+    mongo / mongodb://... capped collection tailed by every worker
+    redis://, unix://     python-socketio's AsyncRedisManager (needs `redis`),
+                          also a local Redis-compatible server on a Unix socket
+    amqp://               python-socketio's AsyncAioPikaManager (needs `aio_pika`)
+
+Clients should connect with the websocket transport when several workers
+share a port, since long-polling requires sticky sessions.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+class AsyncMongoManager(AsyncPubSubManager):
+    """Pub/sub over a capped MongoDB collection read with a tailable cursor.
+
+    Works on a standalone mongod (no replica set or change streams needed),
+    so the existing database doubles as the message queue.
+
+    ObjectIds from different processes do not sort in insert order, so each
+    event carries the publisher's clock in `ts`. A listener that has to
+    reopen its cursor resumes from `resume_window` seconds before the newest
+    event it saw and skips the ones it already delivered, which tolerates
+    that much clock skew between publishers.
+    """
+    name = "mongo"
+
+    def __init__(self, url: str, db_name: str, channel: str = "socketio",
+                 write_only: bool = False, logger=None,
+                 capped_size: int = 16 * 1024 * 1024, resume_window: float = 5.0,
+                 max_idle_delay: float = 2.0):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.client = AsyncIOMotorClient(url)
+        self.collection = self.client[db_name][f"{channel}_events"]
+        self.capped_size = capped_size
+        self.resume_window = resume_window
+        self.max_idle_delay = max_idle_delay
+        self._ready = None
+
+    async def _ensure_collection(self):
+        if self._ready is None:
+            self._ready = asyncio.ensure_future(self._create_collection())
+        await self._ready
+
+    async def _create_collection(self):
+        try:
+            await self.collection.database.create_collection(
+                self.collection.name, capped=True, size=self.capped_size
+            )
+        except CollectionInvalid:
+            pass  # created by another worker
+
+    async def _publish(self, data):
+        await self._ensure_collection()
+        await self.collection.insert_one({**data, "ts": time.time()})
+
+    async def _listen(self):
+        await self._ensure_collection()
+        # Only deliver events published after this worker started listening
+        last = await self.collection.find_one(sort=[("$natural", -1)], projection={"ts": 1})
+        query = {"ts": {"$gt": last["ts"]}} if last and "ts" in last else {}
+        newest = None
+        delivered = deque()  # (ts, _id) inside the resume window, in arrival order
+        delivered_ids = set()
+        delay = 0.1
+        while True:
+            cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for message in cursor:
+                        message_id, ts = message.pop("_id"), message.pop("ts", 0.0)
+                        if message_id in delivered_ids:
+                            continue
+                        delivered.append((ts, message_id))
+                        delivered_ids.add(message_id)
+                        newest = ts if newest is None else max(newest, ts)
+                        while delivered and delivered[0][0] < newest - self.resume_window:
+                            delivered_ids.discard(delivered.popleft()[1])
+                        delay = 0.1
+                        yield message
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._get_logger().exception("Mongo pubsub cursor failed, retrying")
+            finally:
+                await cursor.close()
+            if newest is not None:
+                query = {"ts": {"$gte": newest - self.resume_window}}
+            # An empty capped collection returns a dead cursor immediately, so
+            # idle workers back off instead of polling
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_idle_delay)
+
+def create_client_manager(url: Optional[str], mongo_url: str, db_name: str):
+    """Build the client manager for SOCKETIO_MESSAGE_QUEUE, or None for in-memory"""
+    if not url or url == "memory":
+        return None
+    if url == "mongo" or url.startswith(("mongodb://", "mongodb+srv://")):
+        return AsyncMongoManager(mongo_url if url == "mongo" else url, db_name)
+    scheme = url.split("://", 1)[0].split("+", 1)[0].lower()
+    if scheme in ("redis", "rediss", "valkey", "valkeys", "unix"):
+        return socketio.AsyncRedisManager(url)
+    if scheme in ("amqp", "amqps"):
+        return socketio.AsyncAioPikaManager(url)
+    raise ValueError(f"Unsupported SOCKETIO_MESSAGE_QUEUE: {url}")
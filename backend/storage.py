@@ -0,0 +1,681 @@
+"""
+Storage engines behind the route handlers.
+
+Handlers talk to one repository per collection through a small async API
+(get / find_one / find / insert / update_one / update_many /
+find_one_and_update / delete_one / bulk_update / count) using Mongo query
+and update documents. STORAGE_ENGINE selects the implementation:
+
+    mongo   MotorRepository, a thin wrapper over the Motor collection
+    memory  MemoryRepository, documents in a dict with the same semantics for
+            the operators the handlers use; unique indexes are enforced and
+            the first field of every index gets a hash index (equality, $in)
+            and a sorted list (ranges), built from REQUIRED_INDEXES
+
+The memory engine needs no server, so handler logic can be unit tested and
+profiled in isolation, and comparing the two engines separates Mongo I/O
+from handler CPU. It does not enforce TTL indexes or run aggregations other
+than the domain queries defined here.
+"""
+
+import copy
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+COLLECTIONS = [
+    "users", "appointments", "messages", "conversations", "payments",
+    "doctor_schedules", "idempotency_keys", "leases", "payment_notifications",
+]
+
+# ==================== MOTOR ====================
+
+class MotorRepository:
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    async def get(self, doc_id, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.collection.find_one({"_id": doc_id}, projection=projection)
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None,
+                       sort: Optional[list] = None) -> Optional[dict]:
+        return await self.collection.find_one(query, projection=projection, sort=sort)
+
+    async def find(self, query: dict, projection: Optional[dict] = None,
+                   sort: Optional[list] = None, limit: int = 0) -> List[dict]:
+        cursor = self.collection.find(query, projection=projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(limit or None)
+
+    async def insert(self, document: dict):
+        await self.collection.insert_one(document)
+
+    async def update_one(self, query: dict, update, upsert: bool = False) -> bool:
+        """True when a document matched (or was upserted)"""
+        result = await self.collection.update_one(query, update, upsert=upsert)
+        return result.matched_count > 0 or result.upserted_id is not None
+
+    async def update_many(self, query: dict, update) -> int:
+        result = await self.collection.update_many(query, update)
+        return result.modified_count
+
+    async def find_one_and_update(self, query: dict, update, projection: Optional[dict] = None,
+                                  return_after: bool = False, upsert: bool = False) -> Optional[dict]:
+        return await self.collection.find_one_and_update(
+            query, update, projection=projection, upsert=upsert,
+            return_document=ReturnDocument.AFTER if return_after else ReturnDocument.BEFORE
+        )
+
+    async def delete_one(self, query: dict) -> bool:
+        result = await self.collection.delete_one(query)
+        return result.deleted_count > 0
+
+    async def bulk_update(self, operations: List[Tuple[dict, dict]]):
+        """Unordered (query, update) pairs; raises BulkWriteError after applying the rest"""
+        if operations:
+            await self.collection.bulk_write(
+                [UpdateOne(query, update) for query, update in operations], ordered=False
+            )
+
+    async def count(self, query: Optional[dict] = None) -> int:
+        if not query:
+            return await self.collection.estimated_document_count()
+        return await self.collection.count_documents(query)
+
+def conversations_pipeline(query: dict, limit: int) -> list:
+    """Newest appointments joined with their conversation summary, keeping
+    those that have messages or are confirmed/completed"""
+    return [
+        {"$match": query},
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "conversations",
+            "localField": "_id",
+            "foreignField": "_id",
+            "as": "conversation"
+        }},
+        {"$unwind": {"path": "$conversation", "preserveNullAndEmptyArrays": True}},
+        {"$match": {"$or": [
+            {"conversation.last_message": {"$exists": True}},
+            {"status": {"$in": ["confirmed", "completed"]}}
+        ]}},
+        {"$project": {
+            "patient_name": 1,
+            "doctor_name": 1,
+            "specialization": 1,
+            "appointment_date": 1,
+            "appointment_time": 1,
+            "status": 1,
+            "last_message": "$conversation.last_message",
+            "unread": "$conversation.unread"
+        }}
+    ]
+
+class MotorAppointments(MotorRepository):
+    async def with_conversations(self, query: dict, limit: int) -> List[dict]:
+        return await self.collection.aggregate(conversations_pipeline(query, limit)).to_list(limit)
+
+# ==================== MEMORY ====================
+
+MISSING = object()
+
+def get_path(document, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+def set_path(document: dict, path: str, value):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[leaf] = value
+
+def unset_path(document: dict, path: str):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(leaf, None)
+
+def type_rank(value) -> int:
+    """BSON comparison order of the types the app stores"""
+    if value is MISSING or value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, datetime):
+        return 9
+    return 6
+
+def sort_key(value):
+    rank = type_rank(value)
+    if rank == 1:
+        return (1, 0)
+    if rank in (4, 5, 6):
+        return (rank, repr(value))
+    return (rank, value)
+
+def equals(value, expected) -> bool:
+    if value is MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return any(equals(item, expected) for item in value)
+    return type_rank(value) == type_rank(expected) and value == expected
+
+def compare(value, op: str, bound) -> bool:
+    # Ranges only match values of the same type, as in Mongo
+    if value is MISSING or type_rank(value) != type_rank(bound):
+        return False
+    if op == "$gt":
+        return value > bound
+    if op == "$gte":
+        return value >= bound
+    if op == "$lt":
+        return value < bound
+    return value <= bound
+
+def is_operator_document(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+def match_condition(value, condition) -> bool:
+    if not is_operator_document(condition):
+        return equals(value, condition)
+    for op, argument in condition.items():
+        if op == "$eq":
+            matched = equals(value, argument)
+        elif op == "$ne":
+            matched = not equals(value, argument)
+        elif op == "$in":
+            matched = any(equals(value, item) for item in argument)
+        elif op == "$nin":
+            matched = not any(equals(value, item) for item in argument)
+        elif op == "$exists":
+            matched = (value is not MISSING) == bool(argument)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            matched = compare(value, op, argument)
+        elif op == "$bitsAllClear":
+            matched = isinstance(value, int) and not value & argument
+        elif op == "$bitsAllSet":
+            matched = isinstance(value, int) and value & argument == argument
+        else:
+            raise ValueError(f"Unsupported query operator: {op}")
+        if not matched:
+            return False
+    return True
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif not match_condition(get_path(document, key), condition):
+            return False
+    return True
+
+def resolve_expression(document: dict, value):
+    """Aggregation expressions used in pipeline updates: "$field.path" references"""
+    if isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+        return copy.deepcopy(get_path(document, value[1:]))
+    return copy.deepcopy(value)
+
+def apply_update(document: dict, update, inserting: bool = False):
+    if isinstance(update, list):
+        for stage in update:
+            for op, fields in stage.items():
+                if op in ("$set", "$addFields"):
+                    for path, value in fields.items():
+                        resolved = resolve_expression(document, value)
+                        if resolved is MISSING:
+                            unset_path(document, path)
+                        else:
+                            set_path(document, path, resolved)
+                elif op == "$unset":
+                    for path in [fields] if isinstance(fields, str) else fields:
+                        unset_path(document, path)
+                else:
+                    raise ValueError(f"Unsupported pipeline update stage: {op}")
+        return
+
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                set_path(document, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                unset_path(document, path)
+            elif op == "$inc":
+                current = get_path(document, path)
+                set_path(document, path, value if current is MISSING else current + value)
+            elif op == "$bit":
+                current = get_path(document, path)
+                result = 0 if current is MISSING else current
+                for bit_op, mask in value.items():
+                    if bit_op == "and":
+                        result &= mask
+                    elif bit_op == "or":
+                        result |= mask
+                    elif bit_op == "xor":
+                        result ^= mask
+                    else:
+                        raise ValueError(f"Unsupported $bit operation: {bit_op}")
+                set_path(document, path, result)
+            else:
+                raise ValueError(f"Unsupported update operator: {op}")
+
+def upsert_document(query: dict) -> dict:
+    """Seed of an upserted document: the query's equality conditions"""
+    document = {}
+    for key, condition in query.items():
+        if not key.startswith("$") and not is_operator_document(condition):
+            set_path(document, key, copy.deepcopy(condition))
+    return document
+
+def project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+    included = [path for path, flag in projection.items() if flag and path != "_id"]
+    if included:
+        result = {}
+        if projection.get("_id", 1):
+            result["_id"] = document["_id"]
+        for path in included:
+            value = get_path(document, path)
+            if value is not MISSING:
+                set_path(result, path, copy.deepcopy(value))
+        return result
+    result = copy.deepcopy(document)
+    for path, flag in projection.items():
+        if not flag:
+            unset_path(result, path)
+    return result
+
+def sort_documents(documents: list, sort) -> list:
+    spec = list(sort.items()) if isinstance(sort, dict) else list(sort)
+    # Stable sorts from the last key to the first give a compound order
+    for field, direction in reversed(spec):
+        documents.sort(key=lambda document: sort_key(get_path(document, field)), reverse=direction < 0)
+    return documents
+
+class _Top:
+    """Sorts after every document id, for inclusive upper bounds in sorted indexes"""
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, _Top)
+
+TOP = _Top()
+
+class FieldIndex:
+    """Secondary index on one field: a hash index for equality and a sorted list for ranges"""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.by_value = defaultdict(set)
+        self.ordered = []  # sorted (sort_key(value), _id)
+
+    def values(self, document: dict) -> list:
+        value = get_path(document, self.field)
+        return list(value) if isinstance(value, list) and value else [value]
+
+    def add(self, document: dict):
+        for value in self.values(document):
+            key = sort_key(value)
+            self.by_value[key].add(document["_id"])
+            insort(self.ordered, (key, document["_id"]))
+
+    def remove(self, document: dict):
+        for value in self.values(document):
+            key = sort_key(value)
+            ids = self.by_value.get(key)
+            if ids is not None:
+                ids.discard(document["_id"])
+                if not ids:
+                    del self.by_value[key]
+            position = bisect_left(self.ordered, (key, document["_id"]))
+            if position < len(self.ordered) and self.ordered[position] == (key, document["_id"]):
+                del self.ordered[position]
+
+    def lookup(self, condition) -> Optional[set]:
+        """Candidate ids for a condition on this field, or None when it cannot narrow"""
+        if not is_operator_document(condition):
+            return set(self.by_value.get(sort_key(condition), ()))
+        if "$eq" in condition:
+            return set(self.by_value.get(sort_key(condition["$eq"]), ()))
+        if "$in" in condition:
+            ids = set()
+            for item in condition["$in"]:
+                ids |= self.by_value.get(sort_key(item), set())
+            return ids
+        lower = condition.get("$gte", condition.get("$gt", MISSING))
+        upper = condition.get("$lte", condition.get("$lt", MISSING))
+        if lower is MISSING and upper is MISSING:
+            return None
+        # Inclusive bounds; the matcher applies the exact operators afterwards
+        start = 0 if lower is MISSING else bisect_left(self.ordered, (sort_key(lower),))
+        end = len(self.ordered) if upper is MISSING else bisect_right(self.ordered, (sort_key(upper), TOP))
+        return {doc_id for _, doc_id in self.ordered[start:end]}
+
+class UniqueIndex:
+    def __init__(self, name: str, fields: List[str], partial: Optional[dict] = None):
+        self.name = name
+        self.fields = fields
+        self.partial = partial
+        self.owners = {}
+
+    def key(self, document: dict):
+        if self.partial and not matches(document, self.partial):
+            return None
+        return tuple(sort_key(get_path(document, field)) for field in self.fields)
+
+    def check(self, document: dict):
+        key = self.key(document)
+        if key is not None and self.owners.get(key, document["_id"]) != document["_id"]:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error index: {self.name}", code=11000
+            )
+
+    def add(self, document: dict):
+        key = self.key(document)
+        if key is not None:
+            self.owners[key] = document["_id"]
+
+    def remove(self, document: dict):
+        key = self.key(document)
+        if key is not None and self.owners.get(key) == document["_id"]:
+            del self.owners[key]
+
+class MemoryRepository:
+    def __init__(self, name: str, indexes: Iterable = ()):
+        self.name = name
+        self.documents = {}
+        self.field_indexes = {}
+        self.unique_indexes = []
+        for index in indexes:
+            spec = getattr(index, "document", index)  # IndexModel or its document
+            fields = list(spec["key"])
+            if fields[0] != "_id" and fields[0] not in self.field_indexes:
+                self.field_indexes[fields[0]] = FieldIndex(fields[0])
+            if spec.get("unique"):
+                self.unique_indexes.append(
+                    UniqueIndex(spec.get("name", "_".join(fields)), fields, spec.get("partialFilterExpression"))
+                )
+
+    # Index maintenance
+
+    def _store(self, document: dict):
+        for index in self.unique_indexes:
+            index.check(document)
+        previous = self.documents.get(document["_id"])
+        if previous is not None:
+            self._unindex(previous)
+        self.documents[document["_id"]] = document
+        for index in self.unique_indexes:
+            index.add(document)
+        for index in self.field_indexes.values():
+            index.add(document)
+
+    def _unindex(self, document: dict):
+        for index in self.unique_indexes:
+            index.remove(document)
+        for index in self.field_indexes.values():
+            index.remove(document)
+
+    def _candidates(self, query: dict) -> Iterable[dict]:
+        """Narrow by _id or the most selective indexed field, then match"""
+        best = None
+        if "_id" in query:
+            condition = query["_id"]
+            if not is_operator_document(condition):
+                best = {condition}
+            elif "$in" in condition:
+                best = set(condition["$in"])
+        if best is None:
+            for field, condition in query.items():
+                index = self.field_indexes.get(field)
+                ids = index.lookup(condition) if index else None
+                if ids is not None and (best is None or len(ids) < len(best)):
+                    best = ids
+        if best is None:
+            documents = list(self.documents.values())
+        else:
+            documents = [self.documents[doc_id] for doc_id in best if doc_id in self.documents]
+        return [document for document in documents if matches(document, query)]
+
+    def _first(self, query: dict, sort=None) -> Optional[dict]:
+        candidates = self._candidates(query)
+        if sort:
+            sort_documents(candidates, sort)
+        return candidates[0] if candidates else None
+
+    # Repository API
+
+    async def get(self, doc_id, projection: Optional[dict] = None) -> Optional[dict]:
+        document = self.documents.get(doc_id)
+        return project(document, projection) if document is not None else None
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None,
+                       sort: Optional[list] = None) -> Optional[dict]:
+        document = self._first(query, sort)
+        return project(document, projection) if document is not None else None
+
+    async def find(self, query: dict, projection: Optional[dict] = None,
+                   sort: Optional[list] = None, limit: int = 0) -> List[dict]:
+        documents = self._candidates(query)
+        if sort:
+            sort_documents(documents, sort)
+        if limit:
+            documents = documents[:limit]
+        return [project(document, projection) for document in documents]
+
+    async def insert(self, document: dict):
+        if document.get("_id") in self.documents:
+            raise DuplicateKeyError("E11000 duplicate key error index: _id_", code=11000)
+        self._store(copy.deepcopy(document))
+
+    def _update(self, document: dict, update) -> dict:
+        updated = copy.deepcopy(document)
+        apply_update(updated, update)
+        self._store(updated)
+        return updated
+
+    def _upsert(self, query: dict, update) -> dict:
+        document = upsert_document(query)
+        if isinstance(update, list):
+            apply_update(document, update)
+        else:
+            apply_update(document, update, inserting=True)
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError("E11000 duplicate key error index: _id_", code=11000)
+        self._store(document)
+        return document
+
+    async def update_one(self, query: dict, update, upsert: bool = False) -> bool:
+        document = self._first(query)
+        if document is not None:
+            self._update(document, update)
+            return True
+        if upsert:
+            self._upsert(query, update)
+            return True
+        return False
+
+    async def update_many(self, query: dict, update) -> int:
+        """Number of documents the update changed, like Mongo's modified_count"""
+        modified = 0
+        for document in self._candidates(query):
+            if self._update(document, update) != document:
+                modified += 1
+        return modified
+
+    async def find_one_and_update(self, query: dict, update, projection: Optional[dict] = None,
+                                  return_after: bool = False, upsert: bool = False) -> Optional[dict]:
+        document = self._first(query)
+        if document is None:
+            if not upsert:
+                return None
+            created = self._upsert(query, update)
+            return project(created, projection) if return_after else None
+        updated = self._update(document, update)
+        return project(updated if return_after else document, projection)
+
+    async def delete_one(self, query: dict) -> bool:
+        document = self._first(query)
+        if document is None:
+            return False
+        self._unindex(document)
+        del self.documents[document["_id"]]
+        return True
+
+    async def bulk_update(self, operations: List[Tuple[dict, dict]]):
+        errors = []
+        for index, (query, update) in enumerate(operations):
+            try:
+                await self.update_one(query, update)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def count(self, query: Optional[dict] = None) -> int:
+        if not query:
+            return len(self.documents)
+        return len(self._candidates(query))
+
+class MemoryAppointments(MemoryRepository):
+    def __init__(self, name: str, indexes: Iterable, conversations: MemoryRepository):
+        super().__init__(name, indexes)
+        self.conversations = conversations
+
+    async def with_conversations(self, query: dict, limit: int) -> List[dict]:
+        documents = sort_documents(self._candidates(query), [("created_at", -1)])[:limit]
+        results = []
+        for document in documents:
+            conversation = self.conversations.documents.get(document["_id"], {})
+            if "last_message" not in conversation and document.get("status") not in ("confirmed", "completed"):
+                continue
+            result = project(document, {
+                "patient_name": 1, "doctor_name": 1, "specialization": 1,
+                "appointment_date": 1, "appointment_time": 1, "status": 1
+            })
+            for field, source in (("last_message", "last_message"), ("unread", "unread")):
+                if source in conversation:
+                    result[field] = copy.deepcopy(conversation[source])
+            results.append(result)
+        return results
+
+# ==================== WRITE HOOKS ====================
+
+class InvalidatingRepository:
+    """A repository that reports every write to `on_write(doc_id)`, e.g. to
+    drop cached copies. doc_id is None when the write is not pinned to one
+    _id (update_many, bulk_update, queries on other fields).
+    """
+
+    def __init__(self, repository, on_write):
+        self.repository = repository
+        self.on_write = on_write
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+    def _written(self, query: dict):
+        doc_id = query.get("_id")
+        self.on_write(None if doc_id is None or is_operator_document(doc_id) else doc_id)
+
+    async def insert(self, document: dict):
+        try:
+            await self.repository.insert(document)
+        finally:
+            self._written(document)
+
+    async def update_one(self, query: dict, update, upsert: bool = False) -> bool:
+        try:
+            return await self.repository.update_one(query, update, upsert=upsert)
+        finally:
+            self._written(query)
+
+    async def update_many(self, query: dict, update) -> int:
+        try:
+            return await self.repository.update_many(query, update)
+        finally:
+            self.on_write(None)
+
+    async def find_one_and_update(self, query: dict, update, projection: Optional[dict] = None,
+                                  return_after: bool = False, upsert: bool = False) -> Optional[dict]:
+        try:
+            return await self.repository.find_one_and_update(
+                query, update, projection=projection, return_after=return_after, upsert=upsert
+            )
+        finally:
+            self._written(query)
+
+    async def delete_one(self, query: dict) -> bool:
+        try:
+            return await self.repository.delete_one(query)
+        finally:
+            self._written(query)
+
+    async def bulk_update(self, operations: List[Tuple[dict, dict]]):
+        try:
+            await self.repository.bulk_update(operations)
+        finally:
+            self.on_write(None)
+
+# ==================== STORAGE ====================
+
+class Storage:
+    """One repository per collection, e.g. storage.appointments"""
+
+    def __init__(self, engine: str, repositories: dict):
+        self.engine = engine
+        for name, repository in repositories.items():
+            setattr(self, name, repository)
+
+def create_storage(engine: str, database=None, indexes: Optional[dict] = None) -> Storage:
+    """Build the repositories for STORAGE_ENGINE ('mongo' needs the Motor database)"""
+    if engine == "mongo":
+        repositories = {name: MotorRepository(database[name]) for name in COLLECTIONS}
+        repositories["appointments"] = MotorAppointments(database["appointments"])
+        return Storage(engine, repositories)
+    if engine == "memory":
+        indexes = indexes or {}
+        repositories = {name: MemoryRepository(name, indexes.get(name, ())) for name in COLLECTIONS}
+        repositories["appointments"] = MemoryAppointments(
+            "appointments", indexes.get("appointments", ()), repositories["conversations"]
+        )
+        return Storage(engine, repositories)
+    raise ValueError(f"Unsupported STORAGE_ENGINE: {engine}")
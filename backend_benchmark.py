@@ -0,0 +1,845 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmarks for Clinic Booking Application
+Measures throughput and latency of backend endpoints under concurrent load.
+
+Usage: python backend_benchmark.py [benchmark ...]
+Set BENCH_BASE_URL to point at a running backend (default: local uvicorn).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import uuid
+import threading
+import statistics
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+import availability
+
+# Configuration
+BASE_URL = os.environ.get("BENCH_BASE_URL", "http://localhost:8001/api")
+HEADERS = {"Content-Type": "application/json"}
+CONCURRENCY = int(os.environ.get("BENCH_CONCURRENCY", 32))
+DURATION = float(os.environ.get("BENCH_DURATION", 10))
+
+def print_bench_header(name):
+    print(f"\n{'='*60}")
+    print(f"BENCHMARK: {name}")
+    print(f"{'='*60}")
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(name, latencies, errors, elapsed):
+    """Summarize latencies (in seconds) as a machine-readable dict"""
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def print_summary(summary):
+    print(f"📊 {summary['name']}")
+    print(f"   Requests: {summary['requests']}  Errors: {summary['errors']}  "
+          f"Throughput: {summary['throughput_rps']} req/s")
+    print(f"   p50: {summary['p50_ms']} ms  p95: {summary['p95_ms']} ms  "
+          f"p99: {summary['p99_ms']} ms")
+
+def drive(name, request_fn, workers, duration, stop_event=None):
+    """Call request_fn from `workers` threads for `duration` seconds.
+
+    request_fn(session) must return True on success.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            started = time.perf_counter()
+            try:
+                ok = request_fn(session)
+            except Exception:
+                ok = False
+            took = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(took)
+                else:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(worker)
+    return summarize(name, latencies, errors[0], time.perf_counter() - started)
+
+def register_user(role="patient", **extra):
+    user = {
+        "email": f"bench_{role}_{uuid.uuid4().hex[:10]}@bench.vn",
+        "password": "matkhau123",
+        "full_name": f"Bench {role.capitalize()}",
+        "phone": "0900000000",
+        "role": role,
+        **extra
+    }
+    response = requests.post(f"{BASE_URL}/auth/register", json=user, headers=HEADERS)
+    response.raise_for_status()
+    data = response.json()
+    return user, data["token"], data["user"]["id"]
+
+# ==================== BENCHMARKS ====================
+
+def bench_login():
+    """Login throughput and latency of unrelated endpoints during a login burst"""
+    print_bench_header("LOGIN BURST vs UNRELATED ENDPOINTS")
+    user, _, _ = register_user()
+    credentials = {"email": user["email"], "password": user["password"]}
+
+    def do_login(session):
+        response = session.post(f"{BASE_URL}/auth/login", json=credentials, headers=HEADERS)
+        return response.status_code == 200
+
+    def do_specializations(session):
+        response = session.get(f"{BASE_URL}/specializations", headers=HEADERS)
+        return response.status_code == 200
+
+    baseline = drive("specializations (idle)", do_specializations, 4, DURATION / 2)
+
+    results = {}
+    def run_logins():
+        results["login"] = drive("login (concurrent)", do_login, CONCURRENCY, DURATION)
+
+    login_thread = threading.Thread(target=run_logins)
+    login_thread.start()
+    time.sleep(0.5)
+    under_load = drive("specializations (during logins)", do_specializations, 4, DURATION - 1)
+    login_thread.join()
+
+    summaries = [baseline, results["login"], under_load]
+    for summary in summaries:
+        print_summary(summary)
+    return summaries
+
+def auth_headers(token):
+    return {**HEADERS, "Authorization": f"Bearer {token}"}
+
+# The backend's default working hours and slot length; both ends of the
+# hours are bookable, so the slot count comes from availability.slot_count
+DEFAULT_HOURS = "08:00-17:00"
+SLOT_MINUTES = int(os.environ.get("APPOINTMENT_SLOT_MINUTES", 30))
+SLOT_TIMES = availability.slot_times(DEFAULT_HOURS, SLOT_MINUTES)
+SLOTS_PER_DAY = availability.slot_count(DEFAULT_HOURS, SLOT_MINUTES)
+
+def booking_slot(i, first_day=None):
+    """Date and time of the i-th distinct bookable slot, filling days from tomorrow on"""
+    first_day = first_day or datetime.utcnow().date() + timedelta(days=1)
+    day = first_day + timedelta(days=i // SLOTS_PER_DAY)
+    return day.isoformat(), SLOT_TIMES[i % SLOTS_PER_DAY]
+
+def seed_conversations(count):
+    """Create one doctor with `count` appointments, each with one message"""
+    _, doctor_token, doctor_id = register_user("doctor", specialization="Nội khoa")
+    _, patient_token, _ = register_user("patient")
+    first_day = datetime.utcnow().date() + timedelta(days=1)
+
+    def seed_one(i):
+        session = requests.Session()
+        day, time_value = booking_slot(i, first_day)
+        response = session.post(f"{BASE_URL}/appointments", json={
+            "doctor_id": doctor_id,
+            "appointment_date": day,
+            "appointment_time": time_value,
+            "notes": f"Bench appointment {i}"
+        }, headers=auth_headers(patient_token))
+        response.raise_for_status()
+        session.post(f"{BASE_URL}/messages", json={
+            "appointment_id": response.json()["id"],
+            "message": f"Chào bác sĩ, tôi muốn hỏi về lịch khám số {i}"
+        }, headers=auth_headers(patient_token)).raise_for_status()
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        list(pool.map(seed_one, range(count)))
+    return doctor_token, patient_token
+
+def bench_chats():
+    """GET /chats latency for a doctor with many conversations"""
+    conversations = int(os.environ.get("BENCH_CONVERSATIONS", 1000))
+    print_bench_header(f"CHAT LIST ({conversations} CONVERSATIONS PER DOCTOR)")
+    doctor_token, patient_token = seed_conversations(conversations)
+
+    def chats_as(token):
+        def do_chats(session):
+            response = session.get(f"{BASE_URL}/chats", headers=auth_headers(token))
+            return response.status_code == 200
+        return do_chats
+
+    summaries = [
+        drive("chats (doctor)", chats_as(doctor_token), CONCURRENCY, DURATION),
+        drive("chats (patient)", chats_as(patient_token), CONCURRENCY, DURATION),
+    ]
+    for summary in summaries:
+        print_summary(summary)
+    return summaries
+
+def bench_availability():
+    """Availability search over a specialization with many doctors"""
+    doctors = int(os.environ.get("BENCH_DOCTORS", 300))
+    specialization = f"Bench {uuid.uuid4().hex[:6]}"
+    print_bench_header(f"AVAILABILITY SEARCH ({doctors} DOCTORS, 30 DAYS)")
+    _, patient_token, _ = register_user("patient")
+
+    def seed_doctor(i):
+        _, _, doctor_id = register_user("doctor", specialization=specialization)
+        # Book the first morning slots so the search has to skip occupied bits
+        day = (datetime.utcnow().date() + timedelta(days=1 + i % 5)).isoformat()
+        for slot_time in ("08:00", "08:30"):
+            requests.post(f"{BASE_URL}/appointments", json={
+                "doctor_id": doctor_id,
+                "appointment_date": day,
+                "appointment_time": slot_time
+            }, headers=auth_headers(patient_token))
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        list(pool.map(seed_doctor, range(doctors)))
+
+    def do_search(session):
+        response = session.get(f"{BASE_URL}/availability", params={
+            "specialization": specialization,
+            "limit": 5
+        }, headers=HEADERS)
+        return response.status_code == 200 and len(response.json()) == doctors
+
+    summaries = [
+        drive("availability (single client)", do_search, 1, DURATION),
+        drive("availability (concurrent)", do_search, CONCURRENCY, DURATION),
+    ]
+    for summary in summaries:
+        print_summary(summary)
+    return summaries
+
+def bench_socket_fanout():
+    """End-to-end chat delivery latency with many Socket.IO clients.
+
+    Run the backend with several workers sharing a message queue, e.g.
+    SOCKETIO_MESSAGE_QUEUE=mongo uvicorn server:socket_app --workers 4.
+    Requires the optional `aiohttp` package for socketio.AsyncClient.
+    """
+    import asyncio
+    import socketio
+
+    clients_total = int(os.environ.get("BENCH_SOCKET_CLIENTS", 10000))
+    rooms = int(os.environ.get("BENCH_SOCKET_ROOMS", 100))
+    messages_per_room = int(os.environ.get("BENCH_SOCKET_MESSAGES", 20))
+    socket_url = BASE_URL.rsplit("/api", 1)[0]
+    print_bench_header(f"SOCKET.IO FAN-OUT ({clients_total} CLIENTS, {rooms} ROOMS)")
+
+    _, doctor_token, doctor_id = register_user("doctor", specialization="Nội khoa")
+    _, patient_token, _ = register_user("patient")
+    appointment_ids = []
+    first_day = datetime.utcnow().date() + timedelta(days=1)
+    for i in range(rooms):
+        day, time_value = booking_slot(i, first_day)
+        response = requests.post(f"{BASE_URL}/appointments", json={
+            "doctor_id": doctor_id,
+            "appointment_date": day,
+            "appointment_time": time_value
+        }, headers=auth_headers(patient_token))
+        response.raise_for_status()
+        appointment_ids.append(response.json()["id"])
+
+    latencies = []
+    expected = [0]
+
+    async def connect_client(index):
+        client = socketio.AsyncClient(reconnection=False)
+        room = appointment_ids[index % rooms]
+
+        @client.on("new_message")
+        async def on_message(data):
+            sent_at = float(data["message"].split("|", 1)[0])
+            latencies.append(time.time() - sent_at)
+
+        await client.connect(socket_url, auth={"token": patient_token},
+                             transports=["websocket"], socketio_path="socket.io")
+        await client.call("join_room", {"appointment_id": room})
+        return client
+
+    async def run():
+        connected = []
+        for start in range(0, clients_total, 500):
+            batch = range(start, min(start + 500, clients_total))
+            connected += await asyncio.gather(*(connect_client(i) for i in batch))
+        print(f"   Connected {len(connected)} clients")
+
+        sender = socketio.AsyncClient(reconnection=False)
+        await sender.connect(socket_url, auth={"token": doctor_token},
+                             transports=["websocket"], socketio_path="socket.io")
+        started = time.perf_counter()
+        for _ in range(messages_per_room):
+            await asyncio.gather(*(
+                sender.call("send_message", {
+                    "appointment_id": room,
+                    "message": f"{time.time()}|Kết quả xét nghiệm đã có"
+                })
+                for room in appointment_ids
+            ))
+            # Every client sits in exactly one room
+            expected[0] += clients_total
+        deadline = time.time() + 30
+        while len(latencies) < expected[0] and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+        await sender.disconnect()
+        await asyncio.gather(*(client.disconnect() for client in connected))
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    summary = summarize("socket delivery", latencies, expected[0] - len(latencies), elapsed)
+    print_summary(summary)
+    return [summary]
+
+class GatewaySimulator:
+    """Produces signed IPN callbacks the way vnpay/momo/zalopay would send them"""
+
+    def __init__(self, gateway, secret):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+        import gateways
+        self.gateways = gateways
+        self.gateway = gateway
+        self.secret = secret
+
+    def callback(self, payment_id, amount, transaction_id, success=True):
+        if self.gateway == "vnpay":
+            params = {
+                "vnp_TmnCode": "CLINIC01",
+                "vnp_Amount": str(int(amount * 100)),
+                "vnp_TxnRef": payment_id,
+                "vnp_TransactionNo": transaction_id,
+                "vnp_ResponseCode": "00" if success else "24",
+                "vnp_TransactionStatus": "00" if success else "02",
+                "vnp_OrderInfo": f"Thanh toan lich kham {payment_id}",
+                "vnp_PayDate": datetime.utcnow().strftime("%Y%m%d%H%M%S"),
+            }
+        elif self.gateway == "momo":
+            params = {
+                "partnerCode": "CLINIC01", "accessKey": "bench", "requestId": transaction_id,
+                "amount": str(int(amount)), "orderId": payment_id, "orderInfo": "Thanh toan lich kham",
+                "orderType": "momo_wallet", "transId": transaction_id, "resultCode": 0 if success else 1006,
+                "message": "Successful." if success else "Rejected", "payType": "qr",
+                "responseTime": int(time.time() * 1000), "extraData": "",
+            }
+        else:
+            params = {
+                "app_id": 2553, "app_trans_id": payment_id, "zp_trans_id": transaction_id,
+                "amount": int(amount), "server_time": int(time.time() * 1000),
+            }
+        return self.gateways.sign(self.gateway, params, self.secret)
+
+    def send(self, session, payload):
+        url = f"{BASE_URL}/payments/webhook/{self.gateway}"
+        if self.gateway == "vnpay":
+            return session.get(url, params=payload)
+        return session.post(url, json=payload, headers=HEADERS)
+
+def bench_webhooks():
+    """Gateway callback ingestion throughput, including duplicate deliveries.
+
+    BENCH_GATEWAY_SECRET must match the backend's secret for BENCH_GATEWAY.
+    """
+    gateway = os.environ.get("BENCH_GATEWAY", "vnpay")
+    secret = os.environ.get("BENCH_GATEWAY_SECRET", "bench-secret")
+    count = int(os.environ.get("BENCH_WEBHOOKS", 5000))
+    print_bench_header(f"GATEWAY WEBHOOKS ({gateway}, {count} CALLBACKS)")
+
+    _, _, doctor_id = register_user("doctor", specialization="Nội khoa")
+    _, patient_token, _ = register_user("patient")
+    response = requests.post(f"{BASE_URL}/appointments", json={
+        "doctor_id": doctor_id,
+        "appointment_date": (datetime.utcnow().date() + timedelta(days=1)).isoformat(),
+        "appointment_time": "09:00"
+    }, headers=auth_headers(patient_token))
+    response.raise_for_status()
+    appointment_id = response.json()["id"]
+
+    def create_payment(_):
+        response = requests.post(f"{BASE_URL}/payments/create", json={
+            "appointment_id": appointment_id, "amount": 500000.0, "gateway": gateway
+        }, headers=auth_headers(patient_token))
+        response.raise_for_status()
+        return response.json()["payment_id"]
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        payment_ids = list(pool.map(create_payment, range(count)))
+
+    simulator = GatewaySimulator(gateway, secret)
+    # Every callback is delivered twice, as gateways do when an ack is slow
+    callbacks = [
+        simulator.callback(payment_id, 500000.0, str(10_000_000 + i))
+        for i, payment_id in enumerate(payment_ids)
+    ] * 2
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def deliver(payload):
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        started = time.perf_counter()
+        ok = simulator.send(session, payload).status_code == 200
+        with lock:
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        list(pool.map(deliver, callbacks))
+    summary = summarize("webhook ingestion", latencies, errors[0], time.perf_counter() - started)
+    print_summary(summary)
+
+    # Give the batch worker a moment, then check a sample actually settled
+    time.sleep(2)
+    sample = payment_ids[::max(1, count // 50)]
+    paid = sum(
+        requests.get(f"{BASE_URL}/payments/status/{payment_id}",
+                     headers=auth_headers(patient_token)).json().get("status") == "paid"
+        for payment_id in sample
+    )
+    print(f"   Settled: {paid}/{len(sample)} sampled payments")
+    summary["settled_sample"] = f"{paid}/{len(sample)}"
+    return [summary]
+
+def bench_qr():
+    """Payment QR rendering under checkout load: cold renders, cache hits and 304 revalidation.
+
+    Re-opens are skewed toward recent payments, like patients returning to
+    the payment screen; the cache hit rate is read from /admin/stats.
+    """
+    count = int(os.environ.get("BENCH_QR_PAYMENTS", 500))
+    print_bench_header(f"PAYMENT QR RENDERING ({count} PAYMENTS)")
+
+    _, _, doctor_id = register_user("doctor", specialization="Nội khoa")
+    _, patient_token, _ = register_user("patient")
+    _, admin_token, _ = register_user("admin")
+    response = requests.post(f"{BASE_URL}/appointments", json={
+        "doctor_id": doctor_id,
+        "appointment_date": (datetime.utcnow().date() + timedelta(days=2)).isoformat(),
+        "appointment_time": "10:00"
+    }, headers=auth_headers(patient_token))
+    response.raise_for_status()
+    appointment_id = response.json()["id"]
+
+    def create_payment(_):
+        response = requests.post(f"{BASE_URL}/payments/create", json={
+            "appointment_id": appointment_id, "amount": 500000.0, "gateway": "vnpay"
+        }, headers=auth_headers(patient_token))
+        response.raise_for_status()
+        return response.json()["payment_id"]
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        payment_ids = list(pool.map(create_payment, range(count)))
+
+    def cache_stats():
+        response = requests.get(f"{BASE_URL}/admin/stats", headers=auth_headers(admin_token))
+        response.raise_for_status()
+        return response.json()["qr_cache"]
+
+    def pick_payment():
+        # Most re-opens hit the newest checkouts
+        return payment_ids[min(count - 1, int(random.expovariate(10 / count)))]
+
+    etags = {}
+    def do_render(session):
+        payment_id = pick_payment()
+        response = session.get(f"{BASE_URL}/payments/{payment_id}/qr",
+                               headers=auth_headers(patient_token))
+        etags[payment_id] = response.headers.get("ETag")
+        return response.status_code == 200
+
+    def do_revalidate(session):
+        payment_id = pick_payment()
+        headers = auth_headers(patient_token)
+        if etags.get(payment_id):
+            headers["If-None-Match"] = etags[payment_id]
+        response = session.get(f"{BASE_URL}/payments/{payment_id}/qr", headers=headers)
+        return response.status_code in (200, 304)
+
+    summaries = []
+    for name, request_fn in (("qr (full body)", do_render), ("qr (If-None-Match)", do_revalidate)):
+        before = cache_stats()
+        summary = drive(name, request_fn, CONCURRENCY, DURATION / 2)
+        after = cache_stats()
+        hits = after["hits"] - before["hits"]
+        lookups = hits + after["misses"] - before["misses"]
+        summary["cache_hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        print_summary(summary)
+        print(f"   Render cache hit rate: {summary['cache_hit_rate']:.1%}")
+        summaries.append(summary)
+    return summaries
+
+def bench_directory():
+    """Doctor directory reads: full responses vs If-None-Match revalidation (304)"""
+    doctors = int(os.environ.get("BENCH_DOCTORS", 300))
+    specialization = f"Bench {uuid.uuid4().hex[:6]}"
+    print_bench_header(f"DOCTOR DIRECTORY ({doctors} DOCTORS)")
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        doctor_ids = list(pool.map(
+            lambda _: register_user("doctor", specialization=specialization)[2], range(doctors)
+        ))
+
+    paths = [
+        "/specializations",
+        f"/doctors?specialization={specialization}&limit=100",
+    ] + [f"/doctors/{doctor_id}" for doctor_id in doctor_ids]
+
+    etags = {}
+    def do_full(session):
+        path = random.choice(paths)
+        response = session.get(f"{BASE_URL}{path}", headers=HEADERS)
+        etags[path] = response.headers.get("ETag")
+        return response.status_code == 200
+
+    def do_revalidate(session):
+        path = random.choice(paths)
+        headers = dict(HEADERS)
+        if etags.get(path):
+            headers["If-None-Match"] = etags[path]
+        response = session.get(f"{BASE_URL}{path}", headers=headers)
+        return response.status_code in (200, 304)
+
+    summaries = [
+        drive("directory (full body)", do_full, CONCURRENCY, DURATION / 2),
+        drive("directory (If-None-Match)", do_revalidate, CONCURRENCY, DURATION / 2),
+    ]
+    for summary in summaries:
+        print_summary(summary)
+    return summaries
+
+PATIENT_NAMES = ["Nguyễn Thị Hồng Nhung", "Trần Quốc Bảo", "Lê Minh Khoa", "Phạm Thu Hà", "Võ Thị Lan"]
+MESSAGE_TEXTS = [
+    "Chào bác sĩ, tôi muốn hỏi thêm về kết quả xét nghiệm hôm trước ạ",
+    "Con tôi bị sốt từ tối qua, có cần đưa bé đến khám sớm hơn không?",
+    "Dạ em cảm ơn bác sĩ, em sẽ uống thuốc đúng giờ",
+    "Tôi có thể đổi lịch khám sang buổi chiều được không ạ?",
+    "Bác sĩ ơi, sau khi uống thuốc tôi thấy hơi chóng mặt",
+]
+
+def list_fixtures(encode_cursor, items):
+    """Stored appointment documents and the /appointments and /messages items built from them"""
+    rng = random.Random(items)
+    now = datetime.utcnow()
+    slots = [booking_slot(i, now.date() + timedelta(days=1)) for i in range(items)]
+    documents = [
+        {
+            "_id": str(uuid.uuid4()),
+            "patient_id": str(uuid.uuid4()),
+            "patient_name": rng.choice(PATIENT_NAMES),
+            "doctor_id": str(uuid.uuid4()),
+            "doctor_name": "BS. Trần Văn Minh",
+            "appointment_date": slots[i][0],
+            "appointment_time": slots[i][1],
+            "specialization": "Tai Mũi Họng",
+            "status": rng.choice(["pending", "confirmed", "completed"]),
+            "payment_status": rng.choice(["unpaid", "paid"]),
+            "amount": 500000.0,
+            "notes": "Đau họng kéo dài, sốt nhẹ về chiều" if i % 3 else None,
+            "version": rng.randint(1, 5),
+            "created_at": now - timedelta(minutes=i, microseconds=rng.randint(0, 999999)),
+            "starts_at": datetime.fromisoformat(f"{slots[i][0]}T{slots[i][1]}"),
+        }
+        for i in range(items)
+    ]
+    appointments = [
+        {
+            "id": doc["_id"],
+            **{key: doc[key] for key in (
+                "patient_name", "doctor_name", "appointment_date", "appointment_time",
+                "specialization", "status", "payment_status", "amount", "notes", "version"
+            )},
+            "cursor": encode_cursor(doc["created_at"], doc["_id"])
+        }
+        for doc in documents
+    ]
+    messages = [
+        {
+            "id": doc["_id"],
+            "sender_name": doc["patient_name"],
+            "sender_role": "patient",
+            "message": rng.choice(MESSAGE_TEXTS),
+            "timestamp": doc["created_at"].isoformat(),
+            "cursor": encode_cursor(doc["created_at"], doc["_id"])
+        }
+        for doc in documents
+    ]
+    return documents, appointments, messages
+
+def bench_serialization():
+    """Response serialization CPU for 1000-item lists: jsonable_encoder + stdlib
+    JSONResponse (before) vs response_model + OrjsonResponse (after).
+
+    Runs in-process on the route's own models; no server needed.
+    """
+    items = int(os.environ.get("BENCH_SERIALIZATION_ITEMS", 1000))
+    rounds = int(os.environ.get("BENCH_SERIALIZATION_ROUNDS", 200))
+    print_bench_header(f"RESPONSE SERIALIZATION ({items} ITEMS, {rounds} ROUNDS)")
+
+    os.environ.setdefault("STORAGE_ENGINE", "memory")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    from typing import List
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    import responses
+    import server
+
+    documents, appointments, messages = list_fixtures(server.encode_cursor, items)
+
+    def before(content):
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def typed(model):
+        adapter = TypeAdapter(List[model])
+        def after(content):
+            # What FastAPI does for a response_model: validate, then serialize
+            value = adapter.validate_python(content)
+            return responses.OrjsonResponse(adapter.dump_python(value, mode="json")).body
+        return after
+
+    cases = [
+        ("appointments", appointments, typed(server.AppointmentListItem)),
+        ("messages", messages, typed(server.MessageListItem)),
+        # Routes without a model that return stored documents (datetimes)
+        ("raw documents", documents, lambda content: responses.OrjsonResponse(content).body),
+    ]
+
+    summaries = []
+    for name, content, after in cases:
+        same_output = json.loads(before(content)) == json.loads(after(content))
+        for variant, render in (("before", before), ("after", after)):
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(rounds):
+                call_started = time.perf_counter()
+                body = render(content)
+                latencies.append(time.perf_counter() - call_started)
+            summary = summarize(f"{name} ({variant})", latencies, 0, time.perf_counter() - started)
+            summary["bytes"] = len(body)
+            summary["same_output"] = same_output
+            print_summary(summary)
+            summaries.append(summary)
+        speedup = summaries[-2]["mean_ms"] / summaries[-1]["mean_ms"] if summaries[-1]["mean_ms"] else 0.0
+        print(f"   Speedup: {speedup:.1f}x  Same output: {same_output}")
+    return summaries
+
+def bench_compression():
+    """Bytes on the wire and compression CPU per response for list payloads.
+
+    Renders /appointments and /messages pages the way the API does and runs
+    them through CompressionMiddleware's encoders at several levels, one-shot
+    and streamed in 16 KiB chunks. Runs in-process; no server needed.
+    """
+    sizes = [int(size) for size in os.environ.get("BENCH_COMPRESSION_ITEMS", "50,100,1000").split(",")]
+    rounds = int(os.environ.get("BENCH_COMPRESSION_ROUNDS", 100))
+    chunk_size = 16 * 1024
+    print_bench_header(f"RESPONSE COMPRESSION ({rounds} ROUNDS PER LEVEL)")
+
+    os.environ.setdefault("STORAGE_ENGINE", "memory")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    import compression
+    import responses
+    import server
+
+    encoders = [("gzip", level, lambda level=level: compression.GzipEncoder(level)) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        encoders += [("br", quality, lambda quality=quality: compression.BrotliEncoder(quality))
+                     for quality in (1, 4, 11)]
+    else:
+        print("   brotli is not installed; measuring gzip only")
+
+    def one_shot(make_encoder, body):
+        return make_encoder().finish(body)
+
+    def streamed(make_encoder, body):
+        encoder = make_encoder()
+        parts = [encoder.chunk(body[offset:offset + chunk_size])
+                 for offset in range(0, len(body) - chunk_size, chunk_size)]
+        tail = len(parts) * chunk_size
+        return b"".join(parts) + encoder.finish(body[tail:])
+
+    results = []
+    for items in sizes:
+        _, appointments, messages = list_fixtures(server.encode_cursor, items)
+        for name, content in (("appointments", appointments), ("messages", messages)):
+            body = responses.dumps(content)
+            print(f"\n📦 {name} x{items}: {len(body)} bytes uncompressed")
+            for encoding, level, make_encoder in encoders:
+                for mode, compress in (("one-shot", one_shot), ("streamed", streamed)):
+                    latencies = []
+                    for _ in range(rounds):
+                        started = time.perf_counter()
+                        compressed = compress(make_encoder, body)
+                        latencies.append(time.perf_counter() - started)
+                    result = {
+                        "name": f"{name} x{items} {encoding}-{level} {mode}",
+                        "raw_bytes": len(body),
+                        "wire_bytes": len(compressed),
+                        "ratio": round(len(compressed) / len(body), 4),
+                        "cpu_mean_ms": round(statistics.mean(latencies) * 1000, 3),
+                        "cpu_p95_ms": round(percentile(latencies, 95) * 1000, 3),
+                    }
+                    print(f"   {encoding}-{level} {mode:<8}  {result['wire_bytes']:>8} bytes "
+                          f"({result['ratio']:.1%})  cpu {result['cpu_mean_ms']} ms "
+                          f"(p95 {result['cpu_p95_ms']} ms)")
+                    results.append(result)
+    return results
+
+def bench_handlers():
+    """Route handler CPU without HTTP or MongoDB.
+
+    Imports the backend in-process with STORAGE_ENGINE=memory (override with
+    BENCH_HANDLER_ENGINE=mongo) and awaits the handlers directly; running it
+    once per engine separates Mongo I/O from handler work.
+    """
+    import asyncio
+    engine = os.environ.get("BENCH_HANDLER_ENGINE", "memory")
+    doctors = int(os.environ.get("BENCH_DOCTORS", 300))
+    bookings = int(os.environ.get("BENCH_BOOKINGS_PER_DOCTOR", 5))
+    iterations = int(os.environ.get("BENCH_HANDLER_ITERATIONS", 500))
+    print_bench_header(f"HANDLERS IN-PROCESS ({engine} storage, {doctors} doctors)")
+
+    os.environ["STORAGE_ENGINE"] = engine
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    import server
+
+    specialization = f"Bench {uuid.uuid4().hex[:6]}"
+    tomorrow = datetime.utcnow().date() + timedelta(days=1)
+
+    def bench_user(role, **extra):
+        return {
+            "_id": str(uuid.uuid4()),
+            "email": f"bench_{role}_{uuid.uuid4().hex[:10]}@bench.vn",
+            "password": "",
+            "full_name": f"Bench {role.capitalize()}",
+            "phone": "0900000000",
+            "role": role,
+            "created_at": datetime.utcnow(),
+            **extra
+        }
+
+    async def seed():
+        # Users go straight to storage so bcrypt stays out of the numbers
+        patient = bench_user("patient")
+        await server.storage.users.insert(patient)
+        doctor_ids = []
+        for _ in range(doctors):
+            doctor = bench_user("doctor", specialization=specialization)
+            await server.storage.users.insert(doctor)
+            doctor_ids.append(doctor["_id"])
+        first = None
+        for i, doctor_id in enumerate(doctor_ids):
+            for slot in range(bookings):
+                day, time_value = booking_slot(slot, tomorrow + timedelta(days=i % 5))
+                booked = await server.book_appointment(server.AppointmentCreate(
+                    doctor_id=doctor_id, appointment_date=day, appointment_time=time_value
+                ), patient)
+                appointment = booked["appointment"]
+                first = first or appointment
+                await server.create_message(appointment, patient, f"Chào bác sĩ, lịch khám số {slot}")
+        return patient, first
+
+    def timed(name, call):
+        async def run():
+            latencies, errors = [], 0
+            started = time.perf_counter()
+            for _ in range(iterations):
+                call_started = time.perf_counter()
+                try:
+                    await call()
+                    latencies.append(time.perf_counter() - call_started)
+                except Exception:
+                    errors += 1
+            return summarize(name, latencies, errors, time.perf_counter() - started)
+        return run()
+
+    async def run_all():
+        patient, appointment = await seed()
+        return [
+            await timed("get_chats (patient)", lambda: server.get_chats(current_user=patient)),
+            await timed("get_appointments (patient)", lambda: server.get_appointments(
+                server.Response(), status=None, doctor_id=None, patient_id=None,
+                date_from=None, date_to=None, cursor=None, limit=100, current_user=patient
+            )),
+            await timed("get_messages", lambda: server.get_messages(
+                appointment["_id"], server.Response(), before=None, after=None,
+                limit=50, current_user=patient
+            )),
+            await timed("search_availability", lambda: server.search_availability(
+                specialization, date_from=None, date_to=None, limit=5
+            )),
+        ]
+
+    summaries = asyncio.run(run_all())
+    for summary in summaries:
+        summary["engine"] = engine
+        print_summary(summary)
+    return summaries
+
+BENCHMARKS = {
+    "login": bench_login,
+    "chats": bench_chats,
+    "availability": bench_availability,
+    "socket_fanout": bench_socket_fanout,
+    "webhooks": bench_webhooks,
+    "qr": bench_qr,
+    "directory": bench_directory,
+    "serialization": bench_serialization,
+    "compression": bench_compression,
+    "handlers": bench_handlers,
+}
+
+def run_benchmarks(names):
+    print("🏥 CLINIC BOOKING APPLICATION - BACKEND BENCHMARKS")
+    print(f"Target: {BASE_URL}")
+    report = {}
+    for name in names:
+        report[name] = BENCHMARKS[name]()
+    output = os.environ.get("BENCH_OUTPUT")
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n📝 Results written to {output}")
+    return report
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}")
+        print(f"Available: {', '.join(BENCHMARKS)}")
+        sys.exit(1)
+    run_benchmarks(selected)
@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+Local Load Test for Clinic Booking Application
+Boots the backend in-process against a throwaway local MongoDB, seeds it at
+production-like volumes and drives a mixed workload concurrently:
+logins, browsing, booking, chat over Socket.IO and payment polling.
+
+Usage: python backend_loadtest.py [--compare baseline.json]
+
+    LOAD_SCALE         fraction of the full seed of 10k doctors, 100k patients,
+                       1M appointments and 10M messages (default 1.0; 0.01 for a quick run)
+    LOAD_USERS         concurrent HTTP virtual users (default 64)
+    LOAD_CHAT_PAIRS    patient/doctor Socket.IO pairs chatting (default 32)
+    LOAD_DURATION      seconds of mixed load (default 60)
+    LOAD_MONGO_URL     use this MongoDB instead of spawning mongod (its LOAD_DB_NAME is dropped)
+    LOAD_OUTPUT        JSON report path (default loadtest_report.json)
+
+Requires `mongod` on PATH unless LOAD_MONGO_URL is set, and `aiohttp`.
+The report is stable JSON (one summary per endpoint) meant to be diffed
+between releases with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import aiohttp
+import socketio
+from passlib.context import CryptContext
+from pymongo import MongoClient
+
+from backend_benchmark import summarize, print_summary
+
+# Configuration
+SCALE = float(os.environ.get("LOAD_SCALE", 1.0))
+USERS = int(os.environ.get("LOAD_USERS", 64))
+CHAT_PAIRS = int(os.environ.get("LOAD_CHAT_PAIRS", 32))
+DURATION = float(os.environ.get("LOAD_DURATION", 60))
+MONGO_URL = os.environ.get("LOAD_MONGO_URL")
+DB_NAME = os.environ.get("LOAD_DB_NAME", "clinic_loadtest")
+OUTPUT = os.environ.get("LOAD_OUTPUT", "loadtest_report.json")
+
+FULL_SEED = {"doctors": 10_000, "patients": 100_000, "appointments": 1_000_000, "messages": 10_000_000}
+PASSWORD = "matkhau123"
+SPECIALIZATIONS = ["Nội khoa", "Ngoại khoa", "Nhi khoa", "Sản phụ khoa", "Tim mạch", "Da liễu", "Mắt", "Tai Mũi Họng"]
+# Default working hours 08:00-17:00 in 30 minute slots, both ends bookable
+SLOTS_PER_DAY = 19
+HISTORY_DAYS = 180
+FUTURE_DAYS = 60
+BATCH_SIZE = 10_000
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def print_header(title):
+    print(f"\n{'='*60}")
+    print(title)
+    print(f"{'='*60}")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def slot_time(index):
+    minutes = 8 * 60 + index * 30
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+# ==================== LOCAL MONGODB ====================
+
+def start_mongod():
+    """Spawn a throwaway mongod on a free port; returns (url, cleanup)"""
+    binary = shutil.which("mongod")
+    if not binary:
+        sys.exit("mongod not found on PATH; install MongoDB or set LOAD_MONGO_URL")
+    dbpath = tempfile.mkdtemp(prefix="clinic-loadtest-")
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"mongodb://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while True:
+        try:
+            MongoClient(url, serverSelectionTimeoutMS=500).admin.command("ping")
+            break
+        except Exception:
+            if time.time() > deadline or process.poll() is not None:
+                shutil.rmtree(dbpath, ignore_errors=True)
+                sys.exit("mongod did not start")
+            time.sleep(0.2)
+
+    def cleanup():
+        process.terminate()
+        process.wait(timeout=30)
+        shutil.rmtree(dbpath, ignore_errors=True)
+    return url, cleanup
+
+# ==================== SEED ====================
+
+def seed_counts():
+    counts = {name: max(1, int(count * SCALE)) for name, count in FULL_SEED.items()}
+    counts["patients"] = max(counts["patients"], USERS, CHAT_PAIRS)
+    counts["doctors"] = max(counts["doctors"], CHAT_PAIRS)
+    return counts
+
+def insert_batches(collection, documents):
+    if isinstance(documents, list) and not documents:
+        return
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == BATCH_SIZE:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+def seed(database, counts):
+    """Bulk-load users, appointments, schedules, messages, conversations and payments.
+
+    Returns the appointments of the first patients and doctors, which the
+    virtual users log in as.
+    """
+    rng = random.Random(42)
+    new_id = lambda: str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    password_hash = CryptContext(schemes=["bcrypt"]).hash(PASSWORD)
+    now = datetime.utcnow()
+    today = now.date()
+
+    doctors = [
+        {
+            "_id": new_id(),
+            "email": f"doctor{i}@load.vn",
+            "password": password_hash,
+            "full_name": f"BS. Tải {i}",
+            "phone": "0900000000",
+            "role": "doctor",
+            "specialization": SPECIALIZATIONS[i % len(SPECIALIZATIONS)],
+            "available_days": [],
+            "available_hours": "08:00-17:00",
+            "created_at": now - timedelta(minutes=i)
+        }
+        for i in range(counts["doctors"])
+    ]
+    patients = [
+        {
+            "_id": new_id(),
+            "email": f"patient{i}@load.vn",
+            "password": password_hash,
+            "full_name": f"Bệnh nhân {i}",
+            "phone": "0911111111",
+            "role": "patient",
+            "created_at": now - timedelta(minutes=i)
+        }
+        for i in range(counts["patients"])
+    ]
+    insert_batches(database.users, doctors + patients)
+    print(f"   Users: {len(doctors)} doctors, {len(patients)} patients")
+
+    tracked = {"patients": defaultdict(list), "chats": {}}
+    days = HISTORY_DAYS + FUTURE_DAYS
+    per_doctor, extra = divmod(counts["appointments"], len(doctors))
+    messages_per_appointment, extra_messages = divmod(counts["messages"], counts["appointments"])
+    # Day bitmaps of the doctors generated so far, flushed with each batch
+    schedules = []
+    appointment_count = message_count = 0
+
+    def appointments():
+        nonlocal appointment_count
+        for d, doctor in enumerate(doctors):
+            occupied = {}
+            wanted = min(per_doctor + (d < extra), days * SLOTS_PER_DAY)
+            for position in rng.sample(range(days * SLOTS_PER_DAY), wanted):
+                day = today + timedelta(days=position // SLOTS_PER_DAY - HISTORY_DAYS)
+                index = position % SLOTS_PER_DAY
+                patient_index = rng.randrange(len(patients))
+                patient = patients[patient_index]
+                roll = rng.random()
+                if day < today:
+                    status = "cancelled" if roll < 0.15 else "completed"
+                else:
+                    status = "cancelled" if roll < 0.1 else "confirmed" if roll < 0.4 else "pending"
+                paid = status == "completed" or (status == "confirmed" and roll < 0.25)
+                starts_at = datetime.combine(day, datetime.min.time()) + timedelta(minutes=8 * 60 + index * 30)
+                appointment = {
+                    "_id": new_id(),
+                    "patient_id": patient["_id"],
+                    "patient_name": patient["full_name"],
+                    "patient_email": patient["email"],
+                    "patient_phone": patient["phone"],
+                    "doctor_id": doctor["_id"],
+                    "doctor_name": doctor["full_name"],
+                    "appointment_date": day.strftime("%d/%m/%Y"),
+                    "appointment_time": slot_time(index),
+                    "specialization": doctor["specialization"],
+                    "status": status,
+                    "payment_status": "paid" if paid else "unpaid",
+                    "amount": 500000.0,
+                    "notes": None,
+                    "version": 1,
+                    "created_at": starts_at - timedelta(days=rng.randint(1, 30)),
+                    "starts_at": starts_at,
+                    "duration_minutes": 30,
+                }
+                if status != "cancelled":
+                    key = f"{doctor['_id']}:{day.isoformat()}"
+                    occupied[key] = occupied.get(key, 0) | (1 << index)
+                    appointment.update({
+                        "slot_date": day.isoformat(),
+                        "slot_index": index,
+                        "slot_key": f"{key}:{index}"
+                    })
+                if patient_index < USERS:
+                    tracked["patients"][patient_index].append(appointment["_id"])
+                if d < CHAT_PAIRS and status != "cancelled" and d not in tracked["chats"]:
+                    tracked["chats"][d] = {
+                        "appointment_id": appointment["_id"],
+                        "patient_email": patient["email"],
+                        "doctor_email": doctor["email"]
+                    }
+                appointment_count += 1
+                yield appointment
+            schedules.extend(
+                {"_id": key, "doctor_id": doctor["_id"], "date": key.rsplit(":", 1)[1], "occupied": bits}
+                for key, bits in occupied.items()
+            )
+
+    conversations = []
+    payments = []
+    def messages(appointments_batch, first):
+        nonlocal message_count
+        for ordinal, appointment in enumerate(appointments_batch, first):
+            count = messages_per_appointment + (ordinal < extra_messages)
+            if appointment["status"] == "completed" or appointment["payment_status"] == "paid":
+                payments.append({
+                    "_id": new_id(),
+                    "appointment_id": appointment["_id"],
+                    "patient_id": appointment["patient_id"],
+                    "amount": appointment["amount"],
+                    "gateway": "vnpay",
+                    "status": "paid",
+                    "qr_code": f"vnpay://payment?order_id={appointment['_id']}",
+                    "created_at": appointment["created_at"],
+                    "expires_at": appointment["created_at"] + timedelta(minutes=15),
+                    "paid_at": appointment["created_at"] + timedelta(minutes=5)
+                })
+            if not count:
+                continue
+            participants = [
+                (appointment["patient_id"], appointment["patient_name"], "patient"),
+                (appointment["doctor_id"], appointment["doctor_name"], "doctor"),
+            ]
+            unread = {appointment["patient_id"]: 0, appointment["doctor_id"]: 0}
+            read_up_to = {}
+            message = None
+            for k in range(count):
+                sender_id, sender_name, sender_role = participants[k % 2]
+                recipient_id = participants[(k + 1) % 2][0]
+                # The last two messages of each conversation are still unread
+                read = k < count - 2
+                message = {
+                    "_id": new_id(),
+                    "appointment_id": appointment["_id"],
+                    "sender_id": sender_id,
+                    "sender_name": sender_name,
+                    "sender_role": sender_role,
+                    "message": f"Tin nhắn {k} về lịch khám",
+                    "timestamp": appointment["created_at"] + timedelta(minutes=k),
+                    "read": read
+                }
+                read_up_to[sender_id] = message["timestamp"]
+                if read:
+                    read_up_to[recipient_id] = message["timestamp"]
+                else:
+                    unread[recipient_id] += 1
+                message_count += 1
+                yield message
+            conversations.append({
+                "_id": appointment["_id"],
+                "last_message": {
+                    "id": message["_id"],
+                    "message": message["message"],
+                    "timestamp": message["timestamp"],
+                    "sender_id": message["sender_id"],
+                    "sender_name": message["sender_name"]
+                },
+                "read_up_to": read_up_to,
+                "updated_at": message["timestamp"],
+                "message_count": count,
+                "unread": unread
+            })
+
+    def flush(batch):
+        insert_batches(database.appointments, batch)
+        insert_batches(database.messages, messages(batch, appointment_count - len(batch)))
+        for collection, documents in (
+            (database.conversations, conversations),
+            (database.payments, payments),
+            (database.doctor_schedules, schedules),
+        ):
+            insert_batches(collection, documents)
+            documents.clear()
+        print(f"   Appointments: {appointment_count}  Messages: {message_count}", end="\r")
+
+    batch = []
+    for appointment in appointments():
+        batch.append(appointment)
+        if len(batch) == BATCH_SIZE:
+            flush(batch)
+            batch = []
+    # Include the bitmaps of the last doctor, generated after its final appointment
+    flush(batch)
+    print()
+    # Seeded appointments already carry starts_at and slot fields
+    database.migrations.insert_one({"_id": "appointment_schedule_v1", "applied_at": now, "result": {"seeded": True}})
+    tracked["chats"] = list(tracked["chats"].values())
+    return tracked
+
+# ==================== SERVER ====================
+
+def start_server(mongo_url):
+    """Import the backend against the load test database and serve it on a background thread"""
+    os.environ["MONGO_URL"] = mongo_url
+    os.environ["DB_NAME"] = DB_NAME
+    sys.path.insert(0, os.path.join(ROOT_DIR, "backend"))
+    import uvicorn
+    import server
+
+    port = free_port()
+    config = uvicorn.Config(server.socket_app, host="127.0.0.1", port=port,
+                            log_level="warning", lifespan="on")
+    uvicorn_server = uvicorn.Server(config)
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    # Startup builds the indexes over the seeded data before serving
+    while not uvicorn_server.started:
+        if not thread.is_alive():
+            sys.exit("Backend failed to start")
+        time.sleep(0.2)
+
+    def stop():
+        uvicorn_server.should_exit = True
+        thread.join(timeout=30)
+    return f"http://127.0.0.1:{port}", stop
+
+# ==================== WORKLOAD ====================
+
+class Recorder:
+    """Per-endpoint latencies and error counts"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok):
+        if ok:
+            self.latencies[name].append(seconds)
+        else:
+            self.errors[name] += 1
+
+    def summaries(self, elapsed):
+        names = sorted(set(self.latencies) | set(self.errors))
+        return {name: summarize(name, self.latencies[name], self.errors[name], elapsed) for name in names}
+
+class LoadContext:
+    def __init__(self, base_url, session, recorder, counts, tracked):
+        self.api_url = f"{base_url}/api"
+        self.socket_url = base_url
+        self.session = session
+        self.recorder = recorder
+        self.counts = counts
+        self.tracked = tracked
+        self.doctor_ids = []
+
+    async def call(self, name, method, path, expect=(200,), **kwargs):
+        """Time one request under `name`; returns the JSON body on an expected status"""
+        started = time.perf_counter()
+        data, ok = None, False
+        try:
+            async with self.session.request(method, f"{self.api_url}{path}", **kwargs) as response:
+                body = await response.read()
+                ok = response.status in expect
+                if ok and response.status == 200 and body:
+                    data = json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        self.recorder.record(name, time.perf_counter() - started, ok)
+        return data if ok else None
+
+    async def login(self, email):
+        data = await self.call("POST /auth/login", "POST", "/auth/login",
+                               json={"email": email, "password": PASSWORD})
+        return data["token"] if data else None
+
+class VirtualUser:
+    def __init__(self, ctx, index):
+        self.ctx = ctx
+        self.rng = random.Random(index)
+        self.email = f"patient{index}@load.vn"
+        self.appointments = list(ctx.tracked["patients"].get(index, []))
+        self.headers = None
+        self.payment_id = None
+
+    def auth(self, **extra):
+        return {"headers": {**self.headers, **extra.pop("headers", {})}, **extra}
+
+    def future_day(self):
+        return (datetime.utcnow().date() + timedelta(days=self.rng.randint(1, FUTURE_DAYS))).isoformat()
+
+    async def do_login(self):
+        await self.ctx.login(self.email)
+
+    async def do_doctors(self):
+        params = {"limit": 20}
+        if self.rng.random() < 0.5:
+            params["specialization"] = self.rng.choice(SPECIALIZATIONS)
+        data = await self.ctx.call("GET /doctors", "GET", "/doctors", params=params)
+        if data and len(self.ctx.doctor_ids) < 1000:
+            self.ctx.doctor_ids.extend(doctor["id"] for doctor in data)
+
+    async def do_doctor_detail(self):
+        if self.ctx.doctor_ids:
+            doctor_id = self.rng.choice(self.ctx.doctor_ids)
+            await self.ctx.call("GET /doctors/{doctor_id}", "GET", f"/doctors/{doctor_id}")
+
+    async def do_doctor_availability(self):
+        if self.ctx.doctor_ids:
+            doctor_id = self.rng.choice(self.ctx.doctor_ids)
+            await self.ctx.call("GET /doctors/{doctor_id}/availability", "GET",
+                                f"/doctors/{doctor_id}/availability", params={"date": self.future_day()})
+
+    async def do_search_availability(self):
+        await self.ctx.call("GET /availability", "GET", "/availability",
+                            params={"specialization": self.rng.choice(SPECIALIZATIONS), "limit": 3})
+
+    async def do_appointments(self):
+        await self.ctx.call("GET /appointments", "GET", "/appointments", **self.auth(params={"limit": 20}))
+
+    async def do_book(self):
+        if not self.ctx.doctor_ids:
+            return
+        # A taken slot (409) is a normal outcome under load, not an error
+        data = await self.ctx.call("POST /appointments", "POST", "/appointments", expect=(200, 409), **self.auth(
+            json={
+                "doctor_id": self.rng.choice(self.ctx.doctor_ids),
+                "appointment_date": self.future_day(),
+                "appointment_time": slot_time(self.rng.randrange(SLOTS_PER_DAY))
+            },
+            headers={"Idempotency-Key": uuid.uuid4().hex}
+        ))
+        if data:
+            self.appointments.append(data["id"])
+
+    async def do_chats(self):
+        await self.ctx.call("GET /chats", "GET", "/chats", **self.auth())
+
+    async def do_messages(self):
+        if self.appointments:
+            appointment_id = self.rng.choice(self.appointments)
+            await self.ctx.call("GET /messages/{appointment_id}", "GET", f"/messages/{appointment_id}",
+                                **self.auth(params={"limit": 50}))
+
+    async def do_payment(self):
+        """Open a payment for one of the user's appointments, then poll it like the payment screen"""
+        if self.payment_id is None or self.rng.random() < 0.05:
+            if not self.appointments:
+                return
+            data = await self.ctx.call("POST /payments/create", "POST", "/payments/create", **self.auth(
+                json={"appointment_id": self.rng.choice(self.appointments), "amount": 500000.0, "gateway": "vnpay"}
+            ))
+            self.payment_id = data["payment_id"] if data else None
+            return
+        await self.ctx.call("GET /payments/status/{payment_id}", "GET",
+                            f"/payments/status/{self.payment_id}", **self.auth())
+
+    async def run(self, deadline):
+        token = await self.ctx.login(self.email)
+        if not token:
+            return
+        self.headers = {"Authorization": f"Bearer {token}"}
+        actions, weights = zip(*[
+            (self.do_login, 3),
+            (self.do_doctors, 15),
+            (self.do_doctor_detail, 10),
+            (self.do_doctor_availability, 10),
+            (self.do_search_availability, 5),
+            (self.do_appointments, 15),
+            (self.do_book, 8),
+            (self.do_chats, 10),
+            (self.do_messages, 12),
+            (self.do_payment, 12),
+        ])
+        while time.monotonic() < deadline:
+            await self.rng.choices(actions, weights)[0]()
+
+async def chat_pair(ctx, pair, deadline):
+    """Patient and doctor alternate messages; measures the ack and delivery to the other side"""
+    tokens = [await ctx.login(pair["patient_email"]), await ctx.login(pair["doctor_email"])]
+    if not all(tokens):
+        return
+    clients = []
+    for token in tokens:
+        client = socketio.AsyncClient(reconnection=False)
+
+        @client.on("new_message")
+        async def on_message(data):
+            sent_at = float(data["message"].split("|", 1)[0])
+            ctx.recorder.record("socket new_message (delivery)", time.perf_counter() - sent_at, True)
+
+        await client.connect(ctx.socket_url, auth={"token": token},
+                             transports=["websocket"], socketio_path="socket.io")
+        await client.call("join_room", {"appointment_id": pair["appointment_id"]})
+        clients.append(client)
+
+    turn = 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            ack = await clients[turn % 2].call("send_message", {
+                "appointment_id": pair["appointment_id"],
+                "message": f"{started}|Bác sĩ ơi, tôi có câu hỏi về đơn thuốc"
+            }, timeout=10)
+            ok = "id" in ack
+        except socketio.exceptions.TimeoutError:
+            ok = False
+        ctx.recorder.record("socket send_message (ack)", time.perf_counter() - started, ok)
+        turn += 1
+        await asyncio.sleep(0.5)
+
+    await asyncio.sleep(1)  # let the last deliveries arrive
+    for client in clients:
+        await client.disconnect()
+
+async def run_load(base_url, counts, tracked):
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=USERS * 2)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        ctx = LoadContext(base_url, session, recorder, counts, tracked)
+        # Warm the doctor id pool so detail/availability/booking have targets
+        await VirtualUser(ctx, 0).do_doctors()
+        deadline = time.monotonic() + DURATION
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(VirtualUser(ctx, i).run(deadline) for i in range(USERS)),
+            *(chat_pair(ctx, pair, deadline) for pair in tracked["chats"])
+        )
+        elapsed = time.perf_counter() - started
+    return recorder.summaries(elapsed)
+
+# ==================== REPORT ====================
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    """Print per-endpoint changes against an earlier report"""
+    print_header(f"COMPARED TO {baseline['meta'].get('revision') or 'baseline'}")
+    for name, summary in report["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before:
+            print(f"🆕 {name}")
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if before[key]:
+                changes.append(f"{key} {(summary[key] - before[key]) / before[key]:+.1%}")
+        print(f"📊 {name}: {'  '.join(changes)}")
+
+def main():
+    baseline = None
+    if "--compare" in sys.argv:
+        with open(sys.argv[sys.argv.index("--compare") + 1]) as f:
+            baseline = json.load(f)
+
+    print("🏥 CLINIC BOOKING APPLICATION - LOCAL LOAD TEST")
+    counts = seed_counts()
+    cleanup = None
+    mongo_url = MONGO_URL
+    if not mongo_url:
+        mongo_url, cleanup = start_mongod()
+    try:
+        print_header(f"SEEDING {DB_NAME} (scale {SCALE})")
+        mongo = MongoClient(mongo_url)
+        mongo.drop_database(DB_NAME)
+        started = time.perf_counter()
+        tracked = seed(mongo[DB_NAME], counts)
+        print(f"   Seeded in {time.perf_counter() - started:.0f}s")
+
+        print_header("STARTING BACKEND (building indexes)")
+        started = time.perf_counter()
+        base_url, stop = start_server(mongo_url)
+        print(f"   Ready at {base_url} in {time.perf_counter() - started:.0f}s")
+
+        print_header(f"MIXED LOAD ({USERS} USERS, {len(tracked['chats'])} CHAT PAIRS, {DURATION:.0f}s)")
+        try:
+            endpoints = asyncio.run(run_load(base_url, counts, tracked))
+        finally:
+            stop()
+        for summary in endpoints.values():
+            print_summary(summary)
+
+        report = {
+            "meta": {
+                "revision": git_revision(),
+                "timestamp": datetime.utcnow().isoformat(),
+                "seed": counts,
+                "users": USERS,
+                "chat_pairs": len(tracked["chats"]),
+                "duration_s": DURATION,
+            },
+            "endpoints": endpoints,
+        }
+        with open(OUTPUT, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n📝 Results written to {OUTPUT}")
+        if baseline:
+            compare(report, baseline)
+        mongo.drop_database(DB_NAME)
+    finally:
+        if cleanup:
+            cleanup()
+
+if __name__ == "__main__":
+    main()
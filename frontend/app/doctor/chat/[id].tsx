@@ -9,6 +9,7 @@ import {
   KeyboardAvoidingView,
   Platform,
   Alert,
+  ActivityIndicator,
 } from 'react-native';
 import { useRouter, useLocalSearchParams } from 'expo-router';
 import AsyncStorage from '@react-native-async-storage/async-storage';
@@ -18,12 +19,19 @@ import { Colors } from '../../../constants/Colors';
 
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL || 'http://localhost:8001';
 
+// Appends the messages of `next` that `previous` does not already hold
+const mergeMessages = (previous: Message[], next: Message[]) => {
+  const seen = new Set(previous.map((message) => message.id));
+  return [...previous, ...next.filter((message) => !seen.has(message.id))];
+};
+
 interface Message {
   id: string;
   sender_name: string;
   sender_role: string;
   message: string;
   timestamp: string;
+  cursor: string;
 }
 
 interface User {
@@ -39,7 +47,12 @@ export default function DoctorChatScreen() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(false);
+  const [hasOlder, setHasOlder] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const flatListRef = useRef<FlatList>(null);
+  // The poll runs from a closure created on mount, so it reads messages from a ref
+  const messagesRef = useRef<Message[]>([]);
+  const prependingRef = useRef(false);
 
   useEffect(() => {
     loadUserData();
@@ -64,21 +77,85 @@ export default function DoctorChatScreen() {
     }
   };
 
+  const updateMessages = (next: Message[]) => {
+    messagesRef.current = next;
+    setMessages(next);
+  };
+
+  const fetchMessages = async (token: string, params: { before?: string; after?: string }) => {
+    const response = await axios.get(`${API_URL}/api/messages/${appointmentId}`, {
+      headers: { Authorization: `Bearer ${token}` },
+      params,
+    });
+    return {
+      page: response.data as Message[],
+      hasMore: response.headers['x-has-more'] === 'true',
+    };
+  };
+
   const loadMessages = async () => {
     try {
       const token = await AsyncStorage.getItem('token');
       if (!token) return;
 
-      const response = await axios.get(`${API_URL}/api/messages/${appointmentId}`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
+      const newest = messagesRef.current[messagesRef.current.length - 1];
+      if (!newest) {
+        // Newest page first; older pages load on request
+        const { page, hasMore } = await fetchMessages(token, {});
+        setHasOlder(hasMore);
+        updateMessages(page);
+        return;
+      }
 
-      setMessages(response.data);
+      // Catch up from the newest message shown, one page at a time
+      let after = newest.cursor;
+      let newer: Message[] = [];
+      let hasMore = true;
+      while (hasMore) {
+        const result = await fetchMessages(token, { after });
+        newer = newer.concat(result.page);
+        hasMore = result.hasMore && result.page.length > 0;
+        if (result.page.length > 0) {
+          after = result.page[result.page.length - 1].cursor;
+        }
+      }
+      if (newer.length > 0) {
+        updateMessages(mergeMessages(messagesRef.current, newer));
+      }
     } catch (error) {
       console.error('Error loading messages:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    const oldest = messagesRef.current[0];
+    if (!oldest || !hasOlder || loadingOlder) return;
+
+    setLoadingOlder(true);
+    try {
+      const token = await AsyncStorage.getItem('token');
+      if (!token) return;
+
+      const { page, hasMore } = await fetchMessages(token, { before: oldest.cursor });
+      setHasOlder(hasMore);
+      prependingRef.current = true;
+      updateMessages(mergeMessages(page, messagesRef.current));
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
+  const handleContentSizeChange = () => {
+    // Keep the reader where they were when older messages are prepended
+    if (prependingRef.current) {
+      prependingRef.current = false;
+      return;
+    }
+    flatListRef.current?.scrollToEnd({ animated: true });
+  };
+
   const handleSendMessage = async () => {
     if (!newMessage.trim()) return;
 
@@ -171,7 +248,23 @@ export default function DoctorChatScreen() {
         renderItem={renderMessage}
         style={styles.messagesList}
         contentContainerStyle={styles.messagesContent}
-        onContentSizeChange={() => flatListRef.current?.scrollToEnd({ animated: true })}
+        onContentSizeChange={handleContentSizeChange}
+        maintainVisibleContentPosition={{ minIndexForVisible: 0 }}
+        ListHeaderComponent={
+          hasOlder ? (
+            <TouchableOpacity
+              style={styles.loadOlderButton}
+              onPress={loadOlderMessages}
+              disabled={loadingOlder}
+            >
+              {loadingOlder ? (
+                <ActivityIndicator size="small" color={Colors.primary} />
+              ) : (
+                <Text style={styles.loadOlderText}>Xem tin nhắn cũ hơn</Text>
+              )}
+            </TouchableOpacity>
+          ) : null
+        }
       />
 
       <View style={styles.inputContainer}>
@@ -231,6 +324,17 @@ const styles = StyleSheet.create({
     paddingHorizontal: 24,
     paddingVertical: 16,
   },
+  loadOlderButton: {
+    alignSelf: 'center',
+    paddingHorizontal: 16,
+    paddingVertical: 8,
+    marginBottom: 16,
+  },
+  loadOlderText: {
+    fontSize: 13,
+    fontWeight: '600',
+    color: Colors.primary,
+  },
   messageContainer: {
     marginBottom: 16,
     maxWidth: '75%',
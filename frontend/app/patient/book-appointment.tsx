@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import {
   View,
   Text,
@@ -18,6 +18,7 @@ import axios from 'axios';
 import DatePickerButton from '../../components/DatePickerButton';
 import CustomDropdown, { DropdownOption } from '../../components/CustomDropdown';
 import { Colors } from '../../constants/Colors';
+import { newIdempotencyKey } from '../../utils/idempotency';
 
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL || 'http://localhost:8001';
 
@@ -43,6 +44,8 @@ export default function BookAppointmentScreen() {
   const [appointmentTime, setAppointmentTime] = useState('');
   const [notes, setNotes] = useState('');
   const [loading, setLoading] = useState(false);
+  // One key per distinct booking, kept across retries of the same booking
+  const bookingKeyRef = useRef<{ booking: string; key: string } | null>(null);
 
   useEffect(() => {
     loadSpecializations();
@@ -100,6 +103,11 @@ export default function BookAppointmentScreen() {
       const year = appointmentDate.getFullYear();
       const formattedDate = `${day}/${month}/${year}`;
 
+      const booking = [selectedDoctor, formattedDate, appointmentTime, notes].join('|');
+      if (bookingKeyRef.current?.booking !== booking) {
+        bookingKeyRef.current = { booking, key: newIdempotencyKey() };
+      }
+
       const response = await axios.post(
         `${API_URL}/api/appointments`,
         {
@@ -109,7 +117,10 @@ export default function BookAppointmentScreen() {
           notes,
         },
         {
-          headers: { Authorization: `Bearer ${token}` },
+          headers: {
+            Authorization: `Bearer ${token}`,
+            'Idempotency-Key': bookingKeyRef.current.key,
+          },
         }
       );
 
@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import {
   View,
   Text,
@@ -7,12 +7,14 @@ import {
   ScrollView,
   ActivityIndicator,
   Alert,
+  Image,
 } from 'react-native';
 import { useRouter, useLocalSearchParams } from 'expo-router';
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import { Ionicons } from '@expo/vector-icons';
-import QRCode from 'react-native-qrcode-svg';
 import axios from 'axios';
+import { io } from 'socket.io-client';
+import { newIdempotencyKey } from '../../utils/idempotency';
 
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL || 'http://localhost:8001';
 
@@ -35,11 +37,68 @@ export default function PaymentScreen() {
   const [loading, setLoading] = useState(true);
   const [paymentData, setPaymentData] = useState<PaymentData | null>(null);
   const [checking, setChecking] = useState(false);
+  const [authToken, setAuthToken] = useState<string | null>(null);
+  const settledRef = useRef(false);
+  const paymentKeyRef = useRef(newIdempotencyKey());
 
   useEffect(() => {
     createPayment();
   }, []);
 
+  // Server pushes the paid/expired transition, so the screen never polls
+  useEffect(() => {
+    if (!paymentData?.payment_id) return;
+
+    let socket: ReturnType<typeof io> | null = null;
+    let cancelled = false;
+
+    (async () => {
+      const token = await AsyncStorage.getItem('token');
+      if (!token || cancelled) return;
+
+      socket = io(API_URL, { auth: { token }, transports: ['websocket'] });
+      socket.on('connect', () => {
+        socket?.emit('watch_payment', { payment_id: paymentData.payment_id }, (ack: any) => {
+          if (ack?.status) handlePaymentStatus(ack.status, false);
+        });
+      });
+      socket.on('payment_status', (data: any) => {
+        if (data.payment_id === paymentData.payment_id) {
+          handlePaymentStatus(data.status, false);
+        }
+      });
+    })();
+
+    return () => {
+      cancelled = true;
+      socket?.disconnect();
+    };
+  }, [paymentData?.payment_id]);
+
+  const handlePaymentStatus = (status: string, notifyPending: boolean) => {
+    if (status === 'paid') {
+      if (settledRef.current) return;
+      settledRef.current = true;
+      Alert.alert(
+        'Thành công',
+        'Thanh toán đã được xác nhận!',
+        [
+          {
+            text: 'OK',
+            onPress: () => router.replace('/patient/appointments'),
+          },
+        ]
+      );
+    } else if (status === 'expired') {
+      if (settledRef.current) return;
+      settledRef.current = true;
+      Alert.alert('Hết hạn', 'Mã thanh toán đã hết hạn. Vui lòng tạo lại.');
+      router.back();
+    } else if (notifyPending) {
+      Alert.alert('Thông báo', 'Chưa nhận được thanh toán. Vui lòng thử lại sau vài giây.');
+    }
+  };
+
   const createPayment = async () => {
     try {
       setLoading(true);
@@ -54,10 +113,14 @@ export default function PaymentScreen() {
           gateway: gateway,
         },
         {
-          headers: { Authorization: `Bearer ${token}` },
+          headers: {
+            Authorization: `Bearer ${token}`,
+            'Idempotency-Key': paymentKeyRef.current,
+          },
         }
       );
 
+      setAuthToken(token);
       setPaymentData(response.data);
     } catch (error) {
       console.error('Error creating payment:', error);
@@ -81,23 +144,7 @@ export default function PaymentScreen() {
         }
       );
 
-      if (response.data.status === 'paid') {
-        Alert.alert(
-          'Thành công',
-          'Thanh toán đã được xác nhận!',
-          [
-            {
-              text: 'OK',
-              onPress: () => router.replace('/patient/appointments'),
-            },
-          ]
-        );
-      } else if (response.data.status === 'expired') {
-        Alert.alert('Hết hạn', 'Mã thanh toán đã hết hạn. Vui lòng tạo lại.');
-        router.back();
-      } else {
-        Alert.alert('Thông báo', 'Chưa nhận được thanh toán. Vui lòng thử lại sau vài giây.');
-      }
+      handlePaymentStatus(response.data.status, true);
     } catch (error) {
       console.error('Error checking payment:', error);
       Alert.alert('Lỗi', 'Không thể kiểm tra trạng thái thanh toán');
@@ -122,16 +169,7 @@ export default function PaymentScreen() {
                 {},
                 { headers: { Authorization: `Bearer ${token}` } }
               );
-              Alert.alert(
-                'Thành công',
-                'Thanh toán đã được xác nhận!',
-                [
-                  {
-                    text: 'OK',
-                    onPress: () => router.replace('/patient/appointments'),
-                  },
-                ]
-              );
+              handlePaymentStatus('paid', false);
             } catch (error) {
               Alert.alert('Lỗi', 'Không thể xác nhận thanh toán');
             }
@@ -186,12 +224,15 @@ export default function PaymentScreen() {
         <View style={styles.qrCard}>
           <Text style={styles.qrTitle}>Quét mã QR để thanh toán</Text>
           <View style={styles.qrContainer}>
-            {paymentData && (
-              <QRCode
-                value={paymentData.qr_code}
-                size={240}
-                backgroundColor="white"
-                color="black"
+            {/* Rendered and cached server-side; re-opening revalidates via ETag */}
+            {paymentData && authToken && (
+              <Image
+                source={{
+                  uri: `${API_URL}/api/payments/${paymentData.payment_id}/qr?format=png`,
+                  headers: { Authorization: `Bearer ${authToken}` },
+                }}
+                style={styles.qrImage}
+                resizeMode="contain"
               />
             )}
           </View>
@@ -389,6 +430,10 @@ const styles = StyleSheet.create({
     borderWidth: 1,
     borderColor: '#E8EAED',
   },
+  qrImage: {
+    width: 240,
+    height: 240,
+  },
   qrHint: {
     fontSize: 14,
     color: '#7F8C8D',
@@ -0,0 +1,4 @@
+// Keys for the backend's Idempotency-Key header: reuse one key for every
+// retry of the same submission so the server replays the first response.
+export const newIdempotencyKey = () =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# The backend modules import each other as top-level names (see backend/server.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Handlers run on the in-memory storage engine; no MongoDB is needed
+os.environ.setdefault("STORAGE_ENGINE", "memory")
+os.environ.setdefault("INDEX_MODE", "off")
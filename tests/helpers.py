@@ -0,0 +1,40 @@
+"""Shared setup for handler tests on the memory storage engine"""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import server
+
+# One loop for the session, as in the server: Motor clients and asyncio
+# primitives stay bound to the loop they first ran on
+loop = asyncio.new_event_loop()
+
+def run(coroutine):
+    return loop.run_until_complete(coroutine)
+
+def make_user(role: str, **extra) -> dict:
+    user = {
+        "_id": str(uuid.uuid4()),
+        "email": f"{role}_{uuid.uuid4().hex[:8]}@test.vn",
+        "full_name": f"Test {role}",
+        "phone": "0900000000",
+        "role": role,
+        "created_at": datetime.utcnow(),
+        **extra
+    }
+    run(server.storage.users.insert(user))
+    return user
+
+def future_day(days: int = 3) -> str:
+    return (datetime.utcnow().date() + timedelta(days=days)).isoformat()
+
+def book(doctor: dict, patient: dict, day: str, time_value: str) -> dict:
+    return run(server.book_appointment(server.AppointmentCreate(
+        doctor_id=doctor["_id"], appointment_date=day, appointment_time=time_value
+    ), patient))["appointment"]
+
+def open_payment(appointment: dict, patient: dict, amount: float = 500000.0) -> dict:
+    return run(server.open_payment(server.PaymentRequest(
+        appointment_id=appointment["_id"], amount=amount, gateway="vnpay"
+    ), patient))
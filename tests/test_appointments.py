@@ -0,0 +1,102 @@
+import asyncio
+import uuid
+from datetime import date, datetime, time
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.helpers import book, future_day, make_user, run
+
+def test_booked_slot_cannot_be_booked_twice():
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    book(doctor, patient, future_day(), "09:00")
+    with pytest.raises(HTTPException) as error:
+        book(doctor, patient, future_day(), "09:00")
+    assert error.value.status_code == 409
+
+def test_concurrent_bookings_reserve_slot_once():
+    doctor = make_user("doctor", specialization="Nội khoa")
+    patients = [make_user("patient") for _ in range(5)]
+    async def race():
+        return await asyncio.gather(*[
+            server.book_appointment(server.AppointmentCreate(
+                doctor_id=doctor["_id"], appointment_date=future_day(), appointment_time="15:30"
+            ), patient)
+            for patient in patients
+        ], return_exceptions=True)
+    results = run(race())
+    assert sum(not isinstance(result, Exception) for result in results) == 1
+    assert {result.status_code for result in results if isinstance(result, HTTPException)} == {409}
+
+def test_cancel_releases_slot():
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    appointment = book(doctor, patient, future_day(), "10:00")
+    run(server.cancel_appointment(appointment["_id"], version=None, current_user=patient))
+    book(doctor, patient, future_day(), "10:00")
+
+def test_reschedule_moves_slot():
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    appointment = book(doctor, patient, future_day(), "11:00")
+    run(server.update_appointment(
+        appointment["_id"], server.AppointmentUpdate(appointment_time="14:00"), current_user=patient
+    ))
+    book(doctor, patient, future_day(), "11:00")
+    with pytest.raises(HTTPException) as error:
+        book(doctor, patient, future_day(), "14:00")
+    assert error.value.status_code == 409
+
+def test_cancelled_appointment_cannot_be_rescheduled():
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    appointment = book(doctor, patient, future_day(), "08:00")
+    run(server.cancel_appointment(appointment["_id"], version=None, current_user=patient))
+    with pytest.raises(HTTPException) as error:
+        run(server.update_appointment(
+            appointment["_id"], server.AppointmentUpdate(appointment_time="15:00"), current_user=patient
+        ))
+    assert error.value.status_code == 409
+    # The requested slot was never taken by the dead appointment
+    book(doctor, patient, future_day(), "15:00")
+
+def at_clinic(monkeypatch, hour, minute):
+    now = datetime.combine(datetime.utcnow().date(), time(hour, minute))
+    monkeypatch.setattr(server, "clinic_now", lambda: now)
+    return now
+
+def test_search_skips_slots_already_started_today(monkeypatch):
+    now = at_clinic(monkeypatch, 10, 0)
+    specialization = f"Khoa {uuid.uuid4().hex[:6]}"
+    make_user("doctor", specialization=specialization)
+    results = run(server.search_availability(
+        specialization, date_from=now.date().isoformat(), date_to=None, limit=2
+    ))
+    assert results[0]["slots"] == [
+        {"date": now.date().isoformat(), "time": "10:30"},
+        {"date": now.date().isoformat(), "time": "11:00"},
+    ]
+
+def test_slot_that_already_started_today_cannot_be_booked(monkeypatch):
+    now = at_clinic(monkeypatch, 10, 0)
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    for time_value in ("08:00", "10:00"):
+        with pytest.raises(HTTPException) as error:
+            book(doctor, patient, now.date().isoformat(), time_value)
+        assert error.value.status_code == 400
+    book(doctor, patient, now.date().isoformat(), "10:30")
+
+def test_failed_insert_does_not_occupy_slot(monkeypatch):
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    async def crash(document):
+        raise RuntimeError("connection reset")
+    with monkeypatch.context() as patch:
+        patch.setattr(server.storage.appointments, "insert", crash)
+        with pytest.raises(RuntimeError):
+            book(doctor, patient, future_day(), "16:00")
+    assert run(server.storage.doctor_schedules.get(f"{doctor['_id']}:{future_day()}")) is None
+    book(doctor, patient, future_day(), "16:00")
+
+def test_stale_slot_bit_does_not_block_booking():
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    run(server.reserve_slot(doctor["_id"], date.fromisoformat(future_day()), 2))
+    appointment = book(doctor, patient, future_day(), "09:00")
+    assert appointment["slot_index"] == 2
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+import server
+from tests.helpers import book, future_day, make_user, run
+
+def message(appointment: dict, sender: dict, timestamp: datetime) -> dict:
+    return {
+        "_id": f"m-{timestamp.timestamp()}",
+        "message": "Chào bác sĩ",
+        "timestamp": timestamp,
+        "sender_id": sender["_id"],
+        "sender_name": sender["full_name"]
+    }
+
+def test_summary_records_where_live_counting_started():
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    appointment = book(doctor, patient, future_day(), "13:00")
+    first = datetime.utcnow()
+    run(server.update_conversation_summary(appointment, message(appointment, patient, first)))
+    run(server.update_conversation_summary(
+        appointment, message(appointment, doctor, first + timedelta(seconds=5))
+    ))
+    summary = run(server.storage.conversations.get(appointment["_id"]))
+    assert summary["counted_from"] == first
+    assert summary["message_count"] == 2
+    assert summary["unread"] == {doctor["_id"]: 1, patient["_id"]: 1}
@@ -0,0 +1,69 @@
+import pytest
+
+import gateways
+
+SECRET = "test-secret"
+
+CALLBACKS = {
+    "vnpay": {
+        "vnp_TxnRef": "pay-1", "vnp_TransactionNo": "14000001", "vnp_Amount": "50000000",
+        "vnp_ResponseCode": "00", "vnp_TransactionStatus": "00", "vnp_OrderInfo": "Thanh toán lịch khám"
+    },
+    "momo": {
+        "partnerCode": "MOMO", "orderId": "pay-1", "requestId": "req-1", "amount": 500000,
+        "orderInfo": "Thanh toán lịch khám", "orderType": "momo_wallet", "transId": 14000001,
+        "resultCode": 0, "message": "Successful.", "payType": "qr", "responseTime": 1700000000000,
+        "extraData": "", "accessKey": "key"
+    },
+    "zalopay": {"app_trans_id": "pay-1", "zp_trans_id": 14000001, "amount": 500000},
+}
+
+@pytest.mark.parametrize("gateway", sorted(CALLBACKS))
+def test_signed_callback_is_parsed(gateway):
+    notification = gateways.parse_notification(
+        gateway, gateways.sign(gateway, CALLBACKS[gateway], SECRET), SECRET
+    )
+    assert notification._replace(notification_id="") == gateways.GatewayNotification(
+        gateway=gateway, transaction_id="14000001", payment_id="pay-1", amount=500000.0,
+        success=True, notification_id=""
+    )
+    assert notification.notification_id.startswith("pay-1:")
+
+@pytest.mark.parametrize("gateway", sorted(CALLBACKS))
+def test_wrong_secret_is_rejected(gateway):
+    payload = gateways.sign(gateway, CALLBACKS[gateway], "other-secret")
+    with pytest.raises(gateways.GatewayError, match="Invalid signature"):
+        gateways.parse_notification(gateway, payload, SECRET)
+
+def test_tampered_amount_is_rejected():
+    payload = gateways.sign("vnpay", CALLBACKS["vnpay"], SECRET)
+    payload["vnp_Amount"] = "100"
+    with pytest.raises(gateways.GatewayError, match="Invalid signature"):
+        gateways.parse_notification("vnpay", payload, SECRET)
+
+def test_failed_payment_is_reported_unsuccessful():
+    payload = gateways.sign("vnpay", {**CALLBACKS["vnpay"], "vnp_ResponseCode": "24"}, SECRET)
+    assert not gateways.parse_notification("vnpay", payload, SECRET).success
+
+def test_malformed_or_unconfigured_callbacks_are_rejected():
+    with pytest.raises(gateways.GatewayError, match="Malformed"):
+        gateways.parse_notification("momo", {"signature": "x"}, SECRET)
+    with pytest.raises(gateways.GatewayError, match="No secret"):
+        gateways.parse_notification("vnpay", CALLBACKS["vnpay"], None)
+
+def vnpay_failure(pay_date):
+    callback = {**CALLBACKS["vnpay"], "vnp_TransactionNo": "0", "vnp_ResponseCode": "24",
+                "vnp_TransactionStatus": "02", "vnp_PayDate": pay_date}
+    return gateways.parse_notification("vnpay", gateways.sign("vnpay", callback, SECRET), SECRET)
+
+def test_failed_vnpay_attempts_are_not_duplicates():
+    # VNPay reports TransactionNo "0" for every failed or cancelled attempt
+    first, second = vnpay_failure("20300101080000"), vnpay_failure("20300101081500")
+    assert first.notification_id != second.notification_id
+    assert vnpay_failure("20300101080000").notification_id == first.notification_id
+
+def test_failure_and_success_of_one_transaction_are_distinct():
+    failed = gateways.sign("vnpay", {**CALLBACKS["vnpay"], "vnp_ResponseCode": "24"}, SECRET)
+    succeeded = gateways.sign("vnpay", CALLBACKS["vnpay"], SECRET)
+    assert (gateways.parse_notification("vnpay", failed, SECRET).notification_id
+            != gateways.parse_notification("vnpay", succeeded, SECRET).notification_id)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.helpers import make_user, run
+
+def counted(result):
+    """An operation returning `result` that records how often it ran"""
+    calls = []
+    async def operation():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return result
+    return operation, calls
+
+def test_retry_replays_the_stored_response():
+    user = make_user("patient")
+    operation, calls = counted({"payment_id": "pay-1"})
+    first = run(server.run_idempotent("key-1", "payments", user, {"amount": 1}, operation))
+    server.idempotency_cache.clear()  # as if the retry reached another worker
+    replay = run(server.run_idempotent("key-1", "payments", user, {"amount": 1}, operation))
+    assert first == {"payment_id": "pay-1"}
+    assert len(calls) == 1
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert json.loads(replay.body) == {"payment_id": "pay-1"}
+
+def test_concurrent_duplicates_run_once():
+    user = make_user("patient")
+    operation, calls = counted({"ok": True})
+    async def twice():
+        return await asyncio.gather(*[
+            server.run_idempotent("key-2", "payments", user, {"amount": 1}, operation)
+            for _ in range(2)
+        ])
+    run(twice())
+    assert len(calls) == 1
+
+def test_reused_key_with_another_request_is_rejected():
+    user = make_user("patient")
+    operation, _ = counted({"ok": True})
+    run(server.run_idempotent("key-3", "payments", user, {"amount": 1}, operation))
+    with pytest.raises(HTTPException) as raised:
+        run(server.run_idempotent("key-3", "payments", user, {"amount": 2}, operation))
+    assert raised.value.status_code == 422
+
+def test_client_errors_are_replayed_and_server_errors_retried():
+    user = make_user("patient")
+    async def rejected():
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    with pytest.raises(HTTPException):
+        run(server.run_idempotent("key-4", "payments", user, {}, rejected))
+    assert run(server.run_idempotent("key-4", "payments", user, {}, rejected)).status_code == 404
+
+    async def failing():
+        raise HTTPException(status_code=503, detail="Gateway unavailable")
+    with pytest.raises(HTTPException):
+        run(server.run_idempotent("key-5", "payments", user, {}, failing))
+    operation, calls = counted({"ok": True})
+    assert run(server.run_idempotent("key-5", "payments", user, {}, operation)) == {"ok": True}
+    assert len(calls) == 1
@@ -0,0 +1,75 @@
+import server
+from tests.helpers import run
+
+class FakeCollection:
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.created = []
+
+    async def index_information(self):
+        return self.indexes
+
+    async def create_indexes(self, models):
+        self.created += [model.document["name"] for model in models]
+
+class FakeDatabase:
+    """Every required index present, except for the overrides"""
+
+    def __init__(self, overrides):
+        self.collections = {}
+        for collection, models in server.REQUIRED_INDEXES.items():
+            indexes = {"_id_": {"key": [("_id", 1)]}}
+            for model in models:
+                spec = dict(model.document)
+                indexes[spec.pop("name")] = {**spec, "key": list(spec["key"].items())}
+            indexes.update(overrides.get(collection, {}))
+            self.collections[collection] = FakeCollection(indexes)
+        self.commands = []
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+    async def command(self, command, *args, **kwargs):
+        self.commands.append(command)
+        if command == "explain":
+            plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+            if "aggregate" in args[0]:
+                return {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": plan}}}]}
+            return {"queryPlanner": {"winningPlan": plan}}
+        return {"ok": 1}
+
+def test_required_indexes_are_all_present():
+    assert run(server.ensure_indexes(FakeDatabase({}), mode="verify")) == {}
+
+def test_index_with_the_right_keys_but_wrong_options_is_reported():
+    database = FakeDatabase({"appointments": {
+        "slot_key_unique": {"key": [("slot_key", 1)]}  # built without unique/partial
+    }})
+    for mode in ("verify", "create"):
+        assert run(server.ensure_indexes(database, mode=mode)) == {
+            "appointments": ["slot_key_unique (options differ)"]
+        }
+    assert database["appointments"].created == []
+
+def test_changed_ttl_is_fixed_in_place():
+    database = FakeDatabase({"idempotency_keys": {
+        "expires_ttl": {"key": [("expires_at", 1)], "expireAfterSeconds": 3600}
+    }})
+    assert run(server.ensure_indexes(database, mode="create")) == {}
+    assert database.commands == [{"collMod": "idempotency_keys", "index": {
+        "name": "expires_ttl", "expireAfterSeconds": 0
+    }}]
+
+def test_missing_index_is_created():
+    database = FakeDatabase({})
+    del database["payments"].indexes["status_expires_at"]
+    assert run(server.ensure_indexes(database, mode="create")) == {}
+    assert database["payments"].created == ["status_expires_at"]
+
+def test_query_shapes_cover_background_jobs_and_aggregations():
+    covered = {shape["collection"] for shape in server.QUERY_SHAPES}
+    assert {"doctor_schedules", "payment_notifications", "conversations", "payments"} <= covered
+    assert any("pipeline" in shape for shape in server.QUERY_SHAPES)
+    report = run(server.explain_query_shapes(FakeDatabase({})))
+    assert len(report) == len(server.QUERY_SHAPES)
+    assert all(row["supported"] for row in report)
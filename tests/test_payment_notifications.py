@@ -0,0 +1,145 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+import pytest
+from starlette.requests import Request
+
+import gateways
+import server
+from tests.helpers import book, future_day, make_user, open_payment, run
+
+@pytest.fixture
+def pushed(monkeypatch):
+    """Payment status pushes as (payment_id, status)"""
+    events = []
+    async def notify(payment, status):
+        events.append((payment["_id"], status))
+    monkeypatch.setattr(server, "notify_payment_status", notify)
+    return events
+
+def new_payment() -> dict:
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    appointment = book(doctor, patient, future_day(), "09:00")
+    return open_payment(appointment, patient)
+
+def notification(payment: dict, success: bool, amount: float = 500000.0) -> dict:
+    transaction_id = uuid.uuid4().hex
+    return {
+        "_id": f"vnpay:{transaction_id}",
+        "payment_id": payment["payment_id"],
+        "transaction_id": transaction_id,
+        "amount": amount,
+        "success": success,
+        "status": "queued",
+        "received_at": datetime.utcnow()
+    }
+
+def test_success_marks_paid_and_notifies_once(pushed):
+    payment = new_payment()
+    result = run(server.apply_payment_notifications([notification(payment, True)]))
+    assert result == {"applied": 1}
+    assert pushed == [(payment["payment_id"], "paid")]
+    appointment = run(server.storage.appointments.get(payment["appointment_id"]))
+    assert appointment["payment_status"] == "paid"
+    assert appointment["status"] == "confirmed"
+
+def test_repeated_success_does_not_notify_again(pushed):
+    payment = new_payment()
+    run(server.apply_payment_notifications([notification(payment, True)]))
+    run(server.apply_payment_notifications([notification(payment, True)]))
+    assert pushed == [(payment["payment_id"], "paid")]
+
+def test_failure_after_paid_is_not_pushed(pushed):
+    payment = new_payment()
+    run(server.apply_payment_notifications([notification(payment, True)]))
+    run(server.apply_payment_notifications([notification(payment, False)]))
+    assert pushed == [(payment["payment_id"], "paid")]
+    assert run(server.storage.payments.get(payment["payment_id"]))["status"] == "paid"
+
+def test_failure_then_success_in_one_batch_pushes_final_status(pushed):
+    payment = new_payment()
+    run(server.apply_payment_notifications([
+        notification(payment, False), notification(payment, True)
+    ]))
+    assert pushed == [(payment["payment_id"], "paid")]
+
+def test_amount_mismatch_is_rejected(pushed):
+    payment = new_payment()
+    result = run(server.apply_payment_notifications([notification(payment, True, amount=1000.0)]))
+    assert result == {"amount_mismatch": 1}
+    assert pushed == []
+
+def test_requeue_takes_only_stale_records_once():
+    payment = new_payment()
+    stale = notification(payment, True)
+    stale["received_at"] = datetime.utcnow() - timedelta(seconds=server.WEBHOOK_REQUEUE_AFTER * 2)
+    fresh = notification(payment, True)
+    run(server.storage.payment_notifications.insert(stale))
+    run(server.storage.payment_notifications.insert(fresh))
+
+    async def requeue_twice():
+        server.payment_notifications = asyncio.Queue(maxsize=server.WEBHOOK_QUEUE_SIZE)
+        first = await server.requeue_payment_notifications()
+        second = await server.requeue_payment_notifications()
+        queued = [server.payment_notifications.get_nowait()["_id"]
+                  for _ in range(server.payment_notifications.qsize())]
+        return first, second, queued
+
+    first, second, queued = run(requeue_twice())
+    assert stale["_id"] in queued and fresh["_id"] not in queued
+    assert second == 0
+
+def test_expiry_skips_payments_paid_meanwhile(pushed, monkeypatch):
+    paid, pending = new_payment(), new_payment()
+    later = datetime.utcnow() + timedelta(hours=1)
+    find = server.storage.payments.find
+
+    async def find_then_pay(query, *args, **kwargs):
+        found = await find(query, *args, **kwargs)
+        if query.get("status") == "pending":
+            # The gateway confirms one of them while the sweep is running
+            await server.storage.payments.update_one(
+                {"_id": paid["payment_id"]}, {"$set": {"status": "paid"}}
+            )
+        return found
+
+    monkeypatch.setattr(server.storage.payments, "find", find_then_pay)
+    run(server.expire_pending_payments(later))
+    ours = {paid["payment_id"], pending["payment_id"]}
+    assert [event for event in pushed if event[0] in ours] == [(pending["payment_id"], "expired")]
+    assert run(server.storage.payments.get(paid["payment_id"]))["status"] == "paid"
+
+def test_confirm_settles_only_pending_payments(pushed):
+    doctor, patient = make_user("doctor", specialization="Nội khoa"), make_user("patient")
+    appointment = book(doctor, patient, future_day(), "10:30")
+    pending, expired = open_payment(appointment, patient), open_payment(appointment, patient)
+    run(server.storage.payments.update_one(
+        {"_id": expired["payment_id"]}, {"$set": {"status": "expired"}}
+    ))
+    run(server.confirm_payment(appointment["_id"], patient))
+    assert pushed == [(pending["payment_id"], "paid")]
+    assert run(server.storage.payments.get(expired["payment_id"]))["status"] == "expired"
+    run(server.confirm_payment(appointment["_id"], patient))
+    assert len(pushed) == 1
+
+def webhook(gateway: str, payload: dict):
+    request = Request({
+        "type": "http", "method": "GET", "headers": [],
+        "query_string": urlencode(payload).encode()
+    })
+    return run(server.payment_webhook(gateway, request))
+
+def test_repeated_vnpay_failures_are_each_recorded(monkeypatch):
+    monkeypatch.setitem(server.GATEWAY_SECRETS, "vnpay", "test-secret")
+    payment = new_payment()
+    def failure(pay_date):
+        return gateways.sign("vnpay", {
+            "vnp_TxnRef": payment["payment_id"], "vnp_TransactionNo": "0", "vnp_Amount": "50000000",
+            "vnp_ResponseCode": "24", "vnp_TransactionStatus": "02", "vnp_PayDate": pay_date
+        }, "test-secret")
+    for pay_date in ("20300101080000", "20300101081500", "20300101081500"):
+        assert webhook("vnpay", failure(pay_date)).status_code == 200
+    recorded = run(server.storage.payment_notifications.find({"payment_id": payment["payment_id"]}))
+    assert len(recorded) == 2
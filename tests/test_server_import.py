@@ -0,0 +1,39 @@
+import pytest
+import socketio
+from fastapi import HTTPException
+
+def test_server_imports():
+    import server
+
+    paths = {route.path for route in server.app.routes}
+    assert "/api/appointments" in paths
+    assert "/api/messages/{appointment_id}" in paths
+    assert server.storage.engine == "memory"
+
+def test_mongo_client_manager():
+    import socket_manager
+
+    assert socket_manager.create_client_manager(None, "mongodb://localhost:27017", "clinic_db") is None
+    manager = socket_manager.create_client_manager("mongo", "mongodb://localhost:27017", "clinic_db")
+    assert isinstance(manager, socket_manager.AsyncMongoManager)
+    assert isinstance(manager, socketio.AsyncManager)
+
+def test_user_writes_invalidate_cached_principal():
+    import server
+    from tests.helpers import make_user, run
+
+    user = make_user("doctor", specialization="Nội khoa")
+    token = server.create_access_token({"sub": user["_id"]})
+    principal = run(server.authenticate_token(token))
+    principal["role"] = "admin"  # handlers mutating current_user leave the cache intact
+    assert run(server.authenticate_token(token))["role"] == "doctor"
+
+    run(server.storage.users.update_one({"_id": user["_id"]}, {"$set": {"specialization": "Nhi khoa"}}))
+    assert run(server.authenticate_token(token))["specialization"] == "Nhi khoa"
+
+    run(server.storage.users.update_many({"role": "doctor"}, {"$set": {"available_hours": "09:00-12:00"}}))
+    assert run(server.authenticate_token(token))["available_hours"] == "09:00-12:00"
+
+    run(server.storage.users.delete_one({"_id": user["_id"]}))
+    with pytest.raises(HTTPException):
+        run(server.authenticate_token(token))
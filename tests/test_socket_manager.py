@@ -0,0 +1,69 @@
+import asyncio
+
+import socket_manager
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.alive = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.documents:
+            self.alive = False  # the server closed the tailable cursor
+            raise StopAsyncIteration
+        return dict(self.documents.pop(0))
+
+    async def close(self):
+        self.alive = False
+
+class FakeCollection:
+    """A capped collection whose cursors serve the prepared batches in turn"""
+
+    def __init__(self, existing, batches):
+        self.existing = existing
+        self.batches = list(batches)
+        self.queries = []
+
+    async def find_one(self, sort=None, projection=None):
+        return self.existing
+
+    def find(self, query, cursor_type=None):
+        self.queries.append(query)
+        return FakeCursor(self.batches.pop(0) if self.batches else [])
+
+def listen(collection, count):
+    manager = socket_manager.AsyncMongoManager("mongodb://localhost:27017", "clinic_db")
+    manager.collection = collection
+    async def collect():
+        manager._ready = asyncio.get_running_loop().create_future()
+        manager._ready.set_result(None)
+        events = []
+        async for message in manager._listen():
+            events.append(message["event"])
+            if len(events) == count:
+                return events
+    return asyncio.run(asyncio.wait_for(collect(), 5))
+
+def test_resume_keeps_events_with_lower_object_ids():
+    # Worker B's event arrives first; worker A's event, published slightly
+    # earlier by its clock, lands after the cursor was reopened
+    b = {"_id": "ffff", "ts": 101.0, "event": "b"}
+    a = {"_id": "0000", "ts": 100.5, "event": "a"}
+    collection = FakeCollection({"_id": "old", "ts": 100.0}, [[b], [b, a]])
+    assert listen(collection, 2) == ["b", "a"]
+    assert collection.queries[0] == {"ts": {"$gt": 100.0}}
+    assert collection.queries[1] == {"ts": {"$gte": 101.0 - 5.0}}
+
+def test_idle_listener_backs_off(monkeypatch):
+    collection = FakeCollection(None, [[], [], [], [{"_id": "x", "ts": 1.0, "event": "x"}]])
+    sleeps = []
+    original = asyncio.sleep
+    async def record(delay):
+        sleeps.append(delay)
+        await original(0)
+    monkeypatch.setattr(socket_manager.asyncio, "sleep", record)
+    assert listen(collection, 1) == ["x"]
+    assert sleeps == [0.1, 0.2, 0.4]
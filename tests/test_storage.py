@@ -0,0 +1,165 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel, MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from storage import create_storage
+from tests.helpers import run
+
+INDEXES = {
+    "appointments": [
+        IndexModel([("doctor_id", ASCENDING), ("starts_at", ASCENDING)]),
+        IndexModel([("slot_key", ASCENDING)], unique=True, name="slot_key_unique",
+                   partialFilterExpression={"slot_key": {"$exists": True}}),
+    ]
+}
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+def mongo_reachable() -> bool:
+    try:
+        MongoClient(MONGO_URL, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+@pytest.fixture(params=[
+    "memory",
+    pytest.param("mongo", marks=pytest.mark.skipif(not mongo_reachable(), reason="no MongoDB reachable")),
+])
+def storage(request):
+    """The repository contract, run against each engine available here"""
+    if request.param == "memory":
+        yield create_storage("memory", indexes=INDEXES)
+        return
+    name = f"storage_contract_{uuid.uuid4().hex[:8]}"
+    client = AsyncIOMotorClient(MONGO_URL)
+    for collection, models in INDEXES.items():
+        run(client[name][collection].create_indexes(models))
+    yield create_storage("mongo", client[name])
+    run(client.drop_database(name))
+    client.close()
+
+@pytest.fixture
+def appointments(storage):
+    return storage.appointments
+
+def seed(repository, count=5):
+    start = datetime(2030, 1, 1, 8)
+    for i in range(count):
+        run(repository.insert({
+            "_id": f"a{i}", "doctor_id": "d1" if i % 2 else "d2",
+            "starts_at": start + timedelta(hours=i), "status": "pending", "visits": i
+        }))
+
+def test_insert_get_and_projection(appointments):
+    seed(appointments)
+    assert run(appointments.get("a1"))["doctor_id"] == "d1"
+    assert run(appointments.get("a1", projection={"status": 1})) == {"_id": "a1", "status": "pending"}
+    assert "visits" not in run(appointments.get("a1", projection={"visits": 0}))
+    assert run(appointments.get("missing")) is None
+
+def test_duplicate_id_and_unique_index(appointments):
+    seed(appointments, 1)
+    with pytest.raises(DuplicateKeyError):
+        run(appointments.insert({"_id": "a0"}))
+    run(appointments.insert({"_id": "b1", "slot_key": "d1:2030-01-01:0"}))
+    with pytest.raises(DuplicateKeyError):
+        run(appointments.insert({"_id": "b2", "slot_key": "d1:2030-01-01:0"}))
+    # The partial index leaves documents without a slot_key alone
+    run(appointments.insert({"_id": "b3"}))
+
+def test_find_ranges_sort_and_limit(appointments):
+    seed(appointments)
+    found = run(appointments.find(
+        {"doctor_id": "d2", "starts_at": {"$gte": datetime(2030, 1, 1, 9)}},
+        sort=[("starts_at", -1)], limit=1
+    ))
+    assert [document["_id"] for document in found] == ["a4"]
+    assert run(appointments.count({"doctor_id": "d1"})) == 2
+    assert run(appointments.count()) == 5
+
+def test_find_one_honours_sort(appointments):
+    seed(appointments)
+    assert run(appointments.find_one({"status": "pending"}, sort=[("visits", -1)]))["_id"] == "a4"
+    assert run(appointments.find_one({"status": "pending"}, sort=[("visits", 1)]))["_id"] == "a0"
+
+def test_update_one_reports_match_and_upserts(appointments):
+    seed(appointments, 1)
+    assert run(appointments.update_one({"_id": "a0", "status": "pending"},
+                                       {"$set": {"status": "confirmed"}}))
+    assert not run(appointments.update_one({"_id": "a0", "status": "pending"},
+                                           {"$set": {"status": "cancelled"}}))
+    assert run(appointments.update_one({"_id": "u1"}, {"$setOnInsert": {"status": "pending"}},
+                                       upsert=True))
+    assert run(appointments.get("u1")) == {"_id": "u1", "status": "pending"}
+
+def test_update_many_counts_modified_documents(appointments):
+    seed(appointments)
+    run(appointments.update_one({"_id": "a0"}, {"$set": {"status": "confirmed"}}))
+    # a0 matches but is already confirmed, as in Mongo's modified_count
+    assert run(appointments.update_many({}, {"$set": {"status": "confirmed"}})) == 4
+    assert run(appointments.update_many({}, {"$set": {"status": "confirmed"}})) == 0
+
+def test_find_one_and_update_returns_before_or_after(appointments):
+    seed(appointments, 1)
+    before = run(appointments.find_one_and_update({"_id": "a0"}, {"$inc": {"visits": 1}}))
+    after = run(appointments.find_one_and_update({"_id": "a0"}, {"$inc": {"visits": 1}},
+                                                 return_after=True))
+    assert (before["visits"], after["visits"]) == (0, 2)
+    assert run(appointments.find_one_and_update({"_id": "nope"}, {"$set": {"x": 1}})) is None
+    created = run(appointments.find_one_and_update({"_id": "u1"}, {"$set": {"x": 1}},
+                                                   return_after=True, upsert=True))
+    assert created == {"_id": "u1", "x": 1}
+
+def test_delete_one(appointments):
+    seed(appointments, 2)
+    assert run(appointments.delete_one({"doctor_id": "d1"}))
+    assert not run(appointments.delete_one({"doctor_id": "d1"}))
+    assert run(appointments.find({"doctor_id": "d1"})) == []
+
+def test_bulk_update_applies_the_rest_after_a_conflict(appointments):
+    seed(appointments, 3)
+    with pytest.raises(BulkWriteError) as raised:
+        run(appointments.bulk_update([
+            ({"_id": "a0"}, {"$set": {"slot_key": "k"}}),
+            ({"_id": "a1"}, {"$set": {"slot_key": "k"}}),
+            ({"_id": "a2"}, {"$set": {"status": "confirmed"}}),
+        ]))
+    assert [error["index"] for error in raised.value.details["writeErrors"]] == [1]
+    assert "slot_key" not in run(appointments.get("a1"))
+    assert run(appointments.get("a2"))["status"] == "confirmed"
+
+def test_bit_updates_reserve_each_slot_once(storage):
+    schedules = storage.doctor_schedules
+    def reserve(index):
+        return run(schedules.update_one(
+            {"_id": "d1:2030-01-01", "occupied": {"$bitsAllClear": 1 << index}},
+            {"$bit": {"occupied": {"or": 1 << index}}}
+        ))
+    run(schedules.insert({"_id": "d1:2030-01-01", "occupied": 0}))
+    assert reserve(3) and reserve(4)
+    assert not reserve(3)
+    assert run(schedules.get("d1:2030-01-01"))["occupied"] == 0b11000
+
+def test_with_conversations_joins_summaries(storage):
+    created = datetime(2030, 1, 1)
+    for i, status in enumerate(["pending", "confirmed", "pending"]):
+        run(storage.appointments.insert({
+            "_id": f"c{i}", "doctor_id": "d1", "patient_name": f"Bệnh nhân {i}",
+            "status": status, "created_at": created + timedelta(minutes=i), "notes": "x"
+        }))
+    run(storage.conversations.insert({
+        "_id": "c0", "last_message": {"message": "Chào bác sĩ"}, "unread": {"d1": 2}
+    }))
+    chats = run(storage.appointments.with_conversations({"doctor_id": "d1"}, 10))
+    # c2 has neither messages nor a confirmed status; newest first
+    assert chats == [
+        {"_id": "c1", "patient_name": "Bệnh nhân 1", "status": "confirmed"},
+        {"_id": "c0", "patient_name": "Bệnh nhân 0", "status": "pending",
+         "last_message": {"message": "Chào bác sĩ"}, "unread": {"d1": 2}},
+    ]